@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Breaks a fleet's time-to-serving down into boot phases.
+
+Reads the BOOT-PHASE markers that the startup scripts print, for every
+instance named PREFIX-N in the zone (or for --instances). It draws a
+waterfall per instance and ranks the phases by mean duration:
+
+    python bench/boot_phases.py --prefix flask-clone
+    python bench/boot_phases.py --instances flask-tutorial-instance --source guest
+
+With --fake it creates --count instances on the fake API, which prints
+markers on the schedule given by --phases, and reads those instead.
+"""
+
+import argparse
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import ratelimit
+from common.boottrace import BootCollector
+from common.client import get_compute
+from common.fake_compute import FakeCompute
+from common.fleet import list_all
+from common.operations import wait_for_operations
+from common.spec import InstanceSpec
+from common.startup import BOOT_METADATA
+from part1.part1 import ZONE, project
+
+# Marker: seconds after RUNNING, shaped like a cold STARTUP_SCRIPT boot
+FAKE_PHASES = 'packages:4,clone:9,install:10,init-db:16,start:17,serving:18'
+
+
+def fake_fleet(count, phases, prefix):
+    """Creates `count` instances on a fake that prints markers at `phases`; returns (fake, names)."""
+    schedule = [(marker, float(seconds)) for marker, seconds in (item.split(':') for item in phases.split(','))]
+    fake = FakeCompute(latency=2.0, jitter=2.0, boot_phases=schedule)
+    spec = InstanceSpec(metadata=dict(BOOT_METADATA))
+    names = [f'{prefix}-{i}' for i in range(1, count + 1)]
+    operations = [fake.instances().insert(project=project, zone=ZONE, body=spec.body(name, ZONE)).execute()
+                  for name in names]
+    wait_for_operations(fake, project, operations, log=lambda *_: None)
+    return fake, names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--zone', default=ZONE)
+    parser.add_argument('--prefix', default='flask-clone', help='read every instance named PREFIX-N')
+    parser.add_argument('--instances', help='comma-separated instance names, instead of --prefix')
+    parser.add_argument('--source', choices=['serial', 'guest'], default='serial',
+                        help='read markers from the serial console or from boot/ guest attributes')
+    parser.add_argument('--interval', type=float, default=5, help='seconds between polls')
+    parser.add_argument('--deadline', type=float, default=900, help="seconds to wait for every 'serving' marker")
+    parser.add_argument('--fake', action='store_true', help='create instances on the fake API and read theirs')
+    parser.add_argument('--count', type=int, default=5, help='with --fake, instances to create')
+    parser.add_argument('--phases', default=FAKE_PHASES,
+                        help="with --fake, 'marker:seconds after RUNNING,...' printed by each boot")
+    ratelimit.add_arguments(parser)
+    args = parser.parse_args()
+    ratelimit.configure(args)
+
+    if args.fake:
+        compute, names = fake_fleet(args.count, args.phases, args.prefix)
+        interval = min(args.interval, 1)
+    else:
+        compute = get_compute()
+        if args.instances:
+            names = args.instances.split(',')
+        else:
+            pattern = re.compile(rf'{re.escape(args.prefix)}-\d+$')
+            names = [i['name'] for i in list_all(compute.instances(), project=project, zone=args.zone)
+                     if pattern.match(i['name'])]
+        interval = args.interval
+    if not names:
+        parser.error(f'no instances named {args.prefix}-N in {args.zone}')
+
+    print(f"Reading boot phases of {len(names)} instances from {args.source}...")
+    collector = BootCollector(compute, project, args.zone, names, args.source)
+    collector.collect(interval, args.deadline)
+    print('\n'.join(collector.report()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Counts HTTP round trips for fleet list/describe/stop/delete, one-by-one vs batched.
+
+Runs entirely against the local fake Compute API:
+
+    python bench/fleet_round_trips.py --instances 300
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import fleet
+from common.fake_compute import FakeCompute
+from common.operations import wait_for_operations
+
+PROJECT = 'bench-project'
+ZONE = 'us-west1-b'
+
+
+def seeded_fake(count, latency):
+    fake = FakeCompute(latency=latency)
+    for i in range(1, count + 1):
+        fake.add_instance(PROJECT, ZONE, f'flask-clone-{i}')
+    return fake
+
+
+def one_by_one(fake, names, page_size):
+    """The pre-batching pattern: first page only, then one request per instance."""
+    costs = {}
+    start = fake.round_trips
+    listed = fake.instances().list(project=PROJECT, zone=ZONE, maxResults=page_size).execute()
+    costs['list'] = (fake.round_trips - start, len(listed.get('items', [])))
+
+    for label, method in (('get', 'get'), ('stop', 'stop'), ('delete', 'delete')):
+        start = fake.round_trips
+        operations = [getattr(fake.instances(), method)(project=PROJECT, zone=ZONE, instance=name).execute()
+                      for name in names]
+        if method != 'get':
+            wait_for_operations(fake, PROJECT, operations, batch=False, log=lambda *_: None)
+        costs[label] = (fake.round_trips - start, len(operations))
+    return costs
+
+
+def batched(fake, names, page_size):
+    """Paginated listing plus batch HTTP requests and one shared operation waiter."""
+    costs = {}
+    start = fake.round_trips
+    listed = fleet.list_all(fake.instances(), project=PROJECT, zone=ZONE, maxResults=page_size)
+    costs['list'] = (fake.round_trips - start, len(listed))
+
+    start = fake.round_trips
+    instances = fleet.get_instances(fake, PROJECT, ZONE, names)
+    costs['get'] = (fake.round_trips - start, len(instances))
+
+    for label, action in (('stop', fleet.stop_instances), ('delete', fleet.delete_instances)):
+        start = fake.round_trips
+        operations = action(fake, PROJECT, ZONE, names)
+        wait_for_operations(fake, PROJECT, operations.values(), log=lambda *_: None)
+        costs[label] = (fake.round_trips - start, len(operations))
+    return costs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--instances', type=int, default=300, help='fleet size')
+    parser.add_argument('--page-size', type=int, default=100, help='maxResults per list page')
+    parser.add_argument('--op-latency', type=float, default=0.5, help='seconds each stop/delete operation runs')
+    args = parser.parse_args()
+
+    names = [f'flask-clone-{i}' for i in range(1, args.instances + 1)]
+    naive = one_by_one(seeded_fake(args.instances, args.op_latency), names, args.page_size)
+    batch = batched(seeded_fake(args.instances, args.op_latency), names, args.page_size)
+
+    print(f"Fleet of {args.instances} instances, {args.page_size} per list page, "
+          f"{args.op_latency}s operations (stop/delete include polling until DONE)\n")
+    print("| step | one-by-one round trips | items | batched round trips | items |")
+    print("|------|------------------------|-------|---------------------|-------|")
+    for step in ('list', 'get', 'stop', 'delete'):
+        print(f"| {step} | {naive[step][0]} | {naive[step][1]} | {batch[step][0]} | {batch[step][1]} |")
+    total_naive = sum(trips for trips, _ in naive.values())
+    total_batch = sum(trips for trips, _ in batch.values())
+    print(f"| total | {total_naive} | | {total_batch} | |")
+
+
+if __name__ == '__main__':
+    main()
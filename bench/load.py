@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Load-tests the flask app on every clone tagged allow-5000.
+
+The clones are found with one aggregated list call (or one zone's list with
+--zone). A mix of requests is then driven at them for --duration seconds:
+- closed loop (--concurrency N): N requests always outstanding;
+- open loop (--rate R): R arrivals per second, however fast the clones answer.
+
+Requests are spread round-robin or to the least-latency clone. With --stubs
+everything runs locally: one HTTP stub per fake clone, each answering after
+the matching --stub-delay, discovered through the fake Compute API:
+
+    python bench/load.py --stubs 3 --stub-delay 0.002,0.002,0.02 --balancer least-latency
+    python bench/load.py --rate 200 --duration 30
+"""
+
+import argparse
+import asyncio
+import dataclasses
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import loadgen, ratelimit
+from common.client import get_compute
+from common.fake_compute import FakeCompute
+from part1.part1 import project
+
+STUB_ZONE = 'us-west1-b'
+
+
+class Stub:
+    """A local HTTP server standing in for one clone's app, answering 200 after `delay` seconds."""
+
+    def __init__(self, delay):
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Send headers and body in one segment, or delayed ACKs add ~40ms per response
+            disable_nagle_algorithm = True
+            wbufsize = -1
+
+            def _answer(self):
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                time.sleep(delay)
+                body = b'ok\n'
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = _answer
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+def stub_targets(delays):
+    """Starts one stub per delay, registers a matching fake clone, and discovers them like real clones."""
+    fake = FakeCompute(nat_ip='127.0.0.1')
+    ports = {}
+    for i, delay in enumerate(delays, 1):
+        name = f'flask-clone-{i}'
+        fake.add_instance(project, STUB_ZONE, name, tags={'items': [loadgen.TAG]},
+                          networkInterfaces=[{'accessConfigs': [{'type': 'ONE_TO_ONE_NAT'}]}])
+        ports[name] = Stub(delay).port
+    return [dataclasses.replace(target, port=ports[target.name])
+            for target in loadgen.discover_targets(fake, project, STUB_ZONE)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--zone', help='only load clones in this zone (default: every zone)')
+    parser.add_argument('--mix', default=loadgen.DEFAULT_MIX,
+                        help="weighted requests, e.g. 'GET /:8,GET /auth/login:1'")
+    parser.add_argument('--balancer', choices=list(loadgen.BALANCERS), default='round-robin')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--concurrency', type=int, default=16, help='closed loop: requests kept outstanding')
+    mode.add_argument('--rate', type=float, help='open loop: request arrivals per second')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to send load for')
+    parser.add_argument('--timeout', type=float, default=loadgen.TIMEOUT, help='seconds per request')
+    parser.add_argument('--stubs', type=int, help='run against this many local HTTP stubs instead of the fleet')
+    parser.add_argument('--stub-delay', default='0.005',
+                        help='comma-separated seconds each stub takes to answer; the last one repeats')
+    ratelimit.add_arguments(parser)
+    args = parser.parse_args()
+    ratelimit.configure(args)
+
+    if args.stubs:
+        delays = [float(d) for d in args.stub_delay.split(',')]
+        targets = stub_targets([delays[min(i, len(delays) - 1)] for i in range(args.stubs)])
+    else:
+        targets = loadgen.discover_targets(get_compute(), project, args.zone)
+    print(f"Loading {len(targets)} clones: {', '.join(f'{t.name} ({t.host}:{t.port})' for t in targets)}")
+
+    generator = loadgen.LoadGenerator(targets, args.mix, args.balancer, args.timeout)
+    if args.rate:
+        print(f"Open loop: {args.rate:g} arrivals/s for {args.duration:g}s, {args.balancer}")
+        asyncio.run(generator.open_loop(args.rate, args.duration))
+    else:
+        print(f"Closed loop: {args.concurrency} outstanding for {args.duration:g}s, {args.balancer}")
+        asyncio.run(generator.closed_loop(args.concurrency, args.duration))
+    print('\n'.join(generator.report()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""Benchmarks the part1, part2 and part3 provisioning flows end to end.
+
+Each flow runs at several concurrency levels and reports p50/p95/p99
+time-to-RUNNING and time-to-serving, API calls, round trips and wall-clock
+time, as a Markdown table and as JSON. By default everything runs against
+the local fake Compute API, with configurable operation latency, boot
+latency, transient error rate and instance quota. A small local HTTP
+server stands in for the flask app on each fake VM, answering 503 until
+that VM has been RUNNING for the boot latency:
+
+    python bench/provision.py --concurrency 1,4,16 --runs 3
+    python bench/provision.py --error-rate 0.02 --quota 10
+
+With --real the part1 and part2 flows create (and then delete) real VMs in
+the project and zone set in part1.py; part3 needs the VM-1 credentials file
+on a real VM-1 and only runs against the fake.
+
+What the numbers mean:
+  part1        `concurrency` independent part1 flows in parallel threads
+               (insert, wait for the operation, RUNNING, HTTP probe).
+  part2        snapshot the part1 disk, then `--clones` clones with part2's
+               run_clones (concurrency 1 = one after another, otherwise that
+               many workers). Times run from the start of the clone step, so
+               they show when each clone became usable after the fleet was
+               requested; clones are probed once the step returns.
+  part2-bulk   the same clones with one bulkInsert (concurrency is ignored).
+  part3        `concurrency` VM-1 -> VM-2 chains in parallel; the bench plays
+               VM-1's launcher once VM-1 has booted, and times run from the
+               VM-1 insert to VM-2 RUNNING / serving.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from common import ratelimit, readiness, tracing
+from common.fake_compute import FakeCompute
+from common.fleet import delete_instances, get_instances
+from common.operations import wait_for_operations
+from common.stats import summarize
+from part1 import part1
+from part2 import part2
+from part3 import part3
+
+FLOWS = ('part1', 'part2', 'part2-bulk', 'part3')
+
+
+class FakeApp:
+    """Local stand-in for the flask app on every fake VM, addressed as /<zone>/<instance>."""
+
+    def __init__(self, project):
+        self.project = project
+        self.fake = None
+        app = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                _, zone, name = self.path.split('/', 2)
+                self.send_response(200 if app.fake.is_serving(app.project, zone, name) else 503)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+class FakeBackend:
+    """Runs each scenario against a fresh FakeCompute, so counts and quota start from zero."""
+
+    real = False
+
+    def __init__(self, args):
+        self.args = args
+        self.project = part2.project
+        self.zone = part2.ZONE
+        self.app = FakeApp(self.project)
+        self.port = self.app.port
+        self.fake = None
+
+    def reset(self):
+        args = self.args
+        self.fake = FakeCompute(latency=args.op_latency, jitter=args.jitter, nat_ip='127.0.0.1',
+                                seed=args.seed, error_rate=args.error_rate, quota=args.quota,
+                                boot_latency=args.boot_latency)
+        self.fake.add_instance(self.project, self.zone, part2.INSTANCE_NAME)
+        self.app.fake = self.fake
+
+    def compute(self):
+        return self.fake
+
+    def path(self, name):
+        return f'/{self.zone}/{name}'
+
+    def counts(self):
+        return sum(self.fake.calls.values()), self.fake.round_trips
+
+    def wait_booted(self, name):
+        while not self.fake.is_serving(self.project, self.zone, name):
+            time.sleep(self.args.probe_interval)
+
+    def cleanup(self, names):
+        pass
+
+
+class RealBackend:
+    """Runs against real GCE with the default credentials; deletes the VMs it created."""
+
+    real = True
+    port = 5000
+
+    def __init__(self, args):
+        from common.client import get_compute
+        self.args = args
+        self.project = part1.project
+        self.zone = part1.ZONE
+        self.compute = get_compute
+
+    def reset(self):
+        pass
+
+    def path(self, name):
+        return '/'
+
+    def counts(self):
+        return None, None
+
+    def cleanup(self, names):
+        compute = self.compute()
+        existing = [name for name, instance in get_instances(compute, self.project, self.zone, names).items()
+                    if not isinstance(instance, Exception)]
+        operations = [op for op in delete_instances(compute, self.project, self.zone, existing).values()
+                      if not isinstance(op, Exception)]
+        wait_for_operations(compute, self.project, operations, raise_on_error=False)
+
+
+def failed(name, error):
+    return {'name': name, 'running': None, 'serving': None, 'error': f'{type(error).__name__}: {error}'}
+
+
+def in_parallel(count, flow):
+    """Runs flow(i) for i in range(count) on `count` threads; returns the samples in order."""
+    def guarded(i):
+        try:
+            return flow(i)
+        except Exception as e:
+            return failed(f'#{i}', e)
+    with ThreadPoolExecutor(max_workers=count) as pool:
+        return list(pool.map(guarded, range(count)))
+
+
+def serve_probe(backend, compute, name, operation=None):
+    """Runs the readiness pipeline for one VM; returns its phases."""
+    _, phases = readiness.wait_until_serving(
+        compute, backend.project, backend.zone, name, operation=operation, port=backend.port,
+        path=backend.path(name), probe_timeout=backend.args.probe_timeout,
+        probe_interval=backend.args.probe_interval, deadline=backend.args.deadline, log=lambda *_: None)
+    return phases
+
+
+def part1_flow(backend, concurrency, tag):
+    compute = backend.compute()
+    operation = part1.create_firewall_rule(compute, backend.project)
+    if operation:
+        wait_for_operations(compute, backend.project, [operation])
+
+    def flow(i):
+        name = f'bench-p1-{tag}-{i}'
+        compute = backend.compute()
+        start = time.monotonic()
+        try:
+            operation = part1.create_instance(compute, backend.project, backend.zone, name)
+            inserted = time.monotonic() - start
+            phases = serve_probe(backend, compute, name, operation)
+        except Exception as e:
+            return failed(name, e)
+        return {'name': name, 'running': inserted + phases['operation'] + phases['running'],
+                'serving': inserted + phases['total'], 'error': None}
+    return in_parallel(concurrency, flow)
+
+
+def part2_flow(backend, concurrency, tag, bulk=False):
+    args = backend.args
+    compute = backend.compute()
+    # An earlier run's snapshot of the same disk state is reused
+    snapshot_name = part2.create_snapshot(compute, backend.project, backend.zone, part2.INSTANCE_NAME,
+                                          part2.DISK_NAME)
+
+    names = part2.clone_names(args.clones, prefix=f'bench-p2-{tag}')
+    start = time.time()
+    error = None
+    try:
+        if bulk:
+            part2.create_bulk(compute, backend.project, backend.zone, len(names), names=names,
+                              spec=part2.snapshot_spec(snapshot_name))
+        else:
+            part2.run_clones(backend.compute, backend.project, backend.zone,
+                             lambda name: part2.snapshot_instance_config(backend.zone, name, snapshot_name),
+                             names, workers=concurrency if concurrency > 1 else 0)
+    except Exception as e:
+        error = e
+
+    # Which clones exist and when they started comes from the API, so it also
+    # covers clones created before a sequential run was cut short
+    instances = get_instances(compute, backend.project, backend.zone, names)
+
+    def probe(name):
+        instance = instances[name]
+        if isinstance(instance, Exception):
+            return failed(name, error or instance)
+        if not instance.get('lastStartTimestamp'):
+            return failed(name, error or RuntimeError(f"{name} is still {instance['status']}"))
+        running = datetime.fromisoformat(instance['lastStartTimestamp']).timestamp() - start
+        try:
+            serve_probe(backend, backend.compute(), name)
+        except Exception as e:
+            return failed(name, e)
+        return {'name': name, 'running': running, 'serving': time.time() - start, 'error': None}
+    with ThreadPoolExecutor(max_workers=len(names)) as pool:
+        return list(pool.map(probe, names))
+
+
+def part3_flow(backend, concurrency, tag):
+    if backend.real:
+        raise SystemExit("part3 needs service credentials on a real VM-1; run it against the fake")
+
+    def flow(i):
+        vm1, vm2 = f'bench-p3-vm1-{tag}-{i}', f'bench-p3-vm2-{tag}-{i}'
+        compute = backend.compute()
+        start = time.monotonic()
+        try:
+            part3.create_vm(compute, backend.project, backend.zone, vm1)
+            backend.wait_booted(vm1)    # VM-1's startup script installs the client libraries
+            part3.create_vm(compute, backend.project, backend.zone, vm2)
+            phases = serve_probe(backend, compute, vm2)
+        except Exception as e:
+            return failed(vm2, e)
+        now = time.monotonic()
+        return {'name': vm2, 'running': now - start - phases['serving'], 'serving': now - start, 'error': None}
+    return in_parallel(concurrency, flow)
+
+
+def run_scenario(backend, flow, concurrency, runs):
+    """Runs one flow `runs` times at one concurrency level and summarizes the pooled samples."""
+    samples, walls, calls, trips = [], [], [], []
+    for run in range(runs):
+        backend.reset()
+        calls_before, trips_before = backend.counts()
+        tag = f'c{concurrency}-r{run}'
+        start = time.monotonic()
+        with tracing.span('bench.scenario', flow=flow, concurrency=concurrency, run=run):
+            if flow == 'part1':
+                result = part1_flow(backend, concurrency, tag)
+            elif flow == 'part3':
+                result = part3_flow(backend, concurrency, tag)
+            else:
+                result = part2_flow(backend, concurrency, tag, bulk=flow == 'part2-bulk')
+        walls.append(time.monotonic() - start)
+        calls_after, trips_after = backend.counts()
+        if calls_after is not None:
+            calls.append(calls_after - calls_before)
+            trips.append(trips_after - trips_before)
+        backend.cleanup([sample['name'] for sample in result])
+        samples.extend(result)
+
+    errors = [sample['error'] for sample in samples if sample['error']]
+    return {
+        'flow': flow,
+        'concurrency': concurrency,
+        'runs': runs,
+        'vms': len(samples),
+        'ok': sum(1 for sample in samples if sample['serving'] is not None),
+        'errors': len(errors),
+        'error_examples': sorted(set(errors))[:3],
+        'time_to_running': summarize(s['running'] for s in samples if s['running'] is not None),
+        'time_to_serving': summarize(s['serving'] for s in samples if s['serving'] is not None),
+        'api_calls': sum(calls) / runs if calls else None,
+        'round_trips': sum(trips) / runs if trips else None,
+        'wall_time': sum(walls) / runs,
+    }
+
+
+def markdown_table(results):
+    def fmt(value):
+        return '-' if value is None else f'{value:.2f}'
+
+    def triple(summary):
+        return ' / '.join(fmt(summary[key]) for key in ('p50', 'p95', 'p99'))
+
+    lines = [
+        '| flow | concurrency | VMs | ok | errors | RUNNING p50 / p95 / p99 (s) '
+        '| serving p50 / p95 / p99 (s) | API calls / run | round trips / run | wall / run (s) |',
+        '|------|-------------|-----|----|--------|------------------------------'
+        '|------------------------------|-----------------|-------------------|----------------|',
+    ]
+    for r in results:
+        calls = '-' if r['api_calls'] is None else f"{r['api_calls']:.0f}"
+        trips = '-' if r['round_trips'] is None else f"{r['round_trips']:.0f}"
+        lines.append(f"| {r['flow']} | {r['concurrency']} | {r['vms']} | {r['ok']} | {r['errors']} "
+                     f"| {triple(r['time_to_running'])} | {triple(r['time_to_serving'])} "
+                     f"| {calls} | {trips} | {r['wall_time']:.2f} |")
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--flows', default=','.join(FLOWS), help=f'comma-separated subset of {", ".join(FLOWS)}')
+    parser.add_argument('--concurrency', default='1,4,16', help='comma-separated concurrency levels')
+    parser.add_argument('--runs', type=int, default=1, help='repetitions per flow and concurrency level')
+    parser.add_argument('--clones', type=int, default=8, help='clones per part2 run')
+    parser.add_argument('--op-latency', type=float, default=2.0, help='fake: seconds each operation runs')
+    parser.add_argument('--jitter', type=float, default=1.0, help='fake: up to this many extra seconds')
+    parser.add_argument('--boot-latency', type=float, default=3.0,
+                        help='fake: seconds from RUNNING until the app answers')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fake: probability that any API call fails with a transient 503')
+    parser.add_argument('--quota', type=int, help='fake: maximum instances in the project')
+    parser.add_argument('--seed', type=int, default=0, help='fake: random seed for jitter and errors')
+    parser.add_argument('--probe-timeout', type=float, default=1.0, help='seconds per HTTP probe')
+    parser.add_argument('--probe-interval', type=float, default=0.25, help='seconds between HTTP probes')
+    parser.add_argument('--deadline', type=float, default=300, help='give up on a VM after this many seconds')
+    parser.add_argument('--real', action='store_true', help='run against real GCE instead of the fake')
+    parser.add_argument('--json', default='provision-bench.json', help='where to write the JSON results')
+    parser.add_argument('--markdown', help='also write the Markdown table to this file')
+    parser.add_argument('--verbose', action='store_true', help="show the flows' own output")
+    tracing.add_arguments(parser)
+    ratelimit.add_arguments(parser)
+    args = parser.parse_args()
+    tracing.configure(args)
+    ratelimit.configure(args)
+
+    flows = [flow for flow in args.flows.split(',') if flow]
+    unknown = set(flows) - set(FLOWS)
+    if unknown:
+        parser.error(f"unknown flows: {', '.join(sorted(unknown))}")
+    levels = [int(level) for level in args.concurrency.split(',')]
+    backend = RealBackend(args) if args.real else FakeBackend(args)
+
+    results = []
+    for flow in flows:
+        for concurrency in ([1] if flow == 'part2-bulk' else levels):
+            print(f"Running {flow} at concurrency {concurrency}...", flush=True)
+            output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+            with output:
+                results.append(run_scenario(backend, flow, concurrency, args.runs))
+
+    with open(args.json, 'w') as f:
+        json.dump({'settings': vars(args), 'results': results}, f, indent=2)
+    table = markdown_table(results)
+    if args.markdown:
+        with open(args.markdown, 'w') as f:
+            f.write(table)
+    print()
+    print(table)
+    print(f"JSON results written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
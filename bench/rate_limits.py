@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""Measures the client-side rate limiter against a fake API that enforces rate limits.
+
+Many threads create VMs and poll their operations at once against a
+FakeCompute that allows `--api-read` reads and `--api-mutate` mutations per
+second. The run is repeated with the limiter off, with it set just under
+the API's limits, and with it set too high so that it has to adapt to 429s.
+An asyncio run shows the same buckets pacing coroutines, and a batch run
+counts the round trips that fleet gets and deletes take with the limiter
+on. Like GCE, which counts per minute, the fake enforces its limits over a
+sliding `--api-window`, so batches may burst within it.
+
+The bench checks what the limiter promises and exits non-zero if any check
+fails: no 429s from the limited runs, an adapted rate below the configured
+one in the run that starts too high, and one batch round trip per
+BATCH_LIMIT requests. Everything runs locally:
+
+    python bench/rate_limits.py --threads 32 --vms 400
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import googleapiclient.errors
+
+from common import fleet, ratelimit
+from common.fake_compute import FakeCompute
+from common.operations import OperationWaiter
+from common.spec import InstanceSpec
+
+PROJECT = 'bench-project'
+HEADROOM = 0.9      # the limiter runs at this fraction of the API's limits
+ZONE = 'us-west1-b'
+SPEC = InstanceSpec(source_image='projects/debian-cloud/global/images/family/debian-11')
+
+
+def create_all(fake, names, threads):
+    """Inserts every VM from a thread pool while one waiter polls the operations; returns (created, failed)."""
+    waiter = OperationWaiter(fake, PROJECT, ZONE, raise_on_error=False, log=lambda *_: None)
+    failed = 0
+
+    def insert(name):
+        return fake.instances().insert(project=PROJECT, zone=ZONE, body=SPEC.body(name, ZONE)).execute()
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for future in [pool.submit(insert, name) for name in names]:
+            try:
+                waiter.add(future.result())
+            except googleapiclient.errors.HttpError:
+                failed += 1
+    try:
+        waiter.wait()
+    except googleapiclient.errors.HttpError:
+        failed += len(waiter.pending)
+    created = sum(1 for (p, _, _) in fake._resources['instances'] if p == PROJECT)
+    return created, failed
+
+
+def limited_fake(args):
+    return FakeCompute(latency=args.op_latency, rate_limits={'read': args.api_read, 'mutate': args.api_mutate},
+                       rate_window=args.api_window)
+
+
+def run(label, args, read_rate, mutate_rate):
+    fake = limited_fake(args)
+    limiter = ratelimit.enable(read_rate, mutate_rate)
+    names = [f'vm-{i}' for i in range(1, args.vms + 1)]
+    start = time.monotonic()
+    created, failed = create_all(fake, names, args.threads)
+    return {'label': label, 'created': created, 'failed': failed, 'rejected': fake.rate_limited,
+            'wall': time.monotonic() - start, 'metrics': limiter.metrics()}
+
+
+async def run_async(args):
+    """Coroutines that each take a mutate token, then call the fake; returns the same summary."""
+    fake = limited_fake(args)
+    limiter = ratelimit.RateLimiter(args.api_read * HEADROOM, args.api_mutate * HEADROOM)
+    # The coroutines pace themselves; the fake's own execute() calls go through unlimited
+    ratelimit.enable(0, 0)
+    rejected = 0
+
+    async def insert(name):
+        nonlocal rejected
+        await limiter.acquire_async('compute.instances.insert')
+        try:
+            fake.instances().insert(project=PROJECT, zone=ZONE, body=SPEC.body(name, ZONE)).execute()
+        except googleapiclient.errors.HttpError:
+            rejected += 1
+
+    start = time.monotonic()
+    await asyncio.gather(*(insert(f'vm-{i}') for i in range(1, args.vms + 1)))
+    return {'label': 'asyncio, limiter under API limits', 'created': args.vms - rejected, 'failed': rejected,
+            'rejected': fake.rate_limited, 'wall': time.monotonic() - start, 'metrics': limiter.metrics()}
+
+
+def batch_round_trips(args):
+    """Round trips for batched gets and deletes of the whole fleet, limiter on; returns {step: (trips, calls)}."""
+    fake = FakeCompute(latency=args.op_latency)
+    names = [f'vm-{i}' for i in range(1, args.vms + 1)]
+    for name in names:
+        fake.add_instance(PROJECT, ZONE, name)
+    ratelimit.enable(args.api_read * HEADROOM, args.api_mutate * HEADROOM)
+    costs = {}
+    for step, action in (('get', fleet.get_instances), ('delete', fleet.delete_instances)):
+        start = fake.round_trips
+        action(fake, PROJECT, ZONE, names)
+        costs[step] = (fake.round_trips - start, len(names))
+    return costs
+
+
+def check(results, batches):
+    """Returns a message for every broken promise of the limiter."""
+    failures = []
+    for r in results:
+        if 'under API limits' in r['label'] and r['rejected']:
+            failures.append(f"{r['label']}: {r['rejected']} 429s from the API, expected none")
+    adapting = next(r for r in results if 'adapts' in r['label'])
+    limited = {name: m for name, m in adapting['metrics'].items() if m['rate_limited']}
+    if not limited:
+        failures.append(f"{adapting['label']}: never rate-limited, so nothing to adapt to")
+    for name, m in limited.items():
+        if m['min_rate'] >= m['configured_rate']:
+            failures.append(f"{adapting['label']}: {name} rate never went below {m['configured_rate']:g}")
+    for step, (trips, calls) in batches.items():
+        expected = math.ceil(calls / fleet.BATCH_LIMIT)
+        if trips > expected:
+            failures.append(f"batched {step}: {trips} round trips for {calls} calls, expected {expected}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--vms', type=int, default=400, help='VMs to create per run')
+    parser.add_argument('--threads', type=int, default=32, help='threads issuing inserts')
+    parser.add_argument('--api-read', type=int, default=20, help='reads per second the fake API allows')
+    parser.add_argument('--api-mutate', type=int, default=5, help='mutations per second the fake API allows')
+    parser.add_argument('--api-window', type=float, default=60, help='seconds over which the fake API counts calls')
+    parser.add_argument('--op-latency', type=float, default=1.0, help='seconds each fake operation runs')
+    args = parser.parse_args()
+
+    results = [
+        run('no limiter', args, 0, 0),
+        run('limiter under API limits', args, args.api_read * HEADROOM, args.api_mutate * HEADROOM),
+        run('limiter 3x too high (adapts)', args, args.api_read * 3, args.api_mutate * 3),
+        asyncio.run(run_async(args)),
+    ]
+    batches = batch_round_trips(args)
+    print(f"{args.vms} VMs from {args.threads} threads; fake API allows {args.api_read} reads and "
+          f"{args.api_mutate} mutations per second over {args.api_window:g}s\n")
+    print("| run | created | failed | 429s from API | wall (s) | throttled (read/mutate) "
+          "| throttle s (read/mutate) | peak queue (read/mutate) | lowest rate (read/mutate) "
+          "| final rate (read/mutate) |")
+    print("|-----|---------|--------|---------------|----------|------------------------"
+          "|--------------------------|--------------------------|---------------------------"
+          "|--------------------------|")
+    for r in results:
+        m = {name: r['metrics'].get(name, {}) for name in ('read', 'mutate')}
+        pair = lambda key: '/'.join(str(m[name].get(key, '-')) for name in ('read', 'mutate'))
+        print(f"| {r['label']} | {r['created']} | {r['failed']} | {r['rejected']} | {r['wall']:.2f} "
+              f"| {pair('throttled')} | {pair('throttle_seconds')} | {pair('max_queue_depth')} "
+              f"| {pair('min_rate')} | {pair('rate')} |")
+    print()
+    for step, (trips, calls) in batches.items():
+        print(f"batched {step} of {calls} VMs: {trips} round trips")
+
+    failures = check(results, batches)
+    if failures:
+        raise SystemExit('FAILED:\n' + '\n'.join(failures))
+    print("all checks passed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Times tearing down fleets of different sizes with common.teardown.
+
+The fake API takes `--delete` seconds per delete. Each fleet is the
+part1 instance, `size` clones (half of them older than the orphan TTL),
+the base snapshot, an image and the allow-5000 firewall rule. Deletes
+are batched and waited on together, so the time should stay near three
+stages of one delete each, whatever the size. Every delete and every poll
+inside a batch still spends a token of the API rate limits
+(--read-rate/--mutate-rate), so at the default 20/s a 100-clone stage
+takes a few seconds more than a one-clone stage. Everything runs locally:
+
+    python bench/teardown.py --sizes 1,10,100 --delete 2
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import ratelimit
+from common.fake_compute import FakeCompute
+from common.operations import wait_for_operations
+from common.teardown import TTL, Teardown
+
+PROJECT = 'bench-project'
+ZONE = 'us-west1-b'
+
+
+def seed(size, delete):
+    """Returns a fake holding a part2 fleet of `size` clones."""
+    fake = FakeCompute(latency=lambda method, _: delete if method.endswith('.delete') else 0.05)
+    old = (datetime.now(timezone.utc) - timedelta(seconds=2 * TTL)).isoformat()
+    fake.add_instance(PROJECT, ZONE, 'flask-tutorial-instance', creationTimestamp=old)
+    for i in range(1, size + 1):
+        fake.add_instance(PROJECT, ZONE, f'flask-clone-{i}', **({'creationTimestamp': old} if i % 2 else {}))
+    operation = fake.disks().createSnapshot(project=PROJECT, zone=ZONE, disk='flask-tutorial-instance',
+                                            body={'name': 'base-snapshot-flask-tutorial-instance'}).execute()
+    wait_for_operations(fake, PROJECT, [operation], log=lambda *_: None)
+    operations = [
+        fake.images().insert(project=PROJECT, body={
+            'name': 'flask-tutorial-bench', 'family': 'flask-tutorial',
+            'sourceSnapshot': f'projects/{PROJECT}/global/snapshots/base-snapshot-flask-tutorial-instance'}).execute(),
+        fake.firewalls().insert(project=PROJECT, body={'name': 'allow-5000'}).execute(),
+    ]
+    wait_for_operations(fake, PROJECT, operations, log=lambda *_: None)
+    return fake
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1,10,100', help='comma-separated clone counts to tear down')
+    parser.add_argument('--delete', type=float, default=2.0, help='seconds the fake takes per delete')
+    ratelimit.add_arguments(parser)
+    args = parser.parse_args()
+    ratelimit.configure(args)
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    rows = []
+    for size in sizes:
+        fake = seed(size, args.delete)
+        cleaner = Teardown(fake, PROJECT, log=lambda *_: None)
+        round_trips = fake.round_trips
+        start = time.monotonic()
+        cleaner.find()
+        cleaner.delete()
+        seconds = time.monotonic() - start
+        left = sum(len(resources) for resources in fake._resources.values())
+        rows.append((size, len(cleaner.found), seconds, fake.round_trips - round_trips, len(cleaner.orphans()),
+                     left))
+        if size == min(sizes):
+            report = cleaner.report()
+
+    print('| clones | resources | seconds | round trips | orphans | left behind |')
+    print('|--------|-----------|---------|-------------|---------|-------------|')
+    for size, found, seconds, round_trips, orphans, left in rows:
+        print(f'| {size} | {found} | {seconds:.2f} | {round_trips} | {orphans} | {left} |')
+    print(f"\n## {min(sizes)} clones\n")
+    print('\n'.join(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Compares handing out clones from a warm pool with creating them cold.
+
+The fake API takes `--create` seconds per insert (plus `--boot` seconds
+before the app serves) and `--resume` seconds per resume or start, roughly
+the ratio seen on GCE. Clones are requested every `--interval` seconds, so
+a short interval drains the pool faster than it refills and shows misses.
+Everything runs locally:
+
+    python bench/warm_pool.py --pool-size 3 --acquires 8 --interval 1
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.fake_compute import FakeCompute
+from common.pool import MODES, WarmPool
+from common.spec import InstanceSpec
+
+PROJECT = 'bench-project'
+ZONE = 'us-west1-b'
+SPEC = InstanceSpec(source_image='projects/debian-cloud/global/images/family/debian-11')
+
+
+def run(args, mode):
+    latency = lambda method, _: args.resume if method in ('instances.resume', 'instances.start') else args.create
+    fake = FakeCompute(latency=latency, jitter=args.create / 5, boot_latency=args.boot)
+
+    def ready(compute, name):
+        while not fake.is_serving(PROJECT, ZONE, name):
+            time.sleep(0.1)
+
+    pool = WarmPool(lambda: fake, PROJECT, ZONE, lambda name: SPEC.body(name, ZONE), args.pool_size,
+                    mode=mode, ready=ready, log=lambda *_: None).start()
+    pool.wait_full()
+    for _ in range(args.acquires):
+        pool.acquire()
+        time.sleep(args.interval)
+    pool.wait_full()
+    pool.close()
+    return pool
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pool-size', type=int, default=3, help='parked clones to keep ready')
+    parser.add_argument('--acquires', type=int, default=8, help='clones to hand out')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between acquires')
+    parser.add_argument('--create', type=float, default=4.0, help='seconds the fake takes per insert')
+    parser.add_argument('--boot', type=float, default=2.0, help='seconds from RUNNING to serving after a boot')
+    parser.add_argument('--resume', type=float, default=0.5, help='seconds the fake takes per resume or start')
+    args = parser.parse_args()
+
+    for mode in MODES:
+        print(f"## {mode}\n")
+        print('\n'.join(run(args, mode).report()) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1 @@
+"""Helpers shared by the part1, part2 and part3 provisioning scripts."""
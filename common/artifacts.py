@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""Reuse snapshots and images built from the same disk state instead of rebuilding them.
+
+Snapshotting a boot disk is one of the slowest steps in part2, and its
+result only changes when the disk does. Each artifact therefore gets a key:
+a hash of what determines its contents.
+- For a snapshot: the source disk's identity (id, size, source image or
+  snapshot), the startup script of the instance that built it, and any
+  extra config from the caller.
+- For an image: the key of the snapshot it is converted from, plus its
+  family.
+
+The key is stored on the resource as the artifact-key label, and is part
+of its name. A run that finds a resource with its key reuses it, waiting
+if it is still being created; otherwise it creates a new version.
+prune() keeps the newest `keep` versions made from the same source and
+deletes the rest.
+
+The key covers how the disk was built, not changes made to it by hand.
+Pass something that changes (e.g. config={'rev': 2}) to force a new
+version after such edits.
+"""
+
+import hashlib
+import json
+import re
+import time
+from dataclasses import dataclass
+
+import googleapiclient.errors
+
+from common.fleet import batch_execute, list_all
+from common.images import start_image_from_snapshot
+from common.operations import wait_for_operations
+
+LABEL_KEY = 'artifact-key'
+LABEL_SOURCE = 'artifact-source'
+KEEP = 2                # versions kept per source
+KEY_LENGTH = 12         # hex digits of the hash used in names and labels
+POLL_INTERVAL = 5       # seconds between checks on an artifact another run is creating
+READY_TIMEOUT = 1800    # seconds to wait for it
+
+
+@dataclass(frozen=True)
+class Artifact:
+    """A snapshot or image for a key: the one that exists (status set) or the one to create."""
+
+    kind: str               # 'snapshots' or 'images'
+    name: str
+    key: str
+    source: str             # label value naming what it is made from
+    status: str = None      # the existing resource's status; None when it has to be created
+
+    @property
+    def cached(self):
+        return self.status is not None
+
+    @property
+    def labels(self):
+        return {LABEL_KEY: self.key, LABEL_SOURCE: self.source}
+
+
+def artifact_key(value):
+    """A short, stable hash of any JSON-serializable value."""
+    encoded = json.dumps(value, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()[:KEY_LENGTH]
+
+
+def label_value(text):
+    """Makes text a valid label value: lowercase letters, digits, '-' and '_', at most 63 characters."""
+    return re.sub(r'[^a-z0-9_-]', '-', text.lower())[:63]
+
+
+def disk_state(compute, project, zone, instance_name, disk_name):
+    """Returns what determines a disk's contents: the disk's identity and source, and the instance's startup script."""
+    responses = batch_execute(compute, {
+        'instance': compute.instances().get(project=project, zone=zone, instance=instance_name),
+        'disk': compute.disks().get(project=project, zone=zone, disk=disk_name),
+    })
+    for response in responses.values():
+        if isinstance(response, Exception):
+            raise response
+    instance, disk = responses['instance'], responses['disk']
+    metadata = {item['key']: item.get('value', '') for item in instance.get('metadata', {}).get('items', [])}
+    return {
+        'disk_id': disk['id'],
+        'size_gb': disk.get('sizeGb'),
+        'source_image': disk.get('sourceImageId') or disk.get('sourceImage'),
+        'source_snapshot': disk.get('sourceSnapshotId'),
+        'startup_script': hashlib.sha256(metadata.get('startup-script', '').encode()).hexdigest(),
+    }
+
+
+class ArtifactCache:
+    """Finds, creates and prunes keyed snapshots and images in one project."""
+
+    def __init__(self, compute, project, keep=KEEP, log=print):
+        self.compute = compute
+        self.project = project
+        self.keep = keep
+        self.log = log
+
+    def _collection(self, kind):
+        return getattr(self.compute, kind)()
+
+    def _newest_first(self, items):
+        return sorted(items, key=lambda item: (item['creationTimestamp'], int(item['id'])), reverse=True)
+
+    def _versions(self, kind, label, value):
+        # The filter narrows the listing server-side; the check below also covers APIs that ignore it
+        items = list_all(self._collection(kind), project=self.project, filter=f'labels.{label}={value}')
+        return [item for item in items if item.get('labels', {}).get(label) == value]
+
+    def _resolve(self, kind, name, key, source):
+        found = [item for item in self._versions(kind, LABEL_KEY, key)
+                 if item.get('status') not in ('FAILED', 'DELETING')]
+        if not found:
+            return Artifact(kind, name, key, source)
+        newest = self._newest_first(found)[0]
+        self.log(f"Reusing {kind[:-1]} {newest['name']} (key {key}, {newest['status']})")
+        return Artifact(kind, newest['name'], key, source, newest['status'])
+
+    def snapshot_artifact(self, zone, instance_name, disk_name, prefix, config=None):
+        """Returns the snapshot Artifact for the disk's current state."""
+        key = artifact_key({'disk': disk_state(self.compute, self.project, zone, instance_name, disk_name),
+                            'config': config})
+        return self._resolve('snapshots', f'{prefix}-{key}', key, label_value(disk_name))
+
+    def image_artifact(self, snapshot, family, config=None):
+        """Returns the image Artifact converted from the snapshot Artifact into the family."""
+        key = artifact_key({'snapshot': snapshot.key, 'family': family, 'config': config})
+        return self._resolve('images', f'{family}-{key}', key, label_value(family))
+
+    def wait_ready(self, artifact, timeout=READY_TIMEOUT):
+        """Waits until an artifact another run is creating is READY."""
+        give_up = time.monotonic() + timeout
+        while True:
+            resource = self._collection(artifact.kind).get(
+                project=self.project, **{artifact.kind[:-1]: artifact.name}).execute()
+            if resource['status'] == 'READY':
+                return resource
+            if resource['status'] in ('FAILED', 'DELETING') or time.monotonic() >= give_up:
+                raise RuntimeError(f"{artifact.kind[:-1]} {artifact.name} is {resource['status']}")
+            time.sleep(POLL_INTERVAL)
+
+    def _start(self, artifact, create):
+        # Returns the create operation, or None when the artifact exists (waiting for it if needed)
+        if not artifact.cached:
+            try:
+                return create()
+            except googleapiclient.errors.HttpError as e:
+                if e.resp.status != 409:
+                    raise
+                self.log(f"{artifact.kind[:-1]} {artifact.name} was just created by another run; reusing it")
+        self.wait_ready(artifact)
+        return None
+
+    def start_snapshot(self, artifact, zone, disk_name, description=''):
+        """Starts snapshotting the disk unless the artifact exists; returns the operation or None."""
+        def create():
+            self.log(f"Creating snapshot {artifact.name} of disk {disk_name}...")
+            body = {'name': artifact.name, 'description': description, 'labels': artifact.labels}
+            return self.compute.disks().createSnapshot(project=self.project, zone=zone, disk=disk_name,
+                                                       body=body).execute()
+        return self._start(artifact, create)
+
+    def start_image(self, artifact, snapshot_name, family):
+        """Starts converting the snapshot into the image unless the artifact exists; returns the operation or None."""
+        return self._start(artifact, lambda: start_image_from_snapshot(
+            self.compute, self.project, snapshot_name, artifact.name, family, self.log, labels=artifact.labels))
+
+    def prune(self, artifact):
+        """Starts deleting versions from the artifact's source beyond the newest `keep`; returns the operations."""
+        versions = self._newest_first(self._versions(artifact.kind, LABEL_SOURCE, artifact.source))
+        kept = {artifact.name} | {item['name'] for item in versions[:self.keep]}
+        old = [item['name'] for item in versions if item['name'] not in kept]
+        if not old:
+            return []
+        self.log(f"Pruning {len(old)} old {artifact.kind}: {', '.join(old)}")
+        collection = self._collection(artifact.kind)
+        responses = batch_execute(self.compute, {
+            name: collection.delete(project=self.project, **{artifact.kind[:-1]: name}) for name in old})
+        operations = []
+        for name, response in responses.items():
+            if isinstance(response, Exception):
+                self.log(f"Could not delete {artifact.kind[:-1]} {name}: {response}")
+            else:
+                operations.append(response)
+        return operations
+
+    def ensure_snapshot(self, zone, instance_name, disk_name, prefix, config=None, description=''):
+        """Reuses or creates the snapshot for the disk's state, prunes old versions and returns its name."""
+        artifact = self.snapshot_artifact(zone, instance_name, disk_name, prefix, config)
+        operation = self.start_snapshot(artifact, zone, disk_name, description)
+        if operation:
+            wait_for_operations(self.compute, self.project, [operation], log=self.log)
+            self.log(f"Snapshot created: {artifact.name}")
+        wait_for_operations(self.compute, self.project, self.prune(artifact), log=self.log)
+        return artifact.name
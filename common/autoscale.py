@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""A control loop that sizes the clone fleet to its request latency.
+
+Every `interval` seconds the Autoscaler samples each clone. A sample says
+whether the clone is healthy (RUNNING and answering), its request latency,
+and its load when the sampler knows it. From the mean latency of the
+healthy clones, the Policy computes a target size:
+- Scale out when latency stays above `scale_out_above` for `out_samples`
+  samples in a row. The fleet grows in proportion to the overshoot, by at
+  most `max_step` clones.
+- Scale in by one clone when latency stays below `scale_in_below` for
+  `in_samples` samples in a row. The clone with the least load goes first.
+- Never go below `min_size`, even during a cooldown, or above `max_size`.
+
+Between the two thresholds nothing changes. That band, the streaks and the
+cooldowns after each change keep the fleet from flapping. Scale-outs and
+scale-ins run in background threads, so sampling continues while clones
+are created. Clones still being created count toward the size.
+
+Each decision is logged and kept in `decisions`, with the time its clones
+took. Samplers:
+- HttpSampler probes the real clones over HTTP.
+- SimulatedSampler replays a load trace against the clones that exist in
+  the (fake) API, so the loop can be run and checked locally.
+"""
+
+import asyncio
+import math
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from common import tracing
+from common.fleet import external_ip, list_all
+from common.loadgen import HttpClient, Target
+from common.startup import APP_PORT
+
+INTERVAL = 15       # seconds between samples
+
+
+@dataclass(frozen=True)
+class Policy:
+    """Thresholds (seconds of request latency), streaks and cooldowns (seconds) for the autoscaler."""
+
+    min_size: int = 1
+    max_size: int = 10
+    scale_out_above: float = 0.5
+    scale_in_below: float = 0.15
+    out_samples: int = 2        # consecutive samples above scale_out_above before scaling out
+    in_samples: int = 5         # consecutive samples below scale_in_below before scaling in
+    out_cooldown: float = 60    # after a scale-out, before the next one
+    in_cooldown: float = 300    # after any change, before a scale-in
+    max_step: int = 4           # clones added per scale-out
+
+    def __post_init__(self):
+        if not 0 <= self.min_size <= self.max_size:
+            raise ValueError(f"Need 0 <= min_size <= max_size, got {self.min_size} and {self.max_size}")
+        if not self.scale_in_below < self.scale_out_above:
+            raise ValueError('scale_in_below must be lower than scale_out_above, or the fleet would flap')
+
+
+@dataclass(frozen=True)
+class CloneSample:
+    """One clone at one point in time."""
+
+    healthy: bool
+    latency: float = None   # seconds per request
+    load: float = None      # requests per second, when known
+
+
+def clone_instances(compute, project, zone, prefix):
+    """The instances in the zone named PREFIX-N."""
+    pattern = re.compile(rf'{re.escape(prefix)}-(\d+)$')
+    return [instance for instance in list_all(compute.instances(), project=project, zone=zone)
+            if pattern.match(instance['name'])]
+
+
+class HttpSampler:
+    """Samples real clones: RUNNING ones get `probes` GETs each, and healthy means they all answered."""
+
+    def __init__(self, compute, project, zone, prefix, probes=3, path='/', port=APP_PORT, timeout=5):
+        self.compute = compute
+        self.project = project
+        self.zone = zone
+        self.prefix = prefix
+        self.probes = probes
+        self.path = path
+        self.port = port
+        self.timeout = timeout
+
+    def __call__(self):
+        instances = clone_instances(self.compute, self.project, self.zone, self.prefix)
+        targets = [Target(i['name'], external_ip(i), self.port) for i in instances
+                   if i['status'] == 'RUNNING' and external_ip(i)]
+        probed = asyncio.run(self._probe(targets))
+        return {i['name']: probed.get(i['name'], CloneSample(False)) for i in instances}
+
+    async def _probe(self, targets):
+        client = HttpClient(self.timeout)
+        loop = asyncio.get_running_loop()
+
+        async def probe(target):
+            latencies = []
+            for _ in range(self.probes):
+                start = loop.time()
+                try:
+                    status = await client.request(target, 'GET', self.path)
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+                    return CloneSample(False)
+                if status >= 500:
+                    return CloneSample(False)
+                latencies.append(loop.time() - start)
+            return CloneSample(True, sorted(latencies)[len(latencies) // 2])
+
+        try:
+            samples = await asyncio.gather(*(probe(target) for target in targets))
+        finally:
+            client.close()
+        return {target.name: sample for target, sample in zip(targets, samples)}
+
+
+def parse_trace(text):
+    """Parses 'seconds:rps,...' (e.g. '0:50,30:400,90:50') into [(seconds, rps)], sorted by time."""
+    points = sorted((float(at), float(rps)) for at, rps in (item.split(':') for item in text.split(',')))
+    if not points or points[0][0] > 0:
+        raise ValueError(f"Load trace {text!r} must start at 0 seconds")
+    return points
+
+
+class SimulatedSampler:
+    """Replays a load trace over the clones that exist in the API.
+
+    The offered load at time t is the rps of the last trace point at or
+    before t. It is spread evenly over the serving clones, and each clone's
+    latency follows a simple queueing curve: base_latency / (1 - load /
+    capacity), capped where a clone is saturated.
+    """
+
+    def __init__(self, fake, project, zone, prefix, trace, capacity=100, base_latency=0.05, clock=time.monotonic):
+        self.fake = fake
+        self.project = project
+        self.zone = zone
+        self.prefix = prefix
+        self.trace = parse_trace(trace) if isinstance(trace, str) else trace
+        self.capacity = capacity
+        self.base_latency = base_latency
+        self.clock = clock
+        self.start = clock()
+
+    def offered(self, now=None):
+        """Requests per second the trace offers at `now`."""
+        elapsed = (self.clock() if now is None else now) - self.start
+        return [rps for at, rps in self.trace if at <= elapsed][-1]
+
+    def __call__(self):
+        instances = clone_instances(self.fake, self.project, self.zone, self.prefix)
+        serving = [i['name'] for i in instances if self.fake.is_serving(self.project, self.zone, i['name'])]
+        load = self.offered() / len(serving) if serving else 0.0
+        latency = self.base_latency / (1 - min(load / self.capacity, 0.95))
+        return {i['name']: CloneSample(True, latency, load) if i['name'] in serving else CloneSample(False)
+                for i in instances}
+
+
+class Autoscaler:
+    """Samples the fleet, decides a target size and creates or deletes clones to reach it.
+
+    create(compute, name) and delete(compute, name) do the work; each runs
+    in a worker thread with its own client from compute_factory.
+    """
+
+    def __init__(self, policy, sampler, create, delete, compute_factory, prefix, clock=time.monotonic, log=print):
+        self.policy = policy
+        self.sampler = sampler
+        self.create = create
+        self.delete = delete
+        self.compute_factory = compute_factory
+        self.prefix = prefix
+        self.clock = clock
+        self.log = log
+        self.creating = set()
+        self.deleting = set()
+        self.decisions = []
+        self.history = []       # (time, size, healthy, latency, decision)
+        self.high = self.low = 0
+        self.last_out = self.last_change = -math.inf
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max(policy.max_step, 1))
+
+    def _client(self):
+        if not hasattr(self._local, 'compute'):
+            self._local.compute = self.compute_factory()
+        return self._local.compute
+
+    def _fleet(self, samples):
+        # The clones that count toward the size, and the mean latency of the healthy ones
+        with self._lock:
+            fleet = (set(samples) | self.creating) - self.deleting
+        latencies = [s.latency for s in samples.values() if s.healthy and s.latency is not None]
+        return fleet, sum(latencies) / len(latencies) if latencies else None
+
+    def decide(self, samples, now):
+        """Returns (target size, reason) for the current samples, updating the threshold streaks."""
+        policy = self.policy
+        fleet, latency = self._fleet(samples)
+        size = len(fleet)
+        creating = bool(self.creating)
+        self.high = self.high + 1 if latency is not None and latency > policy.scale_out_above else 0
+        self.low = self.low + 1 if latency is not None and latency < policy.scale_in_below else 0
+
+        if size < policy.min_size:
+            return policy.min_size, f'below the minimum of {policy.min_size}'
+        if size > policy.max_size:
+            return policy.max_size, f'above the maximum of {policy.max_size}'
+        if self.high >= policy.out_samples:
+            if size >= policy.max_size:
+                return size, 'latency is high but the fleet is at its maximum'
+            if now - self.last_out < policy.out_cooldown:
+                return size, 'latency is high but scale-out is cooling down'
+            step = min(policy.max_step, max(1, math.ceil(size * (latency / policy.scale_out_above - 1))))
+            return (min(policy.max_size, size + step),
+                    f'latency {latency:.3f}s above {policy.scale_out_above}s for {self.high} samples')
+        if self.low >= policy.in_samples and size > policy.min_size:
+            if creating or now - self.last_change < policy.in_cooldown:
+                return size, 'latency is low but scale-in is cooling down'
+            return size - 1, f'latency {latency:.3f}s below {policy.scale_in_below}s for {self.low} samples'
+        return size, 'within thresholds'
+
+    def step(self):
+        """Takes one sample and acts on it; returns the decision, or None when the size stays."""
+        now = self.clock()
+        with tracing.span('autoscale.sample'):
+            samples = self.sampler()
+        target, reason = self.decide(samples, now)
+        fleet, latency = self._fleet(samples)
+        healthy = sum(1 for s in samples.values() if s.healthy)
+        self.history.append((now, len(fleet), healthy, latency, reason))
+        if target == len(fleet):
+            return None
+
+        decision = {'time': now, 'from': len(fleet), 'to': target, 'reason': reason, 'latency': latency,
+                    'seconds': {}}
+        if target > len(fleet):
+            decision['action'] = 'scale-out'
+            decision['names'] = self._new_names(fleet | set(samples), target - len(fleet))
+            self.last_out = self.last_change = now
+            self.high = 0
+            with self._lock:
+                self.creating.update(decision['names'])
+            work = self.create
+        else:
+            decision['action'] = 'scale-in'
+            # Least load first; unhealthy clones before healthy ones, since they serve nothing
+            candidates = sorted((name for name in fleet if name in samples and name not in self.creating),
+                                key=lambda name: (samples[name].healthy, samples[name].load or 0,
+                                                  samples[name].latency or 0))
+            decision['names'] = candidates[:len(fleet) - target]
+            self.last_change = now
+            self.low = 0
+            with self._lock:
+                self.deleting.update(decision['names'])
+            work = self.delete
+        self.decisions.append(decision)
+        tracing.event('autoscale.decision', action=decision['action'], size_from=decision['from'],
+                      size_to=target, reason=reason, latency=latency)
+        self.log(f"{decision['action']} {decision['from']} -> {target} ({reason}): {', '.join(decision['names'])}")
+        for name in decision['names']:
+            self._pool.submit(self._act, decision, work, name)
+        return decision
+
+    def _new_names(self, taken, count):
+        pattern = re.compile(rf'{re.escape(self.prefix)}-(\d+)$')
+        used = {int(m.group(1)) for m in (pattern.match(name) for name in taken) if m}
+        names = []
+        number = 1
+        while len(names) < count:
+            if number not in used:
+                names.append(f'{self.prefix}-{number}')
+            number += 1
+        return names
+
+    def _act(self, decision, work, name):
+        start = self.clock()
+        try:
+            work(self._client(), name)
+        except Exception as e:
+            decision['seconds'][name] = None
+            self.log(f"{decision['action']} of {name} failed: {e}")
+        else:
+            decision['seconds'][name] = self.clock() - start
+            self.log(f"{decision['action']} of {name} done in {decision['seconds'][name]:.2f}s")
+        finally:
+            with self._lock:
+                self.creating.discard(name)
+                self.deleting.discard(name)
+
+    def run(self, interval=INTERVAL, duration=None):
+        """Samples every `interval` seconds until `duration` has passed (or forever), then waits for work."""
+        end = None if duration is None else self.clock() + duration
+        try:
+            while end is None or self.clock() < end:
+                started = self.clock()
+                self.step()
+                time.sleep(max(0, interval - (self.clock() - started)))
+        finally:
+            self._pool.shutdown(wait=True)
+
+    def report(self):
+        """Returns text lines: one row per decision, with how long its clones took."""
+        lines = ['| t (s) | action | size | latency (s) | reason | clone seconds |',
+                 '|-------|--------|------|-------------|--------|---------------|']
+        start = self.history[0][0] if self.history else 0
+        for d in self.decisions:
+            took = ', '.join(f"{name} {'failed' if s is None else f'{s:.1f}'}" for name, s in d['seconds'].items())
+            latency = '-' if d['latency'] is None else f"{d['latency']:.3f}"
+            lines.append(f"| {d['time'] - start:.1f} | {d['action']} | {d['from']} -> {d['to']} | {latency} "
+                         f"| {d['reason']} | {took or 'pending'} |")
+        if self.history:
+            sizes = [size for _, size, _, _, _ in self.history]
+            lines.append(f"{len(self.history)} samples, {len(self.decisions)} decisions, "
+                         f"size {min(sizes)}..{max(sizes)}, final {sizes[-1]}")
+        return lines
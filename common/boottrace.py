@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""Boot-phase waterfalls from the startup script's BOOT-PHASE markers.
+
+The startup scripts (common.startup) mark the start of each phase. A
+BootCollector reads those markers for a fleet of instances in one of two
+ways:
+- 'serial': instances().getSerialPortOutput. Each poll passes the `start`
+  offset from the previous response's `next`, so only new console output
+  is fetched.
+- 'guest': the boot/ guest attributes. This needs common.startup's
+  BOOT_METADATA in the instance metadata, which the specs that run the
+  startup scripts set.
+
+Either way, all instances are read in one batch request per poll. The API
+timestamps add two phases before the script starts:
+- 'provision': from creationTimestamp to lastStartTimestamp;
+- 'boot': from then until the first marker (kernel and guest agent).
+
+report() draws one waterfall row per instance. It then lists the phases
+sorted by mean duration, so the costliest phase is at the top.
+"""
+
+import re
+import time
+from datetime import datetime
+
+import googleapiclient.errors
+
+from common.fleet import batch_execute, get_instances
+from common.stats import summarize
+
+MARKER = re.compile(r'BOOT-PHASE (\S+) (\d+(?:\.\d+)?)')
+FINAL = 'serving'
+GUEST_PATH = 'boot/'
+POLL_INTERVAL = 5       # seconds between polls
+DEADLINE = 900          # seconds to wait for every instance's FINAL marker
+WIDTH = 60              # characters in a waterfall row
+SYMBOLS = '.=#+*~%@&o'  # one per phase in the waterfall
+
+
+def parse_markers(text):
+    """Returns {marker: epoch seconds} from console output; a later boot's markers replace earlier ones."""
+    return {marker: float(stamp) for marker, stamp in MARKER.findall(text)}
+
+
+def _epoch(timestamp):
+    return datetime.fromisoformat(timestamp).timestamp() if timestamp else None
+
+
+class BootCollector:
+    """Collects boot-phase markers for instances in one zone."""
+
+    def __init__(self, compute, project, zone, names, source='serial'):
+        if source not in ('serial', 'guest'):
+            raise ValueError(f"Unknown marker source {source}; expected serial or guest")
+        self.compute = compute
+        self.project = project
+        self.zone = zone
+        self.names = list(names)
+        self.source = source
+        self.offsets = {name: 0 for name in self.names}
+        self.markers = {name: {} for name in self.names}
+        self.instances = {}
+
+    def _requests(self, names):
+        instances = self.compute.instances()
+        if self.source == 'serial':
+            return {name: instances.getSerialPortOutput(project=self.project, zone=self.zone, instance=name,
+                                                        port=1, start=self.offsets[name]) for name in names}
+        return {name: instances.getGuestAttributes(project=self.project, zone=self.zone, instance=name,
+                                                   queryPath=GUEST_PATH) for name in names}
+
+    def poll(self):
+        """Reads new markers for the instances that have not reached FINAL; returns those still pending."""
+        pending = [name for name in self.names if FINAL not in self.markers[name]]
+        for name, response in batch_execute(self.compute, self._requests(pending)).items():
+            if isinstance(response, Exception):
+                # 404 until the instance exists (or, for guest attributes, until the first marker)
+                if not isinstance(response, googleapiclient.errors.HttpError) or response.resp.status != 404:
+                    raise response
+                continue
+            if self.source == 'serial':
+                self.offsets[name] = int(response.get('next', self.offsets[name]))
+                self.markers[name].update(parse_markers(response.get('contents', '')))
+            else:
+                items = response.get('queryValue', {}).get('items', [])
+                self.markers[name].update({item['key']: float(item['value']) for item in items})
+        return [name for name in self.names if FINAL not in self.markers[name]]
+
+    def collect(self, interval=POLL_INTERVAL, deadline=DEADLINE, log=print):
+        """Polls until every instance has printed FINAL or the deadline passes; returns the waterfall."""
+        give_up = time.monotonic() + deadline
+        while True:
+            pending = self.poll()
+            if not pending or time.monotonic() >= give_up:
+                break
+            time.sleep(interval)
+        if pending:
+            log(f"No '{FINAL}' marker after {deadline}s from: {', '.join(pending)}")
+        self.instances = {name: instance for name, instance in
+                          get_instances(self.compute, self.project, self.zone, self.names).items()
+                          if not isinstance(instance, Exception)}
+        return self.waterfall()
+
+    def waterfall(self):
+        """Returns {name: [(phase, start, seconds)]}; start counts from creation, or else from the first marker."""
+        rows = {}
+        for name in self.names:
+            instance = self.instances.get(name, {})
+            created = _epoch(instance.get('creationTimestamp'))
+            started = _epoch(instance.get('lastStartTimestamp'))
+            points = sorted(self.markers[name].items(), key=lambda item: item[1])
+            if points and started and started <= points[0][1]:
+                points.insert(0, ('boot', started))
+                if created and created <= started:
+                    points.insert(0, ('provision', created))
+            if len(points) < 2:
+                continue
+            origin = points[0][1]
+            rows[name] = [(phase, at - origin, end - at)
+                          for (phase, at), (_, end) in zip(points, points[1:])]
+        return rows
+
+    def report(self, width=WIDTH):
+        """Returns text lines: a waterfall row per instance, then phases sorted by mean duration."""
+        rows = self.waterfall()
+        if not rows:
+            return ['No boot-phase markers found']
+        phases = list(dict.fromkeys(phase for row in rows.values() for phase, _, _ in row))
+        letters = {phase: SYMBOLS[i % len(SYMBOLS)] for i, phase in enumerate(phases)}
+        longest = max(start + seconds for row in rows.values() for _, start, seconds in row) or 1
+        scale = width / longest
+        name_width = max(len(name) for name in rows)
+        lines = [f"{'':{name_width}}  0s{'':{width - 8}}{longest:5.0f}s"]
+        for name, row in rows.items():
+            bar = [' '] * width
+            for phase, start, seconds in row:
+                for i in range(int(start * scale), max(int(start * scale) + 1, int((start + seconds) * scale))):
+                    bar[min(i, width - 1)] = letters[phase]
+            total = row[-1][1] + row[-1][2]
+            lines.append(f"{name:{name_width}} |{''.join(bar)}| {total:.1f}s")
+        lines.append('legend: ' + ', '.join(f'{letters[phase]}={phase}' for phase in phases))
+        lines += ['', '| phase | instances | mean (s) | p95 (s) | max (s) | share of total |',
+                  '|-------|-----------|----------|---------|---------|----------------|']
+        totals = sum(row[-1][1] + row[-1][2] for row in rows.values()) or 1
+        durations = {phase: [seconds for row in rows.values() for p, _, seconds in row if p == phase]
+                     for phase in phases}
+        for phase, values in sorted(durations.items(), key=lambda item: -sum(item[1]) / len(item[1])):
+            s = summarize(values)
+            lines.append(f"| {phase} | {s['count']} | {s['mean']:.2f} | {s['p95']:.2f} | {s['max']:.2f} "
+                         f"| {sum(values) / totals:.0%} |")
+        return lines
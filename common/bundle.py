@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Ship code to a VM as one compressed, checksummed bundle in its metadata.
+
+build_bundle() zips source files, and optionally the contents of a wheelhouse,
+into one deflate-compressed archive. bundle_metadata() base64-encodes the
+archive into as few metadata values as the size limits allow. The script
+from bootstrap_script() fetches those values, checks the SHA-256, unpacks the
+archive and runs the entry point. It uses only curl, base64, sha256sum and
+python3 from the stock image.
+
+The bootstrap puts the vendored wheels (site/ in the bundle) on PYTHONPATH.
+It falls back to apt/pip only when the client libraries still cannot be
+imported. So a VM booted from an image that already has them, or given a
+slim enough wheelhouse, installs nothing from the network.
+"""
+
+import base64
+import hashlib
+import io
+import zipfile
+
+METADATA_VALUE_LIMIT = 256 * 1024      # bytes per metadata value
+METADATA_TOTAL_LIMIT = 512 * 1024      # bytes for all of an instance's metadata
+BOOTSTRAP_ALLOWANCE = 16 * 1024        # kept free for the startup script and other keys
+
+# Packages the bootstrap falls back to installing when they cannot be imported
+CLIENT_PACKAGES = 'google-api-python-client google-auth-httplib2'
+CLIENT_IMPORTS = 'googleapiclient, google_auth_httplib2'
+
+# Of the discovery documents bundled with google-api-python-client, only compute is needed
+_DISCOVERY_DOCUMENTS = 'googleapiclient/discovery_cache/documents/'
+_KEPT_DOCUMENTS = {'compute.v1.json'}
+
+
+def _vendored(name):
+    if '__pycache__/' in name or name.endswith('.pyc'):
+        return False
+    if name.startswith(_DISCOVERY_DOCUMENTS):
+        return name[len(_DISCOVERY_DOCUMENTS):] in _KEPT_DOCUMENTS
+    return True
+
+
+def build_bundle(files, wheels=()):
+    """Returns a compressed zip of {archive path: bytes or str}, plus wheel contents under site/."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=9) as bundle:
+        for name, content in sorted(files.items()):
+            bundle.writestr(name, content)
+        for wheel in wheels:
+            with zipfile.ZipFile(wheel) as source:
+                for name in source.namelist():
+                    if _vendored(name):
+                        bundle.writestr(f'site/{name}', source.read(name))
+    return buffer.getvalue()
+
+
+def bundle_metadata(payload, key='bundle', budget=METADATA_TOTAL_LIMIT - BOOTSTRAP_ALLOWANCE):
+    """Splits a bundle into base64 metadata values; returns ({key-N: value}, sha256 hex).
+
+    Raises ValueError when the encoded bundle does not fit in `budget` bytes.
+    """
+    encoded = base64.b64encode(payload).decode()
+    if len(encoded) > budget:
+        raise ValueError(f"Bundle is {len(encoded) // 1024} KB encoded, over the {budget // 1024} KB "
+                         f"metadata budget; vendor fewer wheels or boot from an image that has them")
+    values = {f'{key}-{i}': encoded[start:start + METADATA_VALUE_LIMIT]
+              for i, start in enumerate(range(0, len(encoded), METADATA_VALUE_LIMIT))}
+    return values, hashlib.sha256(payload).hexdigest()
+
+
+def bootstrap_script(key, parts, sha256, command, workdir='/srv'):
+    """Returns a startup script that unpacks the bundle into workdir and runs command there."""
+    fetch = '\n'.join(
+        f'curl -sf -H "Metadata-Flavor: Google" "$METADATA/{key}-{i}" >> bundle.b64' for i in range(parts))
+    return f"""#!/bin/bash
+set -e
+METADATA=http://metadata.google.internal/computeMetadata/v1/instance/attributes
+mkdir -p {workdir}
+cd {workdir}
+: > bundle.b64
+{fetch}
+base64 -d bundle.b64 > bundle.zip
+echo "{sha256}  bundle.zip" | sha256sum -c --quiet -
+python3 -m zipfile -e bundle.zip .
+rm bundle.b64 bundle.zip
+
+[ -d site ] && export PYTHONPATH={workdir}/site
+if ! python3 -c 'import {CLIENT_IMPORTS}' 2>/dev/null; then
+    command -v pip3 >/dev/null || (apt-get update && apt-get install -y python3-pip)
+    pip3 install {CLIENT_PACKAGES}
+fi
+{command}
+"""
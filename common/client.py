@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""Shared, lazily built Compute Engine client.
+
+Credentials and the discovery document are not touched at import time. The
+first get_compute() call in a process loads them once, and each
+thread then gets its own client bound to its own authorized HTTP transport.
+httplib2 keeps connections alive per transport, so repeated calls from a
+thread reuse one pooled connection, and worker threads never share a
+transport (which is not thread-safe).
+
+The discovery document comes from the copy bundled with
+google-api-python-client, or else from a cache file on local disk that is
+filled from the network on first use. cold_start_report() says how long the
+process took from importing this module to its first completed API call.
+"""
+
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import google.auth
+import google.oauth2.service_account as service_account
+import google_auth_httplib2
+import httplib2
+from googleapiclient import discovery, discovery_cache
+from googleapiclient.http import HttpRequest
+
+from common import ratelimit, tracing
+
+_IMPORTED_AT = time.monotonic()
+
+DISCOVERY_URL = 'https://compute.googleapis.com/$discovery/rest?version=v1'
+DISCOVERY_CACHE = os.environ.get(
+    'COMPUTE_DISCOVERY_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'programmable-cloud', 'compute-v1.json'))
+HTTP_TIMEOUT = 60
+
+_lock = threading.Lock()
+_local = threading.local()
+_document = None
+_credentials = {}
+_timings = {}
+
+
+def discovery_document():
+    """Returns the parsed compute v1 discovery document, loading it once per process."""
+    global _document
+    with _lock:
+        if _document is None:
+            _document = json.loads(_read_discovery_document())
+            _timings.setdefault('discovery', time.monotonic())
+        return _document
+
+
+def _read_discovery_document():
+    content = discovery_cache.get_static_doc('compute', 'v1')
+    if content:
+        return content
+    try:
+        with open(DISCOVERY_CACHE) as f:
+            return f.read()
+    except OSError:
+        pass
+
+    response, content = httplib2.Http(timeout=HTTP_TIMEOUT).request(DISCOVERY_URL)
+    if response.status != 200:
+        raise RuntimeError(f"Fetching {DISCOVERY_URL} failed with HTTP {response.status}")
+    os.makedirs(os.path.dirname(DISCOVERY_CACHE), exist_ok=True)
+    with open(DISCOVERY_CACHE, 'wb') as f:
+        f.write(content)
+    return content.decode()
+
+
+def get_credentials(credentials_file=None):
+    """Loads (once) service-account credentials from a file, or the application defaults."""
+    with _lock:
+        if credentials_file not in _credentials:
+            if credentials_file:
+                _credentials[credentials_file] = service_account.Credentials.from_service_account_file(
+                    credentials_file, scopes=['https://www.googleapis.com/auth/cloud-platform'])
+            else:
+                _credentials[credentials_file], _ = google.auth.default(
+                    scopes=['https://www.googleapis.com/auth/cloud-platform'])
+        return _credentials[credentials_file]
+
+
+def build_compute(credentials_file=None):
+    """Builds a new client with its own authorized HTTP transport."""
+    http = google_auth_httplib2.AuthorizedHttp(get_credentials(credentials_file),
+                                               http=httplib2.Http(timeout=HTTP_TIMEOUT))
+    compute = discovery.build_from_document(discovery_document(), http=http,
+                                            requestBuilder=TimedHttpRequest)
+    _timings.setdefault('client', time.monotonic())
+    return compute
+
+
+def get_compute(credentials_file=None):
+    """Returns this thread's client, building it on first use."""
+    clients = _local.__dict__.setdefault('clients', {})
+    if credentials_file not in clients:
+        clients[credentials_file] = build_compute(credentials_file)
+    return clients[credentials_file]
+
+
+def cold_start_report():
+    """Returns a one-line summary of the time from import to client build and first API call."""
+    parts = []
+    for key, label in (('discovery', 'discovery loaded'), ('client', 'client built'),
+                       ('first_call', 'first API call done')):
+        if key in _timings:
+            parts.append(f"{label} {(_timings[key] - _IMPORTED_AT) * 1000:.0f} ms")
+    return 'cold start: ' + (', '.join(parts) if parts else 'no client built') + ' after import'
+
+
+class TimedHttpRequest(HttpRequest):
+    """HttpRequest that notes when the first API call of the process completes.
+
+    Each call first waits for the shared rate limiter. When tracing is on,
+    each call is also recorded as a span, with its retries counted from the
+    transport's backoff sleeps.
+    """
+
+    def execute(self, http=None, num_retries=0):
+        execute = super().execute
+        if tracing.enabled():
+            retries = []
+            sleep = self._sleep
+            self._sleep = lambda seconds: (retries.append(seconds), sleep(seconds))
+            call = lambda: tracing.traced_call(self.methodId, urlparse(self.uri).path,
+                                               lambda: execute(http=http, num_retries=num_retries), retries)
+        else:
+            call = lambda: execute(http=http, num_retries=num_retries)
+        result = ratelimit.limiter().call(self.methodId, call)
+        _timings.setdefault('first_call', time.monotonic())
+        return result
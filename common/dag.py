@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""Run provisioning steps as a dependency graph instead of a fixed sequence.
+
+Each step names the steps it depends on. Steps whose prerequisites are done
+run concurrently in a thread pool, each with its own client. A step either:
+- does its work and returns a value, or
+- starts API calls and returns their operation(s). It then stays running
+  until those operations are DONE.
+
+The main thread tracks every outstanding operation in one OperationWaiter,
+whether global, regional or zonal. So a dependent step starts as soon as
+its prerequisites' operations finish, and no thread blocks on a wait.
+
+After the run, report() lists each step's start and end and the critical
+path: the chain of steps that decided the total time.
+"""
+
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from common import tracing
+from common.operations import OperationWaiter
+
+WORKERS = 8     # steps running API calls at once
+
+
+class StepFailed(Exception):
+    """One or more steps raised or had a failed operation; their dependents were skipped."""
+
+    def __init__(self, failures, skipped):
+        self.failures = failures
+        self.skipped = skipped
+        details = '; '.join(f'{name}: {error}' for name, error in failures.items())
+        super().__init__(f"Steps failed: {details}" + (f" (skipped {', '.join(skipped)})" if skipped else ''))
+
+
+def _operations(value):
+    # The operations a step returned, if it returned any
+    if isinstance(value, dict) and value.get('kind') == 'compute#operation':
+        return [value]
+    if isinstance(value, (list, tuple)) and value and all(
+            isinstance(v, dict) and v.get('kind') == 'compute#operation' for v in value):
+        return list(value)
+    return []
+
+
+class Graph:
+    """Steps with dependencies, run with as much concurrency as the dependencies allow."""
+
+    def __init__(self):
+        self.steps = {}     # name -> (fn, deps)
+        self.results = {}
+        self.started = {}
+        self.finished = {}
+
+    def add(self, name, fn, deps=()):
+        """Adds a step; fn(compute, results) runs once every step in deps is done.
+
+        results maps each finished step to its return value, with returned
+        operations replaced by their final (DONE) state.
+        """
+        missing = [dep for dep in deps if dep not in self.steps]
+        if missing:
+            raise ValueError(f"Step {name} depends on unknown steps: {', '.join(missing)}")
+        self.steps[name] = (fn, tuple(deps))
+        return name
+
+    def run(self, compute_factory, project, workers=WORKERS, log=print):
+        """Runs every step and returns {step: result}; raises StepFailed if any step failed."""
+        blocked = {name: set(deps) for name, (_, deps) in self.steps.items()}
+        dependents = {name: [other for other, (_, deps) in self.steps.items() if name in deps]
+                      for name in self.steps}
+        failures = {}
+        skipped = []
+        running = {}        # future -> step
+        waiting = {}        # operation name -> step
+        outstanding = {}    # step -> {operation name: final state, or None while running}
+        single = {}         # step -> whether it returned one operation rather than a list
+        self.start = time.monotonic()
+
+        def finish(name, error=None):
+            self.finished[name] = time.monotonic()
+            tracing.event('dag.step', step=name, started=self.started[name] - self.start,
+                          duration=self.finished[name] - self.started[name], failed=error is not None)
+            if error is not None:
+                failures[name] = error
+                log(f"Step {name} failed after {self.finished[name] - self.started[name]:.2f}s: {error}")
+                skip(name)
+                return
+            log(f"Step {name} done in {self.finished[name] - self.started[name]:.2f}s")
+            for other in dependents[name]:
+                blocked[other].discard(name)
+                if not blocked[other] and other not in skipped:
+                    submit(other)
+
+        def skip(name):
+            for other in dependents[name]:
+                if other not in skipped:
+                    skipped.append(other)
+                    skip(other)
+
+        def operation_done(result):
+            name = waiting.pop(result['name'])
+            operations = outstanding[name]
+            operations[result['name']] = result
+            if any(op is None for op in operations.values()):
+                return
+            finished = list(operations.values())
+            self.results[name] = finished[0] if single[name] else finished
+            errors = [f"{e.get('code')}: {e.get('message')}"
+                      for op in finished for e in op.get('error', {}).get('errors', [])]
+            finish(name, '; '.join(errors) if errors else None)
+
+        def run_step(name, fn):
+            with tracing.span('dag.run', step=name):
+                return fn(compute_factory(), self.results)
+
+        waiter = OperationWaiter(compute_factory(), project, raise_on_error=False, on_done=operation_done,
+                                 log=log)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            def submit(name):
+                self.started[name] = time.monotonic()
+                running[pool.submit(run_step, name, self.steps[name][0])] = name
+
+            for name in [name for name, deps in blocked.items() if not deps]:
+                submit(name)
+            while running or waiter.pending:
+                for future in [f for f in running if f.done()]:
+                    name = running.pop(future)
+                    try:
+                        value = future.result()
+                    except Exception as e:
+                        finish(name, f'{type(e).__name__}: {e}')
+                        continue
+                    operations = _operations(value)
+                    if not operations:
+                        self.results[name] = value
+                        finish(name)
+                        continue
+                    single[name] = isinstance(value, dict)
+                    outstanding[name] = {operation['name']: None for operation in operations}
+                    waiting.update((operation['name'], name) for operation in operations)
+                    for operation in operations:
+                        waiter.add(operation)
+                if waiter.pending:
+                    waiter.poll()
+                if running:
+                    wait(running, timeout=waiter.next_delay() if waiter.pending else None,
+                         return_when=FIRST_COMPLETED)
+                elif waiter.pending:
+                    time.sleep(waiter.next_delay())
+        self.end = time.monotonic()
+        if failures or skipped:
+            raise StepFailed(failures, skipped)
+        return self.results
+
+    def critical_path(self):
+        """Returns the chain of finished steps, first to last, that ended the run."""
+        if not self.finished:
+            return []
+        path = [max(self.finished, key=self.finished.get)]
+        while True:
+            deps = [dep for dep in self.steps[path[-1]][1] if dep in self.finished]
+            if not deps:
+                return path[::-1]
+            path.append(max(deps, key=self.finished.get))
+
+    def report(self):
+        """Returns text lines with each step's timing and the critical path."""
+        lines = ['| step | depends on | start (s) | end (s) | duration (s) |',
+                 '|------|------------|-----------|---------|--------------|']
+        for name in sorted(self.started, key=self.started.get):
+            end = self.finished.get(name)
+            lines.append(f"| {name} | {', '.join(self.steps[name][1]) or '-'} "
+                         f"| {self.started[name] - self.start:.2f} "
+                         f"| {'-' if end is None else f'{end - self.start:.2f}'} "
+                         f"| {'-' if end is None else f'{end - self.started[name]:.2f}'} |")
+        path = self.critical_path()
+        if path:
+            chain = ' -> '.join(f'{name} ({self.finished[name] - self.started[name]:.2f}s)' for name in path)
+            lines.append(f"critical path: {chain}, "
+                         f"{self.finished[path[-1]] - self.start:.2f}s of {self.end - self.start:.2f}s total")
+        return lines
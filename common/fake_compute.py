@@ -0,0 +1,661 @@
+#!/usr/bin/env python3
+"""In-memory stand-in for the Compute Engine v1 client.
+
+FakeCompute mirrors the ``compute.<collection>().<method>(**kwargs).execute()``
+call shape of googleapiclient, so the provisioning code in part1/part2/part3
+can run locally without a GCP project. Long-running calls return operations
+that reach DONE after a configurable latency. Every API method executed is
+counted in ``calls``, and every HTTP exchange in ``round_trips`` (a batch of
+requests is one round trip), so callers can check what a flow costs.
+"""
+
+import copy
+import datetime
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from common import ratelimit, tracing
+
+API_ROOT = 'https://www.googleapis.com/compute/v1'
+
+# Longest a fake *Operations().wait call blocks, like the real ~2 minute cap
+WAIT_TIMEOUT = 120
+
+
+def http_error(status, reason, message='', headers=None):
+    """Builds an HttpError shaped like the ones googleapiclient raises."""
+    message = message or reason
+    content = json.dumps({'error': {
+        'code': status,
+        'message': message,
+        'errors': [{'reason': reason, 'message': message}],
+    }})
+    return HttpError(httplib2.Response({'status': status, **(headers or {})}), content.encode(),
+                     uri='fake://compute')
+
+
+def _timestamp():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+class FakeRequest:
+    """A deferred call; nothing happens until execute()."""
+
+    def __init__(self, fake, method, kwargs):
+        self.fake = fake
+        self.method = method
+        self.kwargs = kwargs
+
+    def execute(self, http=None, num_retries=0):
+        call = lambda: self.fake.call(self.method, self.kwargs)
+        if tracing.enabled():
+            resource = '/'.join(f'{key}/{value}' for key, value in self.kwargs.items() if key != 'body')
+            call = lambda: tracing.traced_call(f'compute.{self.method}', resource,
+                                               lambda: self.fake.call(self.method, self.kwargs))
+        return ratelimit.limiter().call(f'compute.{self.method}', call)
+
+
+class FakeBatch:
+    """What ``compute.new_batch_http_request()`` returns; execute() is one round trip."""
+
+    def __init__(self, fake, callback=None):
+        self.fake = fake
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        request_id = request_id or str(len(self.requests) + 1)
+        self.requests.append((request_id, request, callback or self.callback))
+
+    def execute(self, http=None):
+        with self.fake.lock:
+            self.fake.round_trips += 1
+        for request_id, request, callback in self.requests:
+            try:
+                response, exception = self.fake.call(request.method, request.kwargs, round_trip=False), None
+            except HttpError as e:
+                response, exception = None, e
+            if callback:
+                callback(request_id, response, exception)
+
+
+class FakeCollection:
+    """What ``compute.instances()`` and friends return."""
+
+    def __init__(self, fake, name):
+        self._fake = fake
+        self._name = name
+
+    def __getattr__(self, method):
+        if method.endswith('_next'):
+            return self._next_page
+        if not hasattr(self._fake, f'_{self._name}_{method}'):
+            raise AttributeError(f'{self._name}.{method} is not implemented by FakeCompute')
+
+        def build(**kwargs):
+            return FakeRequest(self._fake, f'{self._name}.{method}', kwargs)
+        return build
+
+    def _next_page(self, previous_request, previous_response):
+        token = previous_response.get('nextPageToken')
+        if not token:
+            return None
+        return FakeRequest(self._fake, previous_request.method, {**previous_request.kwargs, 'pageToken': token})
+
+
+class FakeCompute:
+    """Thread-safe fake of the handful of Compute API methods these scripts use.
+
+    ``latency`` is the number of seconds an operation stays RUNNING; it may
+    also be a callable ``latency(method, kwargs)`` returning seconds. ``jitter``
+    adds up to that many random seconds on top. Instances get ``nat_ip`` as
+    their external address when it is set, otherwise a TEST-NET address.
+
+    Failures can be injected too: each call raises a transient 503 with
+    probability ``error_rate``, and inserts that would take a project past
+    ``quota`` instances are rejected with 403 quotaExceeded. ``boot_latency``
+    is how long after reaching RUNNING an instance counts as serving (see
+    is_serving()), standing in for the startup script.
+
+    Zones can differ: ``zone_latency`` maps a zone to its operation latency
+    (instead of ``latency``), ``stockouts`` maps a zone to the probability
+    that an insert there fails with ZONE_RESOURCE_POOL_EXHAUSTED, and
+    ``cpu_quota`` is the CPUS quota per region (one CPU per instance), over
+    which inserts fail with QUOTA_EXCEEDED. regions().get reports both quotas.
+
+    ``rate_limits`` maps 'read' and/or 'mutate' to the calls per second the
+    project may make, counted over a sliding window of ``rate_window``
+    seconds (GCE counts per minute, so a batch may burst above the per-second
+    rate as long as the window's total stays under). Calls over the limit, including those inside a batch, fail with 429
+    rateLimitExceeded and a Retry-After header; ``rate_limited`` counts them.
+
+    Instances can be stopped and started again (TERMINATED -> RUNNING, which
+    reruns the startup script and so waits out boot_latency again) or
+    suspended and resumed (SUSPENDED -> RUNNING, serving straight away).
+
+    ``boot_phases`` lists (marker, seconds after RUNNING) for the startup
+    script's boot-phase markers. Each boot prints them to the serial console
+    (see instances().getSerialPortOutput) and sets them as boot/<marker>
+    guest attributes, each at its time.
+    """
+
+    COLLECTIONS = (
+        'instances', 'instanceTemplates', 'disks', 'snapshots', 'images', 'firewalls', 'regions',
+        'zoneOperations', 'regionOperations', 'globalOperations',
+    )
+
+    def __init__(self, latency=1.0, jitter=0.0, nat_ip=None, seed=0, error_rate=0.0, quota=None,
+                 boot_latency=0.0, zone_latency=None, stockouts=None, cpu_quota=None, rate_limits=None,
+                 rate_window=1.0, boot_phases=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.nat_ip = nat_ip
+        self.error_rate = error_rate
+        self.quota = quota
+        self.boot_latency = boot_latency
+        self.boot_phases = boot_phases or []
+        self.zone_latency = zone_latency or {}
+        self.stockouts = stockouts or {}
+        self.cpu_quota = cpu_quota
+        self.rate_limits = rate_limits or {}
+        self.rate_window = rate_window
+        self.rate_limited = 0
+        self._recent = {bucket: deque() for bucket in self.rate_limits}
+        self.calls = Counter()
+        self.round_trips = 0
+        self.lock = threading.RLock()
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._operations = {}
+        self._started = {}
+        self._guest_attributes = {}
+        self._console = {}          # (project, zone, name) -> serial port 1 output
+        self._boot_markers = {}     # (project, zone, name) -> [(due, marker)] not printed yet
+        self._resources = {name: {} for name in
+                           ('instances', 'instanceTemplates', 'disks', 'snapshots', 'images', 'firewalls')}
+
+    def __getattr__(self, name):
+        if name in self.COLLECTIONS:
+            return lambda: FakeCollection(self, name)
+        raise AttributeError(name)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def call(self, method, kwargs, round_trip=True):
+        collection, name = method.split('.')
+        if name == 'wait':
+            self._block_until_done(kwargs['operation'])
+        with self.lock:
+            self.calls[method] += 1
+            if round_trip:
+                self.round_trips += 1
+            self._advance()
+            if self.error_rate and self._random.random() < self.error_rate:
+                raise http_error(503, 'backendError', 'Injected transient error')
+            self._check_rate(method)
+            result = getattr(self, f'_{collection}_{name}')(**kwargs)
+            return copy.deepcopy(result)
+
+    def _check_rate(self, method):
+        bucket, _ = ratelimit.classify(method)
+        if bucket not in self.rate_limits:
+            return
+        now = time.monotonic()
+        recent = self._recent[bucket]
+        while recent and recent[0] <= now - self.rate_window:
+            recent.popleft()
+        if len(recent) >= self.rate_limits[bucket] * self.rate_window:
+            self.rate_limited += 1
+            raise http_error(429, 'rateLimitExceeded',
+                             f"Rate limit exceeded for {bucket} requests: {self.rate_limits[bucket]} per second",
+                             headers={'retry-after': str(max(1, round(recent[0] + self.rate_window - now)))})
+        recent.append(now)
+
+    # -- seeding helpers ---------------------------------------------------
+
+    def add_instance(self, project, zone, name, status='RUNNING', **fields):
+        """Seeds an existing instance (and its boot disk) without an operation."""
+        with self.lock:
+            instance = self._new_instance(project, zone, {'name': name, **fields})
+            instance['status'] = status
+            self._assign_nat_ip(instance)
+            return instance
+
+    def set_guest_attribute(self, project, zone, name, key, value):
+        """Sets a guest attribute, as software on the VM would through the metadata server."""
+        with self.lock:
+            self._guest_attributes[(project, zone, name, key)] = value
+
+    def is_serving(self, project, zone, name):
+        """True once the instance has been RUNNING for boot_latency seconds."""
+        with self.lock:
+            self._advance()
+            instance = self._resources['instances'].get((project, zone, name))
+            if not instance or instance['status'] != 'RUNNING':
+                return False
+            started = self._started.get((project, zone, name))
+            return started is None or time.monotonic() - started >= self.boot_latency
+
+    # -- operations --------------------------------------------------------
+
+    def _start_operation(self, method, kwargs, target_link, on_done=None, zone=None, error=None):
+        if zone in self.zone_latency:
+            delay = self.zone_latency[zone]
+        else:
+            delay = self.latency(method, kwargs) if callable(self.latency) else self.latency
+        delay += self._random.uniform(0, self.jitter) if self.jitter else 0
+        op_id = next(self._ids)
+        op = {
+            'kind': 'compute#operation',
+            'id': str(op_id),
+            'name': f'operation-{op_id}',
+            'operationType': method.split('.')[1],
+            'targetLink': target_link,
+            'status': 'RUNNING',
+            'progress': 0,
+            'insertTime': _timestamp(),
+            'startTime': _timestamp(),
+        }
+        if zone:
+            op['zone'] = f'{API_ROOT}/projects/{kwargs["project"]}/zones/{zone}'
+        op['selfLink'] = f'{target_link.rsplit("/", 2)[0]}/operations/{op["name"]}'
+        self._operations[op['name']] = {
+            'op': op, 'done_at': time.monotonic() + delay, 'on_done': on_done, 'error': error,
+        }
+        if delay <= 0:
+            self._advance()
+        return op
+
+    def _advance(self):
+        now = time.monotonic()
+        for key, markers in self._boot_markers.items():
+            while markers and markers[0][0] <= now:
+                due, marker = markers.pop(0)
+                stamp = f'{time.time() - (now - due):.6f}'
+                self._console[key] += f'google_metadata_script_runner: startup-script: BOOT-PHASE {marker} {stamp}\n'
+                self._guest_attributes[(*key, f'boot/{marker}')] = stamp
+        for entry in self._operations.values():
+            op = entry['op']
+            if op['status'] != 'DONE' and entry['done_at'] <= now:
+                op.update(status='DONE', progress=100, endTime=_timestamp())
+                if entry['error']:
+                    op['error'] = {'errors': [entry['error']]}
+                elif entry['on_done']:
+                    entry['on_done']()
+
+    def _block_until_done(self, name):
+        with self.lock:
+            entry = self._operations.get(name)
+            remaining = entry['done_at'] - time.monotonic() if entry else 0
+        if remaining > 0:
+            time.sleep(min(remaining, WAIT_TIMEOUT))
+
+    def _get_operation(self, operation, **_):
+        if operation not in self._operations:
+            raise http_error(404, 'notFound', f'The resource operation {operation} was not found')
+        return self._operations[operation]['op']
+
+    _zoneOperations_get = _zoneOperations_wait = _get_operation
+    _regionOperations_get = _regionOperations_wait = _get_operation
+    _globalOperations_get = _globalOperations_wait = _get_operation
+
+    # -- resources ---------------------------------------------------------
+
+    def _lookup(self, kind, project, scope, name):
+        try:
+            return self._resources[kind][(project, scope, name)]
+        except KeyError:
+            raise http_error(404, 'notFound', f"The resource '{kind}/{name}' was not found") from None
+
+    def _store(self, kind, project, scope, resource):
+        key = (project, scope, resource['name'])
+        if key in self._resources[kind]:
+            raise http_error(409, 'alreadyExists', f"The resource '{kind}/{resource['name']}' already exists")
+        resource.setdefault('id', str(next(self._ids)))
+        resource.setdefault('creationTimestamp', _timestamp())
+        where = 'global' if scope == 'global' else f'zones/{scope}'
+        resource['selfLink'] = f'{API_ROOT}/projects/{project}/{where}/{kind}/{resource["name"]}'
+        self._resources[kind][key] = resource
+        return resource
+
+    def _list(self, kind, project, scope, maxResults=500, pageToken=None):
+        items = [r for (p, s, _), r in self._resources[kind].items() if p == project and s == scope]
+        result = {'kind': f'compute#{kind}List', 'id': f'projects/{project}/{kind}'}
+        start = int(pageToken or 0)
+        page = items[start:start + maxResults]
+        if page:
+            result['items'] = page
+        if start + maxResults < len(items):
+            result['nextPageToken'] = str(start + maxResults)
+        return result
+
+    def _assign_nat_ip(self, instance):
+        for nic in instance.get('networkInterfaces', []):
+            for access in nic.get('accessConfigs', []):
+                access.setdefault('natIP', self.nat_ip or f'203.0.113.{int(instance["id"]) % 254 + 1}')
+
+    def _new_instance(self, project, zone, body):
+        instance = copy.deepcopy(body)
+        instance.update(kind='compute#instance', status='PROVISIONING',
+                        zone=f'{API_ROOT}/projects/{project}/zones/{zone}')
+        self._store('instances', project, zone, instance)
+        disk = {'name': instance['name'], 'sizeGb': '10', 'status': 'READY',
+                'users': [instance['selfLink']]}
+        if (project, zone, disk['name']) not in self._resources['disks']:
+            self._store('disks', project, zone, disk)
+        return instance
+
+    def _check_boot_source(self, project, params):
+        snapshot = params.get('sourceSnapshot')
+        if snapshot:
+            self._lookup('snapshots', project, 'global', snapshot.rsplit('/', 1)[-1])
+        image = params.get('sourceImage', '')
+        # Public images (other projects) are assumed to exist
+        if image.startswith((f'projects/{project}/global/images/', 'global/images/')):
+            if '/family/' in image:
+                self._images_getFromFamily(project, image.rsplit('/', 1)[-1])
+            else:
+                self._lookup('images', project, 'global', image.rsplit('/', 1)[-1])
+
+    def _template_properties(self, project, zone, template_url):
+        template = self._lookup('instanceTemplates', project, 'global', template_url.rsplit('/', 1)[-1])
+        return self._zonal_properties(zone, template['properties'])
+
+    @staticmethod
+    def _zonal_properties(zone, properties):
+        # Templates and bulkInsert take a bare machine type; instances store the zonal URL
+        properties = copy.deepcopy(properties)
+        properties['machineType'] = f'zones/{zone}/machineTypes/{properties["machineType"]}'
+        return properties
+
+    def _mark_running(self, instance, boot=True):
+        instance.update(status='RUNNING', lastStartTimestamp=_timestamp())
+        self._assign_nat_ip(instance)
+        project, zone = instance['zone'].split('/')[-3::2]
+        key = (project, zone, instance['name'])
+        self._started[key] = now = time.monotonic()
+        if boot:
+            self._console[key] = self._console.get(key, '') + f"Booting {instance['name']}\n"
+            self._boot_markers[key] = [(now + seconds, marker) for marker, seconds in self.boot_phases]
+
+    def _quota_left(self, project):
+        if self.quota is None:
+            return None
+        return self.quota - sum(1 for (p, _, _) in self._resources['instances'] if p == project)
+
+    def _check_quota(self, project, count):
+        left = self._quota_left(project)
+        if left is not None and left < count:
+            raise http_error(403, 'quotaExceeded',
+                             f"Quota 'INSTANCES' exceeded. Limit: {self.quota} in project {project}")
+
+    def _instances_insert(self, project, zone, body, sourceInstanceTemplate=None):
+        if sourceInstanceTemplate:
+            body = {**self._template_properties(project, zone, sourceInstanceTemplate), **body}
+        for disk in body.get('disks', []):
+            self._check_boot_source(project, disk.get('initializeParams', {}))
+        self._check_quota(project, 1)
+        error = self._placement_error(project, zone)
+        if error:
+            # The insert is accepted, then the operation fails and no instance is left behind
+            return self._start_operation('instances.insert', {'project': project},
+                                         f'{API_ROOT}/projects/{project}/zones/{zone}/instances/{body["name"]}',
+                                         zone=zone, error=error)
+        instance = self._new_instance(project, zone, body)
+        return self._start_operation('instances.insert', {'project': project}, instance['selfLink'],
+                                     on_done=lambda: self._mark_running(instance), zone=zone)
+
+    def _region_usage(self, project, region):
+        return sum(1 for (p, zone, _) in self._resources['instances']
+                   if p == project and zone.rsplit('-', 1)[0] == region)
+
+    def _placement_error(self, project, zone):
+        if self._random.random() < self.stockouts.get(zone, 0):
+            return {'code': 'ZONE_RESOURCE_POOL_EXHAUSTED',
+                    'message': f"The zone '{zone}' does not have enough resources available"}
+        region = zone.rsplit('-', 1)[0]
+        if self.cpu_quota is not None and self._region_usage(project, region) >= self.cpu_quota:
+            return {'code': 'QUOTA_EXCEEDED',
+                    'message': f"Quota 'CPUS' exceeded. Limit: {self.cpu_quota} in region {region}."}
+        return None
+
+    def _regions_get(self, project, region):
+        usage = self._region_usage(project, region)
+        quotas = [{'metric': 'CPUS', 'limit': float(self.cpu_quota if self.cpu_quota is not None else 1000),
+                   'usage': float(usage)},
+                  # The fake's instance quota is project-wide, so its usage is too
+                  {'metric': 'INSTANCES', 'limit': float(self.quota if self.quota is not None else 10000),
+                   'usage': float(sum(1 for (p, _, _) in self._resources['instances'] if p == project))}]
+        return {'kind': 'compute#region', 'name': region, 'status': 'UP', 'quotas': quotas,
+                'selfLink': f'{API_ROOT}/projects/{project}/regions/{region}'}
+
+    def _instances_bulkInsert(self, project, zone, body):
+        if body.get('sourceInstanceTemplate'):
+            properties = self._template_properties(project, zone, body['sourceInstanceTemplate'])
+        elif body.get('instanceProperties'):
+            properties = self._zonal_properties(zone, body['instanceProperties'])
+        else:
+            raise http_error(400, 'invalid', 'instanceProperties or sourceInstanceTemplate is required')
+        named = body.get('perInstanceProperties', {})
+        pattern = body.get('namePattern')
+        count = body['count']
+        if len(named) > count or (not pattern and len(named) != count):
+            raise http_error(400, 'invalid', 'count must match perInstanceProperties unless namePattern is set')
+        for disk in properties.get('disks', []):
+            self._check_boot_source(project, disk.get('initializeParams', {}))
+
+        names = list(named)
+        if pattern:
+            run = max(re.findall('#+', pattern), key=len)
+            for number in itertools.count(1):
+                if len(names) == count:
+                    break
+                name = pattern.replace(run, str(number).zfill(len(run)), 1)
+                if name not in names and (project, zone, name) not in self._resources['instances']:
+                    names.append(name)
+        # Like the real API, create as many as quota allows, but at least minCount
+        self._check_quota(project, body.get('minCount') or count)
+        left = self._quota_left(project)
+        if left is not None:
+            names = names[:left]
+        taken = [name for name in names if (project, zone, name) in self._resources['instances']]
+        if taken:
+            raise http_error(409, 'alreadyExists', f"The resource 'instances/{taken[0]}' already exists")
+        instances = [self._new_instance(project, zone, {**properties, **named.get(name, {}), 'name': name})
+                     for name in names]
+
+        status = {'targetVmCount': count, 'createdVmCount': 0, 'failedToCreateVmCount': 0,
+                  'deletedVmCount': 0, 'rolledBackVmCount': 0}
+
+        def running():
+            for instance in instances:
+                self._mark_running(instance)
+            status['createdVmCount'] = len(instances)
+        operation = self._start_operation('instances.bulkInsert', {'project': project},
+                                          f'{API_ROOT}/projects/{project}/zones/{zone}/instances',
+                                          on_done=running, zone=zone)
+        operation['selfLink'] = f'{API_ROOT}/projects/{project}/zones/{zone}/operations/{operation["name"]}'
+        operation['instancesBulkInsertOperationMetadata'] = {'perLocationStatus': {f'zones/{zone}': status}}
+        return operation
+
+    def _instances_get(self, project, zone, instance):
+        return self._lookup('instances', project, zone, instance)
+
+    def _instances_list(self, project, zone, maxResults=500, pageToken=None, **_):
+        return self._list('instances', project, zone, maxResults, pageToken)
+
+    def _instances_aggregatedList(self, project, maxResults=500, pageToken=None, **_):
+        found = [(z, r) for (p, z, _), r in self._resources['instances'].items() if p == project]
+        start = int(pageToken or 0)
+        result = {'kind': 'compute#instanceAggregatedList', 'items': {}}
+        for zone, instance in found[start:start + maxResults]:
+            result['items'].setdefault(f'zones/{zone}', {'instances': []})['instances'].append(instance)
+        if start + maxResults < len(found):
+            result['nextPageToken'] = str(start + maxResults)
+        return result
+
+    def _instances_getGuestAttributes(self, project, zone, instance, variableKey=None, queryPath=None):
+        self._lookup('instances', project, zone, instance)
+        if variableKey:
+            if (project, zone, instance, variableKey) not in self._guest_attributes:
+                raise http_error(404, 'notFound', f'The guest attribute {variableKey} was not found')
+            return {'kind': 'compute#guestAttributes', 'variableKey': variableKey,
+                    'variableValue': self._guest_attributes[(project, zone, instance, variableKey)]}
+        items = [{'namespace': key.split('/')[0], 'key': key.split('/', 1)[-1], 'value': value}
+                 for (p, z, i, key), value in self._guest_attributes.items()
+                 if (p, z, i) == (project, zone, instance) and key.startswith(queryPath or '')]
+        return {'kind': 'compute#guestAttributes', 'queryPath': queryPath, 'queryValue': {'items': items}}
+
+    def _instances_getSerialPortOutput(self, project, zone, instance, port=1, start=0):
+        resource = self._lookup('instances', project, zone, instance)
+        contents = self._console.get((project, zone, instance), '') if int(port) == 1 else ''
+        start = min(int(start), len(contents))
+        return {'kind': 'compute#serialPortOutput', 'contents': contents[start:], 'start': str(start),
+                'next': str(len(contents)), 'selfLink': f"{resource['selfLink']}/serialPort"}
+
+    def _instances_stop(self, project, zone, instance):
+        resource = self._lookup('instances', project, zone, instance)
+        resource['status'] = 'STOPPING'
+        return self._start_operation('instances.stop', {'project': project}, resource['selfLink'],
+                                     on_done=lambda: resource.update(status='TERMINATED'), zone=zone)
+
+    def _instances_start(self, project, zone, instance):
+        resource = self._lookup('instances', project, zone, instance)
+        if resource['status'] != 'TERMINATED':
+            raise http_error(400, 'resourceNotReady', f"The instance '{instance}' is {resource['status']}")
+        resource['status'] = 'STAGING'
+        return self._start_operation('instances.start', {'project': project}, resource['selfLink'],
+                                     on_done=lambda: self._mark_running(resource), zone=zone)
+
+    def _instances_suspend(self, project, zone, instance):
+        resource = self._lookup('instances', project, zone, instance)
+        if resource['status'] != 'RUNNING':
+            raise http_error(400, 'resourceNotReady', f"The instance '{instance}' is {resource['status']}")
+        resource['status'] = 'SUSPENDING'
+        return self._start_operation('instances.suspend', {'project': project}, resource['selfLink'],
+                                     on_done=lambda: resource.update(status='SUSPENDED'), zone=zone)
+
+    def _instances_resume(self, project, zone, instance):
+        resource = self._lookup('instances', project, zone, instance)
+        if resource['status'] != 'SUSPENDED':
+            raise http_error(400, 'resourceNotReady', f"The instance '{instance}' is {resource['status']}")
+        resource['status'] = 'RESUMING'
+
+        def resumed():
+            # Memory was preserved, so the app is serving again as soon as the VM runs
+            self._mark_running(resource, boot=False)
+            self._started[(project, zone, instance)] = time.monotonic() - self.boot_latency
+        return self._start_operation('instances.resume', {'project': project}, resource['selfLink'],
+                                     on_done=resumed, zone=zone)
+
+    def _instances_delete(self, project, zone, instance):
+        resource = self._lookup('instances', project, zone, instance)
+        resource['status'] = 'STOPPING'
+
+        def deleted():
+            self._resources['instances'].pop((project, zone, instance), None)
+            self._resources['disks'].pop((project, zone, instance), None)
+        return self._start_operation('instances.delete', {'project': project}, resource['selfLink'],
+                                     on_done=deleted, zone=zone)
+
+    def _disks_get(self, project, zone, disk):
+        return self._lookup('disks', project, zone, disk)
+
+    def _disks_createSnapshot(self, project, zone, disk, body):
+        source = self._lookup('disks', project, zone, disk)
+        snapshot = copy.deepcopy(body)
+        snapshot.update(kind='compute#snapshot', status='CREATING', sourceDisk=source['selfLink'],
+                        sourceDiskId=source['id'], diskSizeGb=source['sizeGb'])
+        self._store('snapshots', project, 'global', snapshot)
+        return self._start_operation('disks.createSnapshot', {'project': project}, source['selfLink'],
+                                     on_done=lambda: snapshot.update(status='READY'), zone=zone)
+
+    def _snapshots_get(self, project, snapshot):
+        return self._lookup('snapshots', project, 'global', snapshot)
+
+    def _snapshots_list(self, project, maxResults=500, pageToken=None, **_):
+        return self._list('snapshots', project, 'global', maxResults, pageToken)
+
+    def _snapshots_delete(self, project, snapshot):
+        resource = self._lookup('snapshots', project, 'global', snapshot)
+        return self._start_operation(
+            'snapshots.delete', {'project': project}, resource['selfLink'],
+            on_done=lambda: self._resources['snapshots'].pop((project, 'global', snapshot), None))
+
+    def _firewalls_get(self, project, firewall):
+        return self._lookup('firewalls', project, 'global', firewall)
+
+    def _firewalls_insert(self, project, body):
+        rule = self._store('firewalls', project, 'global', copy.deepcopy(body))
+        return self._start_operation('firewalls.insert', {'project': project}, rule['selfLink'])
+
+    def _firewalls_list(self, project, maxResults=500, pageToken=None, **_):
+        return self._list('firewalls', project, 'global', maxResults, pageToken)
+
+    def _firewalls_delete(self, project, firewall):
+        resource = self._lookup('firewalls', project, 'global', firewall)
+        return self._start_operation(
+            'firewalls.delete', {'project': project}, resource['selfLink'],
+            on_done=lambda: self._resources['firewalls'].pop((project, 'global', firewall), None))
+
+    def _images_insert(self, project, body, forceCreate=False):
+        image = copy.deepcopy(body)
+        image.update(kind='compute#image', status='PENDING')
+        if body.get('sourceDisk'):
+            _, zone, _, disk = body['sourceDisk'].rsplit('/', 3)
+            source = self._lookup('disks', project, zone, disk)
+            if source.get('users') and not forceCreate:
+                raise http_error(400, 'resourceInUseByAnotherResource',
+                                 f"The disk resource '{disk}' is already being used")
+            image['sourceDiskId'] = source['id']
+        elif body.get('sourceSnapshot'):
+            source = self._lookup('snapshots', project, 'global', body['sourceSnapshot'].rsplit('/', 1)[-1])
+            image['sourceSnapshotId'] = source['id']
+        self._store('images', project, 'global', image)
+        return self._start_operation('images.insert', {'project': project}, image['selfLink'],
+                                     on_done=lambda: image.update(status='READY'))
+
+    def _images_get(self, project, image):
+        return self._lookup('images', project, 'global', image)
+
+    def _images_getFromFamily(self, project, family):
+        members = [r for (p, _, _), r in self._resources['images'].items()
+                   if p == project and r.get('family') == family and r['status'] == 'READY'
+                   and not r.get('deprecated')]
+        if not members:
+            raise http_error(404, 'notFound', f"The resource 'images/family/{family}' was not found")
+        return max(members, key=lambda r: (r['creationTimestamp'], int(r['id'])))
+
+    def _images_list(self, project, maxResults=500, pageToken=None, **_):
+        return self._list('images', project, 'global', maxResults, pageToken)
+
+    def _images_delete(self, project, image):
+        resource = self._lookup('images', project, 'global', image)
+        return self._start_operation(
+            'images.delete', {'project': project}, resource['selfLink'],
+            on_done=lambda: self._resources['images'].pop((project, 'global', image), None))
+
+    def _instanceTemplates_insert(self, project, body):
+        template = self._store('instanceTemplates', project, 'global', copy.deepcopy(body))
+        return self._start_operation('instanceTemplates.insert', {'project': project}, template['selfLink'])
+
+    def _instanceTemplates_get(self, project, instanceTemplate):
+        return self._lookup('instanceTemplates', project, 'global', instanceTemplate)
+
+    def _instanceTemplates_list(self, project, maxResults=500, pageToken=None, **_):
+        return self._list('instanceTemplates', project, 'global', maxResults, pageToken)
+
+    def _instanceTemplates_delete(self, project, instanceTemplate):
+        resource = self._lookup('instanceTemplates', project, 'global', instanceTemplate)
+        return self._start_operation(
+            'instanceTemplates.delete', {'project': project}, resource['selfLink'],
+            on_done=lambda: self._resources['instanceTemplates'].pop((project, 'global', instanceTemplate), None))
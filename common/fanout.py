@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""Hierarchical fan-out: launcher VMs that create their children, down a tree.
+
+A FanoutSpec says how many children a launcher creates, how to name them
+and how many levels are left below it. At depth 1 the children are flask
+app VMs. Above that, each child is itself a launcher: it gets the same
+bootstrap bundle (launcher code, shared modules and credentials), and its
+own FanoutSpec with one level less. So a fleet of children ** depth VMs
+is created by many clients in parallel, not by one.
+
+Every launcher inserts its children in one batch HTTP request and waits on
+all the operations in one OperationWaiter. It then waits for its launcher
+children's reports and publishes its own report as the guest attribute
+fanout/report. A report holds each child's timings and, for launchers,
+the child's own report. Reading the root's report therefore yields the
+whole launch tree with its latencies.
+"""
+
+import json
+import os
+import time
+import urllib.request
+from dataclasses import dataclass
+
+import googleapiclient.errors
+
+from common.bundle import bootstrap_script, build_bundle, bundle_metadata
+from common.fleet import batch_execute
+from common.operations import OperationWaiter
+
+LAUNCHER = 'part3/vm1-launch-vm2-code.py'
+# The modules the launcher imports, packed into every launcher's bundle at these paths
+LAUNCHER_MODULES = (
+    'common/__init__.py',
+    'common/bundle.py',
+    'common/client.py',
+    'common/fanout.py',
+    'common/fleet.py',
+    'common/images.py',
+    'common/operations.py',
+    'common/placement.py',
+    'common/ratelimit.py',
+    'common/spec.py',
+    'common/startup.py',
+    'common/tracing.py',
+)
+CREDENTIALS = 'service-credentials.json'    # path of the credentials inside the bundle
+BUNDLE_KEY = 'launcher-bundle'
+REPORT_KEY = 'fanout/report'                # guest attribute namespace/key
+METADATA_SERVER = 'http://metadata.google.internal/computeMetadata/v1/instance'
+REPORT_INTERVAL = 10        # seconds between polls for child reports
+REPORT_DEADLINE = 1800      # seconds to wait for a child launcher's report
+
+
+@dataclass(frozen=True)
+class FanoutSpec:
+    """How many children a launcher creates, what they are called and how deep the tree goes."""
+
+    children: int
+    prefix: str = 'vm2'
+    depth: int = 1
+    image: bool = False     # leaves boot the golden image instead of installing the app
+
+    def names(self):
+        return [f'{self.prefix}-{i}' for i in range(1, self.children + 1)]
+
+    def child(self, name):
+        """The spec a launcher child runs with: its name as prefix, one level less."""
+        return FanoutSpec(self.children, name, self.depth - 1, self.image)
+
+    def args(self):
+        """Command-line arguments for the launcher that runs this spec."""
+        args = f'--children {self.children} --prefix {self.prefix} --depth {self.depth}'
+        return args + ' --image' if self.image else args
+
+
+def launcher_files(root, credentials_path):
+    """Reads the launcher, its modules and the credentials from a checkout (or an unpacked bundle)."""
+    files = {path: open(os.path.join(root, path)).read() for path in (LAUNCHER,) + LAUNCHER_MODULES}
+    files[CREDENTIALS] = open(credentials_path).read()
+    return files
+
+
+def launcher_body(spec, name, zone, files, launch_args='', wheels=(), log=print):
+    """Returns the insert body for a launcher VM that unpacks `files` and runs the launcher."""
+    payload = build_bundle(files, wheels)
+    metadata, sha256 = bundle_metadata(payload, BUNDLE_KEY)
+    log(f"Bootstrap bundle for {name}: {len(payload) / 1024:.1f} KB compressed "
+        f"in {len(metadata)} metadata value(s)")
+    script = bootstrap_script(BUNDLE_KEY, len(metadata), sha256, f'python3 {LAUNCHER} {launch_args}'.strip())
+    metadata['enable-guest-attributes'] = 'TRUE'
+    return spec.body(name, zone, startup_script=script, metadata=metadata)
+
+
+def launch(compute, project, zone, fanout, leaf_body, launcher_body_for, log=print):
+    """Creates one level of the tree and returns this node's report.
+
+    leaf_body(name) and launcher_body_for(name, child_spec) build the insert
+    bodies for app VMs and launcher VMs respectively.
+    """
+    start = time.monotonic()
+    names = fanout.names()
+    launchers = fanout.depth > 1
+    bodies = {name: launcher_body_for(name, fanout.child(name)) if launchers else leaf_body(name)
+              for name in names}
+    children = {name: {'name': name, 'launcher': launchers} for name in names}
+
+    log(f"Creating {len(names)} {'launchers' if launchers else 'VMs'} ({fanout.prefix}-*)")
+    requested = time.monotonic()
+    operations = batch_execute(compute, {
+        name: compute.instances().insert(project=project, zone=zone, body=body) for name, body in bodies.items()})
+    by_operation = {}
+    waiter = OperationWaiter(compute, project, zone, raise_on_error=False, log=log,
+                             on_done=lambda result: _record(children[by_operation[result['name']]], result,
+                                                            requested))
+    for name, operation in operations.items():
+        children[name]['requested'] = round(requested - start, 3)
+        if isinstance(operation, Exception):
+            children[name]['error'] = str(operation)
+            continue
+        by_operation[operation['name']] = name
+        waiter.add(operation)
+    waiter.wait()
+
+    if launchers:
+        created = [name for name in names if 'error' not in children[name]]
+        for name, report in wait_for_reports(compute, project, zone, created, log=log).items():
+            children[name]['report'] = report
+    return {'prefix': fanout.prefix, 'depth': fanout.depth, 'children': list(children.values()),
+            'elapsed': round(time.monotonic() - start, 3)}
+
+
+def _record(child, result, requested):
+    child['created'] = round(time.monotonic() - requested, 3)
+    if 'error' in result:
+        child['error'] = '; '.join(e.get('message', '') for e in result['error'].get('errors', []))
+
+
+def read_report(compute, project, zone, name):
+    """Returns a node's published report, or None if it has not published one yet."""
+    try:
+        response = compute.instances().getGuestAttributes(
+            project=project, zone=zone, instance=name, variableKey=REPORT_KEY).execute()
+    except googleapiclient.errors.HttpError as e:
+        if e.resp.status == 404:
+            return None
+        raise
+    return json.loads(response['variableValue'])
+
+
+def wait_for_reports(compute, project, zone, names, interval=REPORT_INTERVAL, deadline=REPORT_DEADLINE,
+                     log=print):
+    """Polls child launchers until each has published its report; returns {name: report}.
+
+    Children that have not reported by the deadline get {'error': ...} instead.
+    """
+    reports = {}
+    pending = set(names)
+    give_up = time.monotonic() + deadline
+    while pending:
+        responses = batch_execute(compute, {
+            name: compute.instances().getGuestAttributes(project=project, zone=zone, instance=name,
+                                                         variableKey=REPORT_KEY)
+            for name in sorted(pending)})
+        for name, response in responses.items():
+            if isinstance(response, googleapiclient.errors.HttpError) and response.resp.status == 404:
+                continue
+            pending.discard(name)
+            reports[name] = ({'error': str(response)} if isinstance(response, Exception)
+                             else json.loads(response['variableValue']))
+        if pending:
+            if time.monotonic() >= give_up:
+                for name in pending:
+                    reports[name] = {'error': f'no report after {deadline}s'}
+                break
+            log(f"Waiting for reports from {len(pending)} launchers...")
+            time.sleep(interval)
+    return reports
+
+
+def _metadata_request(path, data=None):
+    request = urllib.request.Request(f'{METADATA_SERVER}/{path}', data=data, method='PUT' if data else 'GET',
+                                     headers={'Metadata-Flavor': 'Google'})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return response.read().decode()
+
+
+def node_name():
+    """The name of the VM this code runs on, from the metadata server."""
+    return _metadata_request('name')
+
+
+def publish_report(report):
+    """Publishes this node's report as a guest attribute for its parent to read."""
+    _metadata_request(f'guest-attributes/{REPORT_KEY}', json.dumps(report, separators=(',', ':')).encode())
+
+
+def format_tree(report, name='root', indent='', status=''):
+    """Returns the launch tree as indented text lines with per-child latencies."""
+    summary = f"{len(report.get('children', []))} children in {report.get('elapsed', '?')}s"
+    if 'error' in report:
+        summary = f"ERROR {report['error']}"
+    lines = [f"{indent}{name}: {status + ', ' if status else ''}{summary}"]
+    for child in report.get('children', []):
+        status = f"ERROR {child['error']}" if 'error' in child else f"created in {child.get('created', '?')}s"
+        if 'report' in child:
+            lines.extend(format_tree(child['report'], child['name'], indent + '  ', status))
+        else:
+            lines.append(f"{indent}  {child['name']}: {status}")
+    return lines
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Fleet-level Compute calls that cost a handful of round trips, not one per VM.
+
+list_all() follows nextPageToken through every page instead of keeping only
+the first one, aggregated_instances() lists every zone in one paginated
+call, and batch_execute() sends per-instance gets, stops and deletes as
+batch HTTP requests.
+"""
+
+from collections import Counter
+
+from common import ratelimit, tracing
+
+BATCH_LIMIT = 500  # calls per batch HTTP request
+
+
+def list_all(collection, **params):
+    """Returns the items from every page of ``collection.list(**params)``."""
+    items = []
+    request = collection.list(**params)
+    while request is not None:
+        response = request.execute()
+        items.extend(response.get('items', []))
+        request = collection.list_next(previous_request=request, previous_response=response)
+    return items
+
+
+def aggregated_instances(compute, project, **params):
+    """Returns the instances in every zone of the project, following all pages."""
+    instances = []
+    collection = compute.instances()
+    request = collection.aggregatedList(project=project, **params)
+    while request is not None:
+        response = request.execute()
+        for scoped in response.get('items', {}).values():
+            instances.extend(scoped.get('instances', []))
+        request = collection.aggregatedList_next(previous_request=request, previous_response=response)
+    return instances
+
+
+def batch_execute(compute, requests):
+    """Executes {key: request} in batch HTTP requests; returns {key: response or exception}.
+
+    Every request in a batch counts against the API rate limits, so the
+    whole batch waits for its tokens at once; a batch bigger than a bucket
+    leaves it in debt, which later calls pay off. Requests rejected for rate
+    are retried in a later batch.
+    """
+    keys = dict(enumerate(requests))     # batch request ids must be strings; keys may be anything
+    results = {}
+
+    def collect(request_id, response, exception):
+        results[keys[int(request_id)]] = exception if exception is not None else response
+
+    limiter = ratelimit.limiter()
+    queue = list(keys)
+    attempts = Counter()
+    while queue:
+        chunk, queue = queue[:BATCH_LIMIT], queue[BATCH_LIMIT:]
+        methods = {i: ratelimit.method_id(requests[keys[i]]) for i in chunk}
+        granted = {method: limiter.acquire(method, cost=count) for method, count in Counter(methods.values()).items()}
+        buckets = {i: granted[methods[i]] for i in chunk}
+        batch = compute.new_batch_http_request(callback=collect)
+        for i in chunk:
+            batch.add(requests[keys[i]], request_id=str(i))
+        with tracing.span('api.batch', requests=len(chunk)):
+            batch.execute()
+
+        limited = {}    # bucket -> longest Retry-After among its rejected requests
+        for i in chunk:
+            bucket, result = buckets[i], results[keys[i]]
+            if bucket is None:
+                continue
+            if ratelimit.is_rate_limited(result) and attempts[i] < ratelimit.MAX_RETRIES:
+                attempts[i] += 1
+                limited[bucket] = max(limited.get(bucket) or 0, ratelimit.retry_after(result) or 0)
+                queue.append(i)
+            elif bucket not in limited:
+                bucket.recover()
+        for bucket, pause in limited.items():
+            bucket.backoff(pause)
+    return results
+
+
+def get_instances(compute, project, zone, names):
+    """Describes many instances; returns {name: instance or exception}."""
+    return batch_execute(compute, {
+        name: compute.instances().get(project=project, zone=zone, instance=name) for name in names})
+
+
+def stop_instances(compute, project, zone, names):
+    """Stops many instances; returns {name: operation or exception}."""
+    return batch_execute(compute, {
+        name: compute.instances().stop(project=project, zone=zone, instance=name) for name in names})
+
+
+def delete_instances(compute, project, zone, names):
+    """Deletes many instances; returns {name: operation or exception}."""
+    return batch_execute(compute, {
+        name: compute.instances().delete(project=project, zone=zone, instance=name) for name in names})
+
+
+def external_ip(instance):
+    """Returns the instance's external NAT IP, or None if it is not assigned yet."""
+    for nic in instance.get('networkInterfaces', []):
+        for access in nic.get('accessConfigs', []):
+            if access.get('natIP'):
+                return access['natIP']
+    return None
+
+
+def get_instance_ips(compute, project, zone, names):
+    """Returns {name: external IP or None} for many instances in one batch."""
+    return {name: None if isinstance(instance, Exception) else external_ip(instance)
+            for name, instance in get_instances(compute, project, zone, names).items()}
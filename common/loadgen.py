@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""An asyncio load generator for the flask app on the deployed clones.
+
+discover_targets() finds the fleet with the usual list call: the RUNNING
+instances tagged allow-5000 that have an external IP. A LoadGenerator then
+sends a weighted mix of requests at them, in one of two modes:
+- closed loop: `concurrency` workers, each sending its next request as soon
+  as the previous one answers. This measures what the fleet can serve.
+- open loop: requests arrive at `rate` per second (Poisson arrivals)
+  whether or not earlier ones have answered. Latency runs from when a
+  request was due, so a backlog shows up in the numbers instead of
+  slowing the generator down.
+
+Each request goes to the clone a balancer picks:
+- round robin: clones in turn;
+- least latency: the clone with the lowest recent latency, weighted by the
+  requests it already has in flight.
+
+The HTTP client is a small HTTP/1.1 client on asyncio streams. It keeps
+connections alive per clone, so no third-party package is needed. The
+report gives throughput, errors and latency percentiles per clone.
+"""
+
+import asyncio
+import itertools
+import random
+from collections import Counter
+from dataclasses import dataclass
+
+from common.fleet import aggregated_instances, external_ip, list_all
+from common.startup import APP_PORT
+from common.stats import summarize
+
+TAG = 'allow-5000'
+DEFAULT_MIX = 'GET /:8,GET /auth/login:1,GET /auth/register:1'
+TIMEOUT = 10            # seconds per request
+MAX_IN_FLIGHT = 1000    # open loop: arrivals beyond this many outstanding requests are dropped
+EWMA_WEIGHT = 0.2       # weight of the newest sample in least-latency's estimate
+
+
+@dataclass(frozen=True)
+class Target:
+    """One clone serving the app."""
+
+    name: str
+    host: str
+    port: int = APP_PORT
+
+
+def discover_targets(compute, project, zone=None, tag=TAG, port=APP_PORT):
+    """Returns a Target for each RUNNING instance with `tag` and an external IP, in one zone or all."""
+    instances = (list_all(compute.instances(), project=project, zone=zone) if zone
+                 else aggregated_instances(compute, project))
+    return [Target(instance['name'], external_ip(instance), port) for instance in instances
+            if instance['status'] == 'RUNNING' and tag in instance.get('tags', {}).get('items', [])
+            and external_ip(instance)]
+
+
+def parse_mix(text):
+    """Parses 'GET /:8,POST /auth/login:1' into [((method, path), weight)]."""
+    mix = []
+    for item in text.split(','):
+        request, _, weight = item.strip().rpartition(':')
+        method, _, path = request.partition(' ')
+        if not path.startswith('/') or not weight:
+            raise ValueError(f"Bad request mix entry {item!r}; expected 'METHOD /path:weight'")
+        mix.append(((method.upper(), path), float(weight)))
+    return mix
+
+
+class HttpClient:
+    """A minimal HTTP/1.1 client that keeps connections to each target alive."""
+
+    def __init__(self, timeout=TIMEOUT):
+        self.timeout = timeout
+        self.idle = {}      # target -> [(reader, writer)]
+        self.connections = 0
+
+    async def request(self, target, method, path, body=b''):
+        """Sends one request and returns the status code."""
+        idle = self.idle.setdefault(target, [])
+        while idle:
+            reader, writer = idle.pop()
+            try:
+                return await self._send(target, reader, writer, method, path, body)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # The server closed a kept-alive connection; try another one
+                continue
+        reader, writer = await self._connect(target)
+        return await self._send(target, reader, writer, method, path, body)
+
+    async def _send(self, target, reader, writer, method, path, body):
+        try:
+            return await asyncio.wait_for(self._exchange(target, reader, writer, method, path, body),
+                                          self.timeout)
+        except BaseException:
+            writer.close()
+            raise
+
+    async def _connect(self, target):
+        self.connections += 1
+        return await asyncio.wait_for(asyncio.open_connection(target.host, target.port), self.timeout)
+
+    async def _exchange(self, target, reader, writer, method, path, body):
+        head = (f'{method} {path} HTTP/1.1\r\nHost: {target.host}:{target.port}\r\n'
+                f'Content-Length: {len(body)}\r\nConnection: keep-alive\r\n\r\n')
+        writer.write(head.encode() + body)
+        await writer.drain()
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError(f'{target.name} closed the connection')
+        version, status = status_line.decode('latin-1').split()[:2]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        elif 'content-length' in headers:
+            await reader.readexactly(int(headers['content-length']))
+        elif method != 'HEAD' and int(status) not in (204, 304):
+            await reader.read()
+            keep_alive = False
+        if keep_alive:
+            self.idle[target].append((reader, writer))
+        else:
+            writer.close()
+        return int(status)
+
+    def close(self):
+        for connections in self.idle.values():
+            for _, writer in connections:
+                writer.close()
+        self.idle.clear()
+
+
+class RoundRobin:
+    """Sends requests to the targets in turn."""
+
+    def __init__(self, targets):
+        self._cycle = itertools.cycle(targets)
+
+    def pick(self):
+        return next(self._cycle)
+
+    def started(self, target):
+        pass
+
+    def finished(self, target, seconds, ok):
+        pass
+
+
+class LeastLatency:
+    """Sends each request to the target with the lowest latency estimate times its requests in flight.
+
+    Targets that have not answered yet are tried first. A failed request
+    counts as TIMEOUT seconds, so a broken clone is avoided.
+    """
+
+    def __init__(self, targets):
+        self.targets = list(targets)
+        self.latency = {}
+        self.in_flight = Counter()
+
+    def pick(self):
+        return min(self.targets, key=lambda t: (self.latency.get(t, 0) * (self.in_flight[t] + 1),
+                                                self.in_flight[t]))
+
+    def started(self, target):
+        self.in_flight[target] += 1
+
+    def finished(self, target, seconds, ok):
+        self.in_flight[target] -= 1
+        seconds = seconds if ok else TIMEOUT
+        previous = self.latency.get(target)
+        self.latency[target] = seconds if previous is None else (
+            EWMA_WEIGHT * seconds + (1 - EWMA_WEIGHT) * previous)
+
+
+BALANCERS = {'round-robin': RoundRobin, 'least-latency': LeastLatency}
+
+
+class LoadGenerator:
+    """Drives a request mix at the targets and records what each one served."""
+
+    def __init__(self, targets, mix=DEFAULT_MIX, balancer='round-robin', timeout=TIMEOUT, seed=0):
+        if not targets:
+            raise ValueError('No targets to send load to')
+        self.targets = list(targets)
+        self.mix = parse_mix(mix) if isinstance(mix, str) else mix
+        self.balancer = BALANCERS[balancer](self.targets)
+        self.client = HttpClient(timeout)
+        self.random = random.Random(seed)
+        self.latencies = {target: [] for target in self.targets}
+        self.statuses = {target: Counter() for target in self.targets}
+        self.dropped = 0
+        self.duration = 0.0
+
+    async def _one(self, due):
+        # Sends one request; latency runs from `due`, when the request should have gone out
+        loop = asyncio.get_running_loop()
+        (method, path), = self.random.choices([r for r, _ in self.mix], [w for _, w in self.mix])
+        target = self.balancer.pick()
+        self.balancer.started(target)
+        sent = loop.time()
+        try:
+            status = await self.client.request(target, method, path)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+            status = type(e).__name__
+        done = loop.time()
+        ok = isinstance(status, int) and status < 500
+        self.balancer.finished(target, done - sent, ok)
+        self.statuses[target][status] += 1
+        if ok:
+            self.latencies[target].append(done - due)
+
+    async def closed_loop(self, concurrency, duration):
+        """`concurrency` workers send back-to-back requests for `duration` seconds."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        end = start + duration
+
+        async def worker():
+            while loop.time() < end:
+                await self._one(loop.time())
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        self.duration = loop.time() - start
+        self.client.close()
+
+    async def open_loop(self, rate, duration, max_in_flight=MAX_IN_FLIGHT):
+        """Requests arrive at `rate` per second for `duration` seconds, regardless of answers."""
+        loop = asyncio.get_running_loop()
+        start = due = loop.time()
+        in_flight = set()
+        while True:
+            due += self.random.expovariate(rate)
+            if due >= start + duration:
+                break
+            await asyncio.sleep(max(0, due - loop.time()))
+            if len(in_flight) >= max_in_flight:
+                self.dropped += 1
+                continue
+            task = asyncio.ensure_future(self._one(due))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        if in_flight:
+            await asyncio.gather(*in_flight)
+        self.duration = loop.time() - start
+        self.client.close()
+
+    def results(self):
+        """Returns {target name: {requests, errors, throughput, latency summary, statuses}}, plus 'total'."""
+        results = {}
+        rows = [(target.name, self.latencies[target], self.statuses[target]) for target in self.targets]
+        rows.append(('total', [s for t in self.targets for s in self.latencies[t]],
+                     sum(self.statuses.values(), Counter())))
+        for name, latencies, statuses in rows:
+            requests = sum(statuses.values())
+            results[name] = {'requests': requests, 'errors': requests - len(latencies),
+                             'throughput': len(latencies) / self.duration if self.duration else 0.0,
+                             'latency': summarize(latencies), 'statuses': dict(statuses)}
+        return results
+
+    def report(self):
+        """Returns text lines: a per-clone table of throughput, errors and latency percentiles in ms."""
+        ms = lambda value: '-' if value is None else f'{value * 1000:.1f}'
+        lines = ['| clone | requests | errors | ok/s | p50 (ms) | p95 (ms) | p99 (ms) | max (ms) |',
+                 '|-------|----------|--------|------|----------|----------|----------|----------|']
+        for name, r in self.results().items():
+            latency = r['latency']
+            lines.append(f"| {name} | {r['requests']} | {r['errors']} | {r['throughput']:.1f} "
+                         f"| {ms(latency['p50'])} | {ms(latency['p95'])} | {ms(latency['p99'])} "
+                         f"| {ms(latency['max'])} |")
+        lines.append(f"{self.duration:.2f}s, {self.client.connections} connections opened"
+                     + (f", {self.dropped} arrivals dropped with too many requests in flight" if self.dropped else ''))
+        return lines
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""Shared engine for waiting on Compute Engine operations.
+
+One OperationWaiter tracks any number of zone, region or global operations
+in a single loop. Each operation is polled on its own exponential backoff
+schedule with jitter, so fast operations are noticed quickly and slow ones
+are not hammered. Operations that finish with an ``error`` field raise
+OperationError, and operations that outlive their deadline raise
+OperationTimeout. ``long_poll=True`` uses the server-side
+``*Operations().wait`` call, which blocks for up to two minutes per request.
+Otherwise, when several operations are due at once, their status checks
+share one batch HTTP request.
+"""
+
+import random
+import socket
+import time
+
+import googleapiclient.errors
+
+from common import tracing
+from common.fleet import batch_execute
+
+DEFAULT_TIMEOUT = 600       # seconds an operation may take before we give up
+INITIAL_DELAY = 1.0         # first poll interval
+MAX_DELAY = 20.0            # longest poll interval
+MULTIPLIER = 1.5            # backoff growth per unfinished poll
+BATCH_WINDOW = 0.5          # when batching, also poll operations due this soon
+
+# HTTP statuses worth retrying while polling
+TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+
+
+class OperationError(Exception):
+    """An operation finished (status DONE) with an error field."""
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.errors = operation.get('error', {}).get('errors', [])
+        details = '; '.join(f"{e.get('code')}: {e.get('message')}" for e in self.errors)
+        super().__init__(f"Operation {operation.get('name')} failed: {details}")
+
+
+class OperationTimeout(Exception):
+    """One or more operations were still running at their deadline."""
+
+    def __init__(self, names):
+        self.names = list(names)
+        super().__init__(f"Timed out waiting for operations: {', '.join(self.names)}")
+
+
+def is_transient(error):
+    """True for errors that are worth retrying (rate limits, 5xx, network blips)."""
+    if isinstance(error, googleapiclient.errors.HttpError):
+        return error.resp.status in TRANSIENT_STATUSES
+    return isinstance(error, (socket.timeout, ConnectionError, TimeoutError))
+
+
+def operation_scope(operation, zone=None, region=None):
+    """Returns ('zone', name), ('region', name) or ('global', None) for an operation."""
+    if isinstance(operation, dict):
+        if operation.get('zone'):
+            return 'zone', operation['zone'].rsplit('/', 1)[-1]
+        if operation.get('region'):
+            return 'region', operation['region'].rsplit('/', 1)[-1]
+        return 'global', None
+    if zone:
+        return 'zone', zone
+    if region:
+        return 'region', region
+    return 'global', None
+
+
+def operation_request(compute, project, name, scope, long_poll=False):
+    """Builds the get (or wait) request for an operation in the given scope."""
+    kind, location = scope
+    method = 'wait' if long_poll else 'get'
+    if kind == 'zone':
+        return getattr(compute.zoneOperations(), method)(project=project, zone=location, operation=name)
+    if kind == 'region':
+        return getattr(compute.regionOperations(), method)(project=project, region=location, operation=name)
+    return getattr(compute.globalOperations(), method)(project=project, operation=name)
+
+
+class _Tracked:
+    def __init__(self, name, scope, now, timeout, delay):
+        self.name = name
+        self.scope = scope
+        self.deadline = now + timeout
+        self.delay = delay
+        self.next_poll = now
+
+
+class OperationWaiter:
+    """Waits on many operations at once, each with its own backoff schedule.
+
+    Operations can be added while others are in flight, either as operation
+    dicts returned by insert/delete calls (their scope is read from the
+    ``zone``/``region`` fields) or as bare names in the waiter's zone/region.
+    With batch=True, operations due at the same time are polled together in
+    one batch HTTP request.
+    """
+
+    def __init__(self, compute, project, zone=None, region=None, timeout=DEFAULT_TIMEOUT,
+                 initial_delay=INITIAL_DELAY, max_delay=MAX_DELAY, multiplier=MULTIPLIER,
+                 long_poll=False, batch=True, raise_on_error=True, on_done=None, log=print):
+        self.compute = compute
+        self.project = project
+        self.zone = zone
+        self.region = region
+        self.timeout = timeout
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.long_poll = long_poll
+        self.batch = batch
+        self.raise_on_error = raise_on_error
+        self.on_done = on_done
+        self.log = log
+        self.results = {}
+        self._pending = {}
+
+    @property
+    def pending(self):
+        """Names of operations that have not finished yet."""
+        return list(self._pending)
+
+    def add(self, operation, timeout=None):
+        """Starts tracking an operation and returns its name."""
+        name = operation['name'] if isinstance(operation, dict) else operation
+        if isinstance(operation, dict) and operation.get('status') == 'DONE':
+            self._finish(operation)
+            return name
+        scope = operation_scope(operation, self.zone, self.region)
+        self._pending[name] = _Tracked(name, scope, time.monotonic(),
+                                       self.timeout if timeout is None else timeout, self.initial_delay)
+        return name
+
+    def next_delay(self):
+        """Seconds until the next operation is due to be polled."""
+        if not self._pending or self.long_poll:
+            return 0
+        return max(0, min(t.next_poll for t in self._pending.values()) - time.monotonic())
+
+    def poll(self):
+        """Polls every operation that is due once; returns the results that finished."""
+        finished = []
+        now = time.monotonic()
+        window = BATCH_WINDOW if self.batch and not self.long_poll else 0
+        due = [t for t in self._pending.values() if t.next_poll <= now + window]
+        responses = self._fetch(due)
+        for tracked in due:
+            result = responses[tracked.name]
+            if isinstance(result, Exception):
+                if not is_transient(result):
+                    raise result
+                self.log(f"Transient error polling {tracked.name}, backing off: {result}")
+                result = None
+            if result and result['status'] == 'DONE':
+                del self._pending[tracked.name]
+                finished.append(self._finish(result))
+                continue
+            now = time.monotonic()
+            if now >= tracked.deadline:
+                raise OperationTimeout([tracked.name])
+            tracked.next_poll = now + random.uniform(tracked.delay / 2, tracked.delay)
+            tracked.delay = min(tracked.delay * self.multiplier, self.max_delay)
+        return finished
+
+    def _fetch(self, due):
+        # Returns {name: result or exception}; several due operations share one batch request
+        requests = {t.name: operation_request(self.compute, self.project, t.name, t.scope, self.long_poll)
+                    for t in due}
+        if self.batch and len(requests) > 1 and not self.long_poll:
+            try:
+                return batch_execute(self.compute, requests)
+            except Exception as e:
+                return {name: e for name in requests}
+        responses = {}
+        for name, request in requests.items():
+            try:
+                responses[name] = request.execute()
+            except Exception as e:
+                responses[name] = e
+        return responses
+
+    def wait(self):
+        """Blocks until every tracked operation is DONE; returns {name: result}."""
+        with tracing.span('wait.operations', operations=len(self._pending)) as s:
+            polls = 0
+            while self._pending:
+                self.poll()
+                polls += 1
+                if self._pending:
+                    time.sleep(self.next_delay())
+            s.set(polls=polls)
+        return self.results
+
+    def _finish(self, result):
+        self.results[result['name']] = result
+        if tracing.enabled():
+            tracing.event('operation.done', operation=result['name'], operation_type=result.get('operationType'),
+                          target=result.get('targetLink'), failed='error' in result,
+                          **tracing.operation_times(result, observed=time.time()))
+        if 'error' in result:
+            if self.raise_on_error:
+                raise OperationError(result)
+            self.log(f"Operation {result['name']} failed: {result['error']}")
+        if self.on_done:
+            self.on_done(result)
+        return result
+
+
+def wait_for_operations(compute, project, operations, zone=None, region=None, **kwargs):
+    """Waits for many operations in one loop; returns {name: result}."""
+    waiter = OperationWaiter(compute, project, zone=zone, region=region, **kwargs)
+    for operation in operations:
+        waiter.add(operation)
+    return waiter.wait()
+
+
+def wait_for_operation(compute, project, zone, operation, log=print, **kwargs):
+    """Waits for a single zone operation (a name or an operation dict) to finish."""
+    name = operation['name'] if isinstance(operation, dict) else operation
+    log('Waiting for operation to finish...')
+    result = wait_for_operations(compute, project, [operation], zone=zone, log=log, **kwargs)[name]
+    log("Operation finished.")
+    return result
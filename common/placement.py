@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""Multi-zone placement: spread VMs over zones, check quotas, fall back on stockouts.
+
+PlacementScheduler takes a list of zones in order of preference. It checks
+each region's CPUS and INSTANCES quota headroom with regions().get, and
+spreads the VMs round-robin over the zones, fastest first. It inserts them
+in batches and waits on every operation at once. When an insert fails for
+lack of capacity (ZONE_RESOURCE_POOL_EXHAUSTED or a quota error), that zone
+is skipped for the rest of the run and the VM is retried in the next-best
+zone with headroom.
+
+The time from insert to DONE in each zone feeds an exponentially weighted
+average. ZoneStats keeps those averages in a small JSON file, so later
+runs rank the zones that have been provisioning fastest first.
+"""
+
+import json
+import os
+import time
+
+import googleapiclient.errors
+
+from common.fleet import batch_execute
+from common.operations import OperationWaiter
+
+ZONE_STATS = os.environ.get(
+    'COMPUTE_ZONE_STATS',
+    os.path.join(os.path.expanduser('~'), '.cache', 'programmable-cloud', 'zone-latency.json'))
+EWMA_WEIGHT = 0.3           # weight of the newest latency sample
+FAILURE_PENALTY = 30.0      # seconds added to a zone's score per recent capacity failure
+FAILURE_DECAY = 0.5         # each success halves the failure count
+
+# Errors that mean "try another zone", from HTTP error reasons or operation error codes
+CAPACITY_ERRORS = {
+    'ZONE_RESOURCE_POOL_EXHAUSTED', 'ZONE_RESOURCE_POOL_EXHAUSTED_WITH_DETAILS',
+    'QUOTA_EXCEEDED', 'quotaExceeded', 'resourceExhausted',
+}
+
+
+def region_of(zone):
+    return zone.rsplit('-', 1)[0]
+
+
+def error_codes(error):
+    """Returns the error codes/reasons of an HttpError or of an operation's error field."""
+    if isinstance(error, googleapiclient.errors.HttpError):
+        details = error.error_details if isinstance(error.error_details, list) else []
+        return {detail.get('reason') for detail in details if isinstance(detail, dict)}
+    if isinstance(error, dict):
+        return {e.get('code') for e in error.get('errors', [])}
+    return set()
+
+
+def is_capacity_error(error):
+    return bool(error_codes(error) & CAPACITY_ERRORS)
+
+
+class ZoneStats:
+    """Per-zone provisioning latency (EWMA) and recent capacity failures, kept in a JSON file."""
+
+    def __init__(self, path=ZONE_STATS):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.zones = json.load(f)
+        except (OSError, ValueError):
+            self.zones = {}
+
+    def observe(self, zone, seconds):
+        stats = self.zones.setdefault(zone, {'ewma': seconds, 'samples': 0, 'failures': 0})
+        stats['ewma'] = EWMA_WEIGHT * seconds + (1 - EWMA_WEIGHT) * stats['ewma']
+        stats['samples'] += 1
+        stats['failures'] *= FAILURE_DECAY
+
+    def failure(self, zone):
+        stats = self.zones.setdefault(zone, {'ewma': None, 'samples': 0, 'failures': 0})
+        stats['failures'] += 1
+
+    def score(self, zone, default):
+        """Expected seconds to provision in the zone; `default` for zones never measured."""
+        stats = self.zones.get(zone, {})
+        ewma = stats.get('ewma')
+        return (default if ewma is None else ewma) + FAILURE_PENALTY * stats.get('failures', 0)
+
+    def rank(self, zones):
+        """Orders zones fastest first; unmeasured zones score the average, ties keep the given order."""
+        known = [self.zones[z]['ewma'] for z in zones if self.zones.get(z, {}).get('ewma') is not None]
+        default = sum(known) / len(known) if known else 0.0
+        return sorted(zones, key=lambda zone: self.score(zone, default))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump(self.zones, f, indent=2, sort_keys=True)
+
+
+class PlacementScheduler:
+    """Places VMs over several zones and retries capacity failures in the next-best zone."""
+
+    def __init__(self, compute, project, zones, stats=None, cpus_per_vm=1, log=print):
+        self.compute = compute
+        self.project = project
+        self.zones = list(zones)
+        self.stats = stats if stats is not None else ZoneStats()
+        self.cpus_per_vm = cpus_per_vm
+        self.log = log
+        self.exhausted = set()
+
+    def headroom(self):
+        """Returns {region: number of VMs its CPUS and INSTANCES quotas still allow}."""
+        headroom = {}
+        for region in dict.fromkeys(region_of(zone) for zone in self.zones):
+            quotas = self.compute.regions().get(project=self.project, region=region).execute().get('quotas', [])
+            room = {q['metric']: q['limit'] - q['usage'] for q in quotas}
+            headroom[region] = int(min(room.get('CPUS', float('inf')) // self.cpus_per_vm,
+                                       room.get('INSTANCES', float('inf'))))
+        return headroom
+
+    def plan(self, names, headroom):
+        """Assigns names round-robin over the ranked zones whose region has quota left; returns {name: zone}."""
+        ranked = [zone for zone in self.stats.rank(self.zones) if zone not in self.exhausted]
+        placement = {}
+        names = list(names)
+        while names:
+            usable = [zone for zone in ranked if headroom.get(region_of(zone), 0) > 0]
+            if not usable:
+                break
+            for zone in usable:
+                if not names or headroom[region_of(zone)] <= 0:
+                    continue
+                placement[names.pop(0)] = zone
+                headroom[region_of(zone)] -= 1
+        return placement
+
+    def create(self, names, body_for, **insert_params):
+        """Creates the named VMs, with body_for(name, zone) building each insert body.
+
+        insert_params (e.g. sourceInstanceTemplate) are passed to every insert.
+        Returns ({name: (zone, seconds)}, {name: error}) for the VMs that were
+        created and those that could not be placed anywhere. A VM's seconds
+        include any attempts in zones that failed; the zone statistics only
+        see the attempt that succeeded.
+        """
+        headroom = self.headroom()
+        self.log("Quota headroom: " + ', '.join(f'{region} {room} VMs' for region, room in headroom.items()))
+        placement = self.plan(names, headroom)
+        failed = {name: 'no zone with quota left' for name in names if name not in placement}
+        created = {}
+        requested = {}
+        started = {}
+        operations = {}     # operation name -> instance name
+
+        def retry(name, zone, error):
+            self.exhausted.add(zone)
+            self.stats.failure(zone)
+            headroom[region_of(zone)] += 1
+            moved = self.plan([name], headroom)
+            if moved:
+                self.log(f"{name}: {zone} failed ({error}); retrying in {moved[name]}")
+                queue.update(moved)
+            else:
+                failed[name] = f'{zone}: {error}'
+
+        def done(result):
+            name = operations[result['name']]
+            zone = placement[name]
+            if 'error' in result:
+                if is_capacity_error(result['error']):
+                    retry(name, zone, ', '.join(sorted(error_codes(result['error']))))
+                else:
+                    failed[name] = f"{zone}: {result['error']}"
+                return
+            self.stats.observe(zone, time.time() - started[name])
+            created[name] = (zone, time.time() - requested[name])
+            self.log(f"Instance {name} created in {zone} in {created[name][1]:.2f} seconds")
+
+        waiter = OperationWaiter(self.compute, self.project, raise_on_error=False, on_done=done, log=self.log)
+        queue = dict(placement)
+        while queue or waiter.pending:
+            if queue:
+                batch, queue = queue, {}
+                placement.update(batch)
+                for name in batch:
+                    started[name] = time.time()
+                    requested.setdefault(name, started[name])
+                responses = batch_execute(self.compute, {
+                    name: self.compute.instances().insert(project=self.project, zone=zone,
+                                                          body=body_for(name, zone), **insert_params)
+                    for name, zone in batch.items()})
+                for name, response in responses.items():
+                    if isinstance(response, Exception):
+                        if is_capacity_error(response):
+                            retry(name, batch[name], ', '.join(sorted(error_codes(response))))
+                        else:
+                            failed[name] = f'{batch[name]}: {response}'
+                        continue
+                    operations[response['name']] = name
+                    waiter.add(response)
+            waiter.poll()
+            if waiter.pending and not queue:
+                time.sleep(waiter.next_delay())
+        self.stats.save()
+        return created, failed
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""A warm pool of pre-built clones, parked so they can be handed out in seconds.
+
+Creating a clone takes tens of seconds, and booting the app adds more. A
+WarmPool creates clones ahead of time and lets them boot. It then parks
+them, either suspended (memory kept, so the app is serving as soon as the VM
+resumes) or stopped (TERMINATED, so the startup script runs again on start).
+
+acquire() takes a parked clone and resumes or starts it, which costs only
+that one operation. When the pool is empty, it falls back to a cold create.
+Either way, a background thread tops the pool back up to its target size.
+A new member that cannot be parked is deleted rather than left running.
+
+Members carry the ``warm-pool`` label with the pool's name. A new WarmPool
+therefore picks up members that an earlier run parked. Once a member is
+handed out it is RUNNING, and the pool ignores it from then on; stopping or
+suspending it puts it back into the pool.
+
+metrics() reports:
+- pool size and the members still being built;
+- hits, misses and the hit rate;
+- acquire latency, split into hits and misses;
+- the cold-create baseline, from the pool's own inserts;
+- refill lag: from a member leaving the pool until its replacement is parked.
+"""
+
+import itertools
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import googleapiclient.errors
+
+from common import tracing
+from common.fleet import list_all
+from common.operations import OperationError, OperationWaiter, wait_for_operation
+from common.stats import summarize
+
+LABEL = 'warm-pool'
+MODES = {'suspend': ('suspend', 'SUSPENDED', 'resume'), 'stop': ('stop', 'TERMINATED', 'start')}
+RETRY_DELAY = 30        # seconds before retrying a refill after an insert was rejected
+FILL_TIMEOUT = 1800     # seconds callers wait for the pool to fill before going on without it
+WORKERS = 4             # members being readied and parked at once
+
+_quiet = lambda *_: None
+
+
+class WarmPool:
+    """Keeps `size` parked clones in one zone and hands them out on demand.
+
+    config_for(name) returns a clone's insert body; members also get the
+    pool label. ready(compute, name), if given, blocks until a freshly
+    created member is worth parking, e.g. until its app answers HTTP.
+    """
+
+    def __init__(self, compute_factory, project, zone, config_for, size, name='flask', mode='suspend',
+                 ready=None, log=print):
+        if mode not in MODES:
+            raise ValueError(f"Unknown pool mode {mode}; expected one of {', '.join(MODES)}")
+        self.compute_factory = compute_factory
+        self.project = project
+        self.zone = zone
+        self.config_for = config_for
+        self.size = size
+        self.name = name
+        self.mode = mode
+        self.ready = ready
+        self.log = log
+        self.prefix = f'{name}-warm'
+        self.lock = threading.Condition()
+        self.parked = deque()       # (member, status), oldest first
+        self.building = {}          # member -> insert start time
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self.hit_times = []
+        self.miss_times = []
+        self.create_times = []
+        self.refill_lags = []
+        self._departures = deque()  # when members left the pool, for refill lag
+        self._retry_at = 0.0
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._closing = threading.Event()
+        self._numbers = itertools.count(1)
+        self._thread = None
+
+    def _client(self):
+        if not hasattr(self._local, 'compute'):
+            self._local.compute = self.compute_factory()
+        return self._local.compute
+
+    def _next_name(self):
+        return f'{self.prefix}-{next(self._numbers)}'
+
+    def start(self):
+        """Adopts members parked by earlier runs and starts the background refill; returns self."""
+        _, parked_status, _ = MODES[self.mode]
+        instances = list_all(self._client().instances(), project=self.project, zone=self.zone)
+        pattern = re.compile(rf'{re.escape(self.prefix)}-(\d+)$')
+        numbers = [int(m.group(1)) for m in (pattern.match(i['name']) for i in instances) if m]
+        self._numbers = itertools.count(max(numbers, default=0) + 1)
+        with self.lock:
+            for instance in instances:
+                if (instance.get('labels', {}).get(LABEL) == self.name
+                        and instance['status'] in ('SUSPENDED', 'TERMINATED')):
+                    self.parked.append((instance['name'], instance['status']))
+        if self.parked:
+            self.log(f"Adopted {len(self.parked)} parked members of pool {self.name}")
+        if any(status != parked_status for _, status in self.parked):
+            self.log(f"Some members are parked differently than mode {self.mode}; they are handed out as they are")
+        self._thread = threading.Thread(target=self._refill_loop, name=f'pool-{self.name}', daemon=True)
+        self._thread.start()
+        return self
+
+    def wait_full(self, timeout=FILL_TIMEOUT):
+        """Blocks until `size` members are parked; returns whether the pool filled in time.
+
+        With timeout=None it waits for good, even if every refill fails.
+        """
+        with self.lock:
+            return self.lock.wait_for(lambda: len(self.parked) >= self.size, timeout)
+
+    def close(self):
+        """Stops refilling once the members already being built are parked."""
+        self._closing.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+
+    def acquire(self):
+        """Hands out a running clone; returns (name, seconds, hit).
+
+        A hit resumes or starts a parked member. A miss (empty pool, or a
+        member that would not come back) creates a clone from scratch.
+        """
+        start = time.monotonic()
+        compute = self._client()
+        while True:
+            with self.lock:
+                member = self.parked.popleft() if self.parked else None
+                if member:
+                    self._departures.append(start)
+            self._wake.set()
+            if member is None:
+                break
+            name, status = member
+            method = 'resume' if status == 'SUSPENDED' else 'start'
+            try:
+                with tracing.span('pool.resume', instance=name, method=method):
+                    operation = getattr(compute.instances(), method)(project=self.project, zone=self.zone,
+                                                                     instance=name).execute()
+                    wait_for_operation(compute, self.project, self.zone, operation, log=_quiet)
+            except (googleapiclient.errors.HttpError, OperationError) as e:
+                self.log(f"Could not {method} pool member {name}, trying the next one: {e}")
+                continue
+            seconds = time.monotonic() - start
+            with self.lock:
+                self.hits += 1
+                self.hit_times.append(seconds)
+            tracing.event('pool.acquire', instance=name, hit=True, seconds=seconds)
+            self.log(f"Handed out {name} from the pool in {seconds:.2f} seconds ({method})")
+            return name, seconds, True
+
+        name = self._next_name()
+        self.log(f"Pool {self.name} is empty, creating {name} from scratch...")
+        with tracing.span('pool.cold_create', instance=name):
+            operation = compute.instances().insert(project=self.project, zone=self.zone,
+                                                   body=self.config_for(name)).execute()
+            wait_for_operation(compute, self.project, self.zone, operation, log=_quiet)
+        seconds = time.monotonic() - start
+        with self.lock:
+            self.misses += 1
+            self.miss_times.append(seconds)
+        tracing.event('pool.acquire', instance=name, hit=False, seconds=seconds)
+        self.log(f"Created {name} in {seconds:.2f} seconds (pool miss)")
+        return name, seconds, False
+
+    # -- refill ------------------------------------------------------------
+
+    def _refill_loop(self):
+        compute = self._client()
+        phases = {}     # operation name -> (member, 'insert', 'park' or 'delete')
+        parking = {}    # future -> member
+
+        def discard(member, reason):
+            # A member that could not be parked is still RUNNING (and billed); delete it
+            self._drop(member, f'{reason}; deleting it')
+            try:
+                operation = compute.instances().delete(project=self.project, zone=self.zone,
+                                                       instance=member).execute()
+            except googleapiclient.errors.HttpError as e:
+                self.log(f"Could not delete pool member {member}: {e}")
+                return
+            phases[operation['name']] = (member, 'delete')
+            waiter.add(operation)
+
+        def done(result):
+            member, phase = phases.pop(result['name'])
+            if phase == 'delete':
+                if 'error' in result:
+                    self.log(f"Could not delete pool member {member}: {result['error']}")
+            elif 'error' in result and phase == 'park':
+                discard(member, f"park failed: {result['error']}")
+            elif 'error' in result:
+                self._drop(member, f"{phase} failed: {result['error']}")
+            elif phase == 'insert':
+                with self.lock:
+                    self.create_times.append(time.monotonic() - self.building[member])
+                parking[pool.submit(self._park, member)] = member
+            else:
+                self._parked(member)
+
+        waiter = OperationWaiter(compute, self.project, self.zone, raise_on_error=False, on_done=done,
+                                 log=self.log)
+        with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+            while not self._closing.is_set() or waiter.pending or parking:
+                self._wake.clear()
+                if not self._closing.is_set():
+                    for member, operation in self._start_builds(compute):
+                        phases[operation['name']] = (member, 'insert')
+                        waiter.add(operation)
+                for future in [f for f in parking if f.done()]:
+                    member = parking.pop(future)
+                    try:
+                        operation = future.result()
+                    except Exception as e:
+                        discard(member, f'could not be parked: {e}')
+                        continue
+                    phases[operation['name']] = (member, 'park')
+                    waiter.add(operation)
+                if waiter.pending:
+                    waiter.poll()
+                if waiter.pending:
+                    delay = waiter.next_delay()
+                elif parking:
+                    delay = 0.5
+                else:
+                    delay = max(0, self._retry_at - time.monotonic()) or None
+                self._wake.wait(delay)
+
+    def _start_builds(self, compute):
+        # Inserts enough new members to bring parked + building up to the target; returns [(member, op)]
+        if time.monotonic() < self._retry_at:
+            return []
+        with self.lock:
+            missing = self.size - len(self.parked) - len(self.building)
+        started = []
+        for _ in range(max(0, missing)):
+            member = self._next_name()
+            body = self.config_for(member)
+            body['labels'] = {**body.get('labels', {}), LABEL: self.name}
+            with self.lock:
+                self.building[member] = time.monotonic()
+            try:
+                operation = compute.instances().insert(project=self.project, zone=self.zone, body=body).execute()
+            except googleapiclient.errors.HttpError as e:
+                self._drop(member, f'insert was rejected: {e}')
+                self._retry_at = time.monotonic() + RETRY_DELAY
+                break
+            started.append((member, operation))
+        if started:
+            self.log(f"Refilling pool {self.name}: building {', '.join(member for member, _ in started)}")
+        return started
+
+    def _park(self, member):
+        # Runs in a worker thread: waits until the member is ready, then suspends or stops it
+        compute = self._client()
+        method, _, _ = MODES[self.mode]
+        with tracing.span('pool.park', instance=member, method=method):
+            if self.ready:
+                self.ready(compute, member)
+            return getattr(compute.instances(), method)(project=self.project, zone=self.zone,
+                                                        instance=member).execute()
+
+    def _parked(self, member):
+        _, status, _ = MODES[self.mode]
+        now = time.monotonic()
+        with self.lock:
+            self.building.pop(member, None)
+            self.parked.append((member, status))
+            if self._departures:
+                self.refill_lags.append(now - self._departures.popleft())
+            self.lock.notify_all()
+        tracing.event('pool.parked', instance=member, size=len(self.parked))
+
+    def _drop(self, member, reason):
+        with self.lock:
+            self.building.pop(member, None)
+            self.failures += 1
+        self.log(f"Pool member {member} {reason}")
+
+    # -- reporting ---------------------------------------------------------
+
+    def metrics(self):
+        with self.lock:
+            acquired = self.hits + self.misses
+            return {'size': len(self.parked), 'target': self.size, 'building': len(self.building),
+                    'hits': self.hits, 'misses': self.misses, 'failures': self.failures,
+                    'hit_rate': self.hits / acquired if acquired else None,
+                    'hit_seconds': summarize(self.hit_times), 'miss_seconds': summarize(self.miss_times),
+                    'cold_create_seconds': summarize(self.create_times),
+                    'refill_lag_seconds': summarize(self.refill_lags)}
+
+    def report(self):
+        """Returns text lines comparing acquire latency with cold creates, plus the pool's state."""
+        m = self.metrics()
+        fmt = lambda s: ('0 | - | - | - | -' if not s['count'] else
+                         f"{s['count']} | {s['mean']:.2f} | {s['p50']:.2f} | {s['p95']:.2f} | {s['max']:.2f}")
+        lines = ['| path | count | mean (s) | p50 (s) | p95 (s) | max (s) |',
+                 '|------|-------|----------|---------|---------|---------|',
+                 f"| pool hit ({MODES[self.mode][2]}) | {fmt(m['hit_seconds'])} |",
+                 f"| pool miss (cold create) | {fmt(m['miss_seconds'])} |",
+                 f"| cold create baseline (refill inserts) | {fmt(m['cold_create_seconds'])} |",
+                 f"| refill lag | {fmt(m['refill_lag_seconds'])} |"]
+        hit_rate = '-' if m['hit_rate'] is None else f"{m['hit_rate']:.0%}"
+        lines.append(f"pool {self.name}: {m['size']}/{m['target']} parked, {m['building']} building, "
+                     f"{m['hits']} hits, {m['misses']} misses (hit rate {hit_rate}), {m['failures']} failed builds")
+        return lines
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""Client-side rate limiting for Compute API calls.
+
+GCE enforces per-project rate limits, separately for reads (get, list and
+operation polls) and for mutations (insert, delete, ...). Requests over the
+limit are rejected with 429, or with 403 rateLimitExceeded. Every call
+these scripts make first takes a token from a shared bucket:
+- API execute() calls, through the client's request class and FakeCompute;
+- every request inside a batch, through batch_execute(), which takes the
+  tokens for the whole batch at once.
+
+Reads and mutations have separate budgets, so polling can never use up the
+budget that inserts need. Within a bucket, waiters are served by priority
+lane. Operation polls use the lowest lane, so they go after user-facing
+reads.
+
+When the API still answers 429, the bucket halves its rate and honours
+Retry-After before its next grant. It then creeps back to the configured
+rate with each successful call. The throttled call is retried, up to
+MAX_RETRIES times.
+
+The buckets are thread-safe. Blocking callers use acquire(); asyncio code
+uses acquire_async(), which sleeps without blocking the event loop.
+metrics() reports per bucket:
+- queue depth and its peak;
+- grants and throttled waits;
+- total seconds spent waiting;
+- 429s seen, and the current and lowest adapted rate.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import Counter
+
+import googleapiclient.errors
+
+READ_RATE = float(os.environ.get('COMPUTE_READ_RATE', 20))        # requests per second, 0 = unlimited
+MUTATE_RATE = float(os.environ.get('COMPUTE_MUTATE_RATE', 20))
+BURST = 0.1                 # seconds' worth of tokens a bucket can hold (at least one)
+BACKOFF = 0.5               # rate multiplier on a rate-limit error
+MIN_RATE = 0.05             # floor for the adapted rate, as a fraction of the configured rate
+RECOVERY = 0.02             # fraction of the configured rate regained per successful call
+MAX_RETRIES = 5             # retries of a call rejected for rate
+
+# Priority lanes; waiters in a lower-numbered lane are served first
+URGENT, NORMAL, POLL = 0, 1, 2
+
+READ_METHODS = {'get', 'list', 'aggregatedList', 'wait', 'getGuestAttributes', 'getFromFamily',
+                'getSerialPortOutput', 'getIamPolicy', 'listReferrers'}
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+
+def classify(method_id):
+    """Returns (bucket, lane) for a method such as 'compute.instances.insert' or 'zoneOperations.get'."""
+    collection, verb = method_id.split('.')[-2:]
+    if verb in READ_METHODS:
+        return 'read', POLL if collection.endswith('Operations') else NORMAL
+    return 'mutate', NORMAL
+
+
+def method_id(request):
+    """The method of a googleapiclient or FakeCompute request, e.g. 'compute.instances.get'."""
+    return getattr(request, 'methodId', None) or f'compute.{request.method}'
+
+
+def is_rate_limited(error):
+    if not isinstance(error, googleapiclient.errors.HttpError):
+        return False
+    if error.resp.status == 429:
+        return True
+    details = error.error_details if isinstance(error.error_details, list) else []
+    return error.resp.status == 403 and any(
+        isinstance(d, dict) and d.get('reason') in RATE_LIMIT_REASONS for d in details)
+
+
+def retry_after(error):
+    """Seconds from the error's Retry-After header, or None."""
+    try:
+        return float(error.resp.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """A token bucket with priority lanes and a rate that adapts to 429s."""
+
+    def __init__(self, name, rate, burst=BURST):
+        self.name = name
+        self.base_rate = self.rate = self.min_rate = rate
+        self.capacity = max(1.0, rate * burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        self.waiting = Counter()    # lane -> callers waiting
+        self.granted = 0
+        self.throttled = 0          # grants that had to wait
+        self.throttle_time = 0.0
+        self.max_depth = 0
+        self.rate_limited = 0
+
+    def _take(self, lane, cost):
+        # Returns 0 if tokens were taken, else seconds until it is worth trying again
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.paused_until:
+            return self.paused_until - now
+        if any(count for waiting_lane, count in self.waiting.items() if waiting_lane < lane):
+            return 1 / self.rate
+        # A cost above the capacity (a big batch) is let through once the bucket is full, leaving it in debt
+        if self.tokens >= min(cost, self.capacity):
+            self.tokens -= cost
+            self.granted += 1
+            return 0
+        return (min(cost, self.capacity) - self.tokens) / self.rate
+
+    def _queue(self, lane, delta):
+        with self.lock:
+            self.waiting[lane] += delta
+            self.max_depth = max(self.max_depth, sum(self.waiting.values()))
+
+    def _waited(self, seconds):
+        with self.lock:
+            self.throttled += 1
+            self.throttle_time += seconds
+
+    def acquire(self, lane=NORMAL, cost=1):
+        """Blocks until `cost` tokens are granted to this lane; returns the seconds waited."""
+        with self.lock:
+            delay = self._take(lane, cost)
+        if not delay:
+            return 0.0
+        start = time.monotonic()
+        self._queue(lane, 1)
+        try:
+            while delay:
+                time.sleep(delay)
+                with self.lock:
+                    delay = self._take(lane, cost)
+        finally:
+            self._queue(lane, -1)
+        waited = time.monotonic() - start
+        self._waited(waited)
+        return waited
+
+    async def acquire_async(self, lane=NORMAL, cost=1):
+        """Like acquire(), but sleeps with asyncio instead of blocking the thread."""
+        with self.lock:
+            delay = self._take(lane, cost)
+        if not delay:
+            return 0.0
+        start = time.monotonic()
+        self._queue(lane, 1)
+        try:
+            while delay:
+                await asyncio.sleep(delay)
+                with self.lock:
+                    delay = self._take(lane, cost)
+        finally:
+            self._queue(lane, -1)
+        waited = time.monotonic() - start
+        self._waited(waited)
+        return waited
+
+    def backoff(self, pause=None):
+        """Halves the rate after a rate-limit error and pauses grants for `pause` seconds."""
+        with self.lock:
+            self.rate_limited += 1
+            self.rate = max(self.base_rate * MIN_RATE, self.rate * BACKOFF)
+            self.min_rate = min(self.min_rate, self.rate)
+            self.tokens = min(self.tokens, 0.0)
+            if pause:
+                self.paused_until = max(self.paused_until, time.monotonic() + pause)
+
+    def recover(self):
+        """Moves the rate back toward the configured rate after a successful call."""
+        if self.rate < self.base_rate:
+            with self.lock:
+                self.rate = min(self.base_rate, self.rate + self.base_rate * RECOVERY)
+
+    def metrics(self):
+        with self.lock:
+            return {'rate': round(self.rate, 3), 'min_rate': round(self.min_rate, 3),
+                    'configured_rate': self.base_rate,
+                    'queue_depth': sum(self.waiting.values()), 'max_queue_depth': self.max_depth,
+                    'granted': self.granted, 'throttled': self.throttled,
+                    'throttle_seconds': round(self.throttle_time, 3), 'rate_limited': self.rate_limited}
+
+
+class RateLimiter:
+    """Separate read and mutate buckets, shared by every API call in the process."""
+
+    def __init__(self, read_rate=READ_RATE, mutate_rate=MUTATE_RATE):
+        self.buckets = {name: TokenBucket(name, rate)
+                        for name, rate in (('read', read_rate), ('mutate', mutate_rate)) if rate > 0}
+
+    def acquire(self, method, cost=1):
+        """Waits for tokens for a call to `method`; returns the bucket it drew from, or None."""
+        name, lane = classify(method)
+        bucket = self.buckets.get(name)
+        if bucket:
+            bucket.acquire(lane, cost)
+        return bucket
+
+    async def acquire_async(self, method, cost=1):
+        name, lane = classify(method)
+        bucket = self.buckets.get(name)
+        if bucket:
+            await bucket.acquire_async(lane, cost)
+        return bucket
+
+    def call(self, method, execute):
+        """Runs execute() within the budget, backing off and retrying when the API rate-limits it."""
+        for attempt in range(MAX_RETRIES + 1):
+            bucket = self.acquire(method)
+            try:
+                result = execute()
+            except googleapiclient.errors.HttpError as e:
+                if not is_rate_limited(e) or bucket is None or attempt == MAX_RETRIES:
+                    raise
+                bucket.backoff(retry_after(e))
+                continue
+            if bucket:
+                bucket.recover()
+            return result
+
+    def metrics(self):
+        return {name: bucket.metrics() for name, bucket in self.buckets.items()}
+
+    def report(self):
+        """Returns one summary line per bucket."""
+        return '\n'.join(
+            f"{name}: {m['granted']} calls, {m['throttled']} throttled for {m['throttle_seconds']:.2f}s, "
+            f"peak queue {m['max_queue_depth']}, {m['rate_limited']} rate-limit errors, "
+            f"rate {m['rate']:g}/{m['configured_rate']:g} per second"
+            for name, m in self.metrics().items())
+
+
+_limiter = RateLimiter()
+
+
+def limiter():
+    """The process-wide limiter."""
+    return _limiter
+
+
+def enable(read_rate=READ_RATE, mutate_rate=MUTATE_RATE):
+    """Replaces the process-wide limiter; a rate of 0 leaves that kind of call unlimited."""
+    global _limiter
+    _limiter = RateLimiter(read_rate, mutate_rate)
+    return _limiter
+
+
+def add_arguments(parser):
+    """Adds the --read-rate and --mutate-rate options shared by the scripts."""
+    parser.add_argument('--read-rate', type=float, default=READ_RATE,
+                        help='API reads (gets, lists, operation polls) per second; 0 = unlimited')
+    parser.add_argument('--mutate-rate', type=float, default=MUTATE_RATE,
+                        help='API mutations (inserts, deletes, ...) per second; 0 = unlimited')
+
+
+def configure(args):
+    enable(args.read_rate, args.mutate_rate)
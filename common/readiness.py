@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Staged readiness checks: operation DONE -> instance RUNNING with an IP -> HTTP serving.
+
+wait_until_serving() runs the three phases in order and reports how long
+each one took, so "time to serving" can be measured instead of guessed
+with a fixed sleep.
+"""
+
+import time
+import urllib.error
+import urllib.request
+
+from common import tracing
+from common.fleet import external_ip
+from common.operations import wait_for_operation
+
+PROBE_TIMEOUT = 2       # seconds per HTTP attempt
+PROBE_INTERVAL = 2      # seconds between HTTP attempts
+POLL_INTERVAL = 2       # seconds between instances().get calls
+DEADLINE = 900          # seconds for the whole pipeline
+
+
+class NotReady(Exception):
+    """The instance did not reach the expected state before the deadline."""
+
+
+def remaining(give_up):
+    """Seconds left until the monotonic time `give_up`, never negative."""
+    return max(0.0, give_up - time.monotonic())
+
+
+def wait_for_running(compute, project, zone, instance_name, interval=POLL_INTERVAL, deadline=DEADLINE):
+    """Polls instances().get until the instance is RUNNING with a natIP; returns (instance, ip)."""
+    give_up = time.monotonic() + deadline
+    while True:
+        instance = compute.instances().get(project=project, zone=zone, instance=instance_name).execute()
+        ip = external_ip(instance)
+        if instance['status'] == 'RUNNING' and ip:
+            return instance, ip
+        if time.monotonic() >= give_up:
+            raise NotReady(f"{instance_name} is {instance['status']} (natIP={ip}) after {deadline:.1f}s")
+        time.sleep(interval)
+
+
+def probe_http(url, timeout=PROBE_TIMEOUT, interval=PROBE_INTERVAL, deadline=DEADLINE):
+    """Retries an HTTP GET until the server answers with a non-5xx status; returns the status."""
+    give_up = time.monotonic() + deadline
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            if e.code < 500:
+                return e.code
+        except (urllib.error.URLError, OSError):
+            pass
+        if time.monotonic() >= give_up:
+            raise NotReady(f"{url} did not answer within {deadline:.1f}s")
+        time.sleep(interval)
+
+
+def wait_until_serving(compute, project, zone, instance_name, operation=None, port=5000, path='/',
+                       probe_timeout=PROBE_TIMEOUT, probe_interval=PROBE_INTERVAL, deadline=DEADLINE,
+                       log=print):
+    """Runs the readiness pipeline and returns (url, {phase: seconds}).
+
+    The phases are 'operation' (insert DONE, skipped when no operation is
+    given), 'running' (RUNNING with a natIP) and 'serving' (HTTP answers).
+    'total' is the time to serving from the start of the pipeline. The
+    deadline covers all three phases; each gets whatever is left of it.
+    """
+    phases = {}
+    start = phase_start = time.monotonic()
+    give_up = start + deadline
+    if operation is not None:
+        with tracing.span('readiness.operation', instance=instance_name):
+            wait_for_operation(compute, project, zone, operation, log=log, timeout=remaining(give_up))
+        phases['operation'] = time.monotonic() - phase_start
+        phase_start = time.monotonic()
+
+    with tracing.span('readiness.running', instance=instance_name):
+        _, ip = wait_for_running(compute, project, zone, instance_name, deadline=remaining(give_up))
+    phases['running'] = time.monotonic() - phase_start
+    phase_start = time.monotonic()
+
+    url = f'http://{ip}:{port}{path}'
+    log(f"{instance_name} is RUNNING at {ip}, probing {url}...")
+    with tracing.span('readiness.serving', instance=instance_name, url=url):
+        probe_http(url, timeout=probe_timeout, interval=probe_interval, deadline=remaining(give_up))
+    phases['serving'] = time.monotonic() - phase_start
+    phases['total'] = time.monotonic() - start
+    return url, phases
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Declarative instance specs that build insert bodies and instance templates.
+
+Every VM these scripts create has the same shape: one boot disk, the default
+network with ONE_TO_ONE_NAT, the allow-5000 tag and a startup script. An
+InstanceSpec captures that once; body() renders the insert body for one VM
+with optional per-instance overrides. For bulk creation, the same spec can
+be stored as an instance template, and each insert then sends only a name
+plus a sourceInstanceTemplate reference. bulk_insert() goes one step further
+and creates many VMs from a spec or template in a single operation.
+"""
+
+import dataclasses
+import hashlib
+import json
+import re
+from dataclasses import dataclass, field
+
+import googleapiclient.errors
+
+from common.operations import wait_for_operations
+from common.startup import STARTUP_SCRIPT, startup_metadata
+
+
+@dataclass(frozen=True)
+class InstanceSpec:
+    """What a VM should look like, independent of its name and zone."""
+
+    source_image: str = 'projects/ubuntu-os-cloud/global/images/family/ubuntu-2204-lts'
+    source_snapshot: str = None     # used instead of source_image when set
+    machine_type: str = 'f1-micro'
+    startup_script: str = STARTUP_SCRIPT
+    metadata: dict = field(default_factory=dict)    # extra metadata keys besides startup-script
+    tags: tuple = ('allow-5000',)
+    labels: dict = field(default_factory=dict)
+    network: str = 'global/networks/default'
+    external_ip: bool = True
+    service_accounts: tuple = ()
+
+    def replace(self, **overrides):
+        """Returns a copy of the spec with some fields changed."""
+        return dataclasses.replace(self, **overrides)
+
+    def properties(self, machine_type):
+        """Returns the fields shared by instance bodies and template properties."""
+        source = ({'sourceSnapshot': self.source_snapshot} if self.source_snapshot
+                  else {'sourceImage': self.source_image})
+        nic = {'network': self.network}
+        if self.external_ip:
+            nic['accessConfigs'] = [{'type': 'ONE_TO_ONE_NAT', 'name': 'External NAT'}]
+        items = startup_metadata(self.startup_script) if self.startup_script else []
+        items += [{'key': key, 'value': value} for key, value in self.metadata.items()]
+        properties = {
+            'machineType': machine_type,
+            'disks': [{
+                'boot': True,
+                'autoDelete': True,
+                'initializeParams': source,
+            }],
+            'networkInterfaces': [nic],
+            'tags': {'items': list(self.tags)},
+            'metadata': {'items': items},
+        }
+        if self.labels:
+            properties['labels'] = dict(self.labels)
+        if self.service_accounts:
+            properties['serviceAccounts'] = [dict(account) for account in self.service_accounts]
+        return properties
+
+    def body(self, name, zone, **overrides):
+        """Returns the instances().insert body for one VM, with per-instance field overrides."""
+        spec = self.replace(**overrides) if overrides else self
+        return {'name': name, **spec.properties(f'zones/{zone}/machineTypes/{spec.machine_type}')}
+
+    def template_body(self, name):
+        """Returns the instanceTemplates().insert body for this spec."""
+        return {'name': name, 'properties': self.properties(self.machine_type)}
+
+    def fingerprint(self):
+        """Short hash of the spec, used to name immutable instance templates."""
+        encoded = json.dumps(self.properties(self.machine_type), sort_keys=True).encode()
+        return hashlib.sha256(encoded).hexdigest()[:10]
+
+
+def template_name(spec, prefix='flask'):
+    """Instance templates cannot change, so the name includes the spec fingerprint."""
+    return f'{prefix}-{spec.fingerprint()}'
+
+
+def ensure_instance_template(compute, project, spec, prefix='flask', log=print):
+    """Creates the instance template for a spec unless it already exists; returns its URL."""
+    name = template_name(spec, prefix)
+    try:
+        return compute.instanceTemplates().get(project=project, instanceTemplate=name).execute()['selfLink']
+    except googleapiclient.errors.HttpError as e:
+        if e.resp.status != 404:
+            raise
+    log(f"Creating instance template {name}...")
+    operation = compute.instanceTemplates().insert(project=project, body=spec.template_body(name)).execute()
+    wait_for_operations(compute, project, [operation], log=log)
+    return compute.instanceTemplates().get(project=project, instanceTemplate=name).execute()['selfLink']
+
+
+def insert_from_template(compute, project, zone, name, template):
+    """Inserts a VM whose request body is just its name plus a template reference."""
+    return compute.instances().insert(project=project, zone=zone, sourceInstanceTemplate=template,
+                                      body={'name': name}).execute()
+
+
+def bulk_insert(compute, project, zone, count, spec=None, template=None, name_pattern=None,
+                min_count=None, per_instance=None):
+    """Creates up to `count` VMs with one instances().bulkInsert call; returns the operation.
+
+    The VMs are built from `spec` or from the instance template URL
+    `template`. Names come from `name_pattern`, where a run of '#' becomes a
+    zero-padded sequence number (flask-clone-### -> flask-clone-001, ...),
+    and/or from the keys of `per_instance`, which maps each instance name to
+    its per-VM overrides (the API accepts 'hostname'). With `min_count`, the
+    operation succeeds as long as at least that many VMs could be created.
+    A pattern with too few '#' for `count` names raises ValueError.
+    """
+    if name_pattern and count > name_pattern_capacity(name_pattern):
+        raise ValueError(f"Name pattern {name_pattern} allows only {name_pattern_capacity(name_pattern)} names, "
+                         f"not {count}")
+    body = {'count': count}
+    if spec is not None:
+        body['instanceProperties'] = spec.properties(spec.machine_type)
+    if template:
+        body['sourceInstanceTemplate'] = template
+    if name_pattern:
+        body['namePattern'] = name_pattern
+    if min_count:
+        body['minCount'] = min_count
+    if per_instance:
+        body['perInstanceProperties'] = {name: {'name': name, **overrides}
+                                         for name, overrides in per_instance.items()}
+    return compute.instances().bulkInsert(project=project, zone=zone, body=body).execute()
+
+
+def name_pattern_capacity(pattern):
+    """How many names a bulkInsert namePattern can generate (its '#' run numbers from 1)."""
+    digits = max((len(run) for run in re.findall(r'#+', pattern)), default=0)
+    return 10 ** digits - 1 if digits else 1
+
+
+def name_pattern_for(prefix, count, min_digits=2):
+    """A namePattern like 'prefix-##' with enough '#' for `count` names."""
+    return f"{prefix}-{'#' * max(min_digits, len(str(count)))}"
+
+
+def name_pattern_regex(pattern):
+    """Compiles a bulkInsert namePattern into a regex matching the names it generates."""
+    parts = re.split(r'(#+)', pattern)
+    return re.compile(''.join(rf'\d{{{len(part)},}}' if part.startswith('#') else re.escape(part)
+                              for part in parts if part) + '$')
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""Startup scripts for the flask tutorial VMs.
+
+STARTUP_SCRIPT installs and starts the app on a stock Ubuntu/Debian image.
+It is idempotent: packages, the clone, the install and the database are only
+set up when they are missing, so re-running it (or booting a disk that
+already has everything) just starts the app. SERVE_SCRIPT only starts the
+app and is meant for VMs booted from an image or snapshot of a disk that
+STARTUP_SCRIPT already provisioned; if the app is not installed in APP_DIR
+(e.g. a disk set up by an older script), it provisions it first.
+
+Both scripts mark the start of each boot phase with a line
+'BOOT-PHASE <phase> <epoch seconds>'. The line goes to the serial console,
+and also to the guest attribute boot/<phase> when the VM has guest
+attributes enabled, which BOOT_METADATA does; the specs that run these
+scripts set it. Each phase in PHASES runs until the next marker. The
+last marker, 'serving', is printed once the app answers on its port, and
+never if it does not answer within a minute.
+common.boottrace reads the markers back.
+"""
+
+APP_DIR = '/opt/flask-tutorial'
+APP_REPO = 'https://github.com/cu-csci-4253-datacenter/flask-tutorial'
+APP_PORT = 5000
+
+# Instance metadata that lets boot_phase publish its markers as guest attributes
+BOOT_METADATA = {'enable-guest-attributes': 'TRUE'}
+
+# Markers in the order the scripts print them; SERVE_SCRIPT starts at init-db
+PHASES = ('packages', 'clone', 'install', 'init-db', 'start', 'serving')
+
+# Defines boot_phase, which prints a marker and publishes it as a guest attribute (if enabled)
+_MARK_PHASE = """boot_phase() {
+    local now=$(date +%s.%N)
+    echo "BOOT-PHASE $1 $now"
+    curl -s -m 2 -X PUT --data "$now" -H 'Metadata-Flavor: Google' \\
+        "http://metadata.google.internal/computeMetadata/v1/instance/guest-attributes/boot/$1" >/dev/null 2>&1 || true
+}
+"""
+
+# Starts flask in the background unless it is already running, then waits (up to a minute) for it to answer;
+# only an answer marks 'serving'
+_START_APP = f"""cd {APP_DIR}
+export FLASK_APP=flaskr
+boot_phase init-db
+[ -f instance/flaskr.sqlite ] || flask init-db
+boot_phase start
+pgrep -f "flask run" >/dev/null || nohup flask run -h 0.0.0.0 -p {APP_PORT} &
+for _ in $(seq 60); do
+    curl -s -o /dev/null http://localhost:{APP_PORT}/ && {{ boot_phase serving; break; }}
+    sleep 1
+done
+"""
+
+# Installs packages, clones the app into APP_DIR and installs it, skipping whatever is already there.
+# The import check runs from / so that the checkout's own flaskr/ does not count as installed.
+_PROVISION = f"""boot_phase packages
+if ! command -v pip3 >/dev/null || ! command -v git >/dev/null; then
+    sudo apt-get update
+    sudo apt-get install -y python3 python3-pip git
+fi
+boot_phase clone
+[ -d {APP_DIR} ] || git clone {APP_REPO} {APP_DIR}
+cd {APP_DIR}
+boot_phase install
+if ! (cd / && python3 -c 'import flaskr') 2>/dev/null; then
+    sudo python3 setup.py install
+    sudo pip3 install -e .
+fi
+"""
+
+STARTUP_SCRIPT = f"""#!/bin/bash
+{_MARK_PHASE}{_PROVISION}{_START_APP}"""
+
+# Disks provisioned before the app moved to APP_DIR (or never installed) get the full provisioning first
+SERVE_SCRIPT = f"""#!/bin/bash
+{_MARK_PHASE}if [ ! -d {APP_DIR} ] || ! (cd / && python3 -c 'import flaskr') 2>/dev/null; then
+{_PROVISION}fi
+{_START_APP}"""
+
+def startup_metadata(script=STARTUP_SCRIPT):
+    """Returns the metadata items list carrying a startup script."""
+    return [{'key': 'startup-script', 'value': script}]
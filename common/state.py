@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""A local SQLite record of each fleet, and a reconcile loop that converges on it.
+
+The store keeps three things per fleet:
+- the desired resources, each with the create call that makes it;
+- every create or delete operation issued, with its status;
+- the state of each resource when it was last listed.
+
+reconcile() lists each resource type once per zone and compares the result
+with the desired set. It issues only the missing creates, plus deletes for
+resources the fleet created earlier but no longer wants. Resources the
+store never created are left alone.
+
+Each operation is recorded as soon as the API returns it. A run that
+crashes mid-way therefore leaves its in-flight operations in the store,
+and the next reconcile resumes waiting on them instead of issuing them
+again. When nothing has changed, a re-run costs one list call per
+resource type and zone.
+"""
+
+import json
+import os
+import sqlite3
+import time
+from dataclasses import dataclass, field
+
+import googleapiclient.errors
+
+from common.fleet import batch_execute, list_all
+from common.operations import DEFAULT_TIMEOUT, OperationWaiter, operation_request, operation_scope
+
+STATE_DB = os.environ.get(
+    'COMPUTE_STATE_DB',
+    os.path.join(os.path.expanduser('~'), '.cache', 'programmable-cloud', 'state.db'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS resources (
+    fleet TEXT, kind TEXT, scope TEXT, name TEXT,
+    method TEXT, params TEXT, desired INTEGER,
+    PRIMARY KEY (fleet, kind, scope, name));
+CREATE TABLE IF NOT EXISTS operations (
+    name TEXT PRIMARY KEY, fleet TEXT, kind TEXT, scope TEXT, resource TEXT, action TEXT,
+    op_scope TEXT, op_location TEXT, status TEXT, issued REAL, finished REAL, error TEXT);
+CREATE TABLE IF NOT EXISTS observed (
+    kind TEXT, scope TEXT, name TEXT, status TEXT, seen REAL,
+    PRIMARY KEY (kind, scope, name));
+"""
+
+
+@dataclass(frozen=True)
+class Resource:
+    """A resource a fleet should have, and the call that creates it.
+
+    kind is the API collection ('instances', 'snapshots', ...), scope its zone
+    or 'global', and method/params the create call, e.g. 'instances.insert'
+    with {'zone': ..., 'body': ...}.
+    """
+
+    kind: str
+    scope: str
+    name: str
+    method: str
+    params: dict = field(default_factory=dict)
+
+    @property
+    def key(self):
+        return self.kind, self.scope, self.name
+
+
+def instance_resource(zone, body, **insert_params):
+    """An instance created by instances().insert with the given body."""
+    return Resource('instances', zone, body['name'], 'instances.insert',
+                    {'zone': zone, 'body': body, **insert_params})
+
+
+def snapshot_resource(zone, disk, name, **fields):
+    """A snapshot created from a zonal disk by disks().createSnapshot."""
+    return Resource('snapshots', 'global', name, 'disks.createSnapshot',
+                    {'zone': zone, 'disk': disk, 'body': {'name': name, **fields}})
+
+
+class StateStore:
+    """Desired resources, issued operations and observed state, kept in SQLite."""
+
+    def __init__(self, path=STATE_DB):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def set_desired(self, fleet, resources):
+        """Makes `resources` the fleet's desired set; resources it had before are marked for deletion."""
+        with self.db:
+            self.db.execute('UPDATE resources SET desired = 0 WHERE fleet = ?', (fleet,))
+            self.db.executemany(
+                'INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?, ?, 1)',
+                [(fleet, r.kind, r.scope, r.name, r.method, json.dumps(r.params)) for r in resources])
+
+    def managed(self, fleet):
+        """Returns [(Resource, desired)] for everything the fleet wants or created earlier."""
+        rows = self.db.execute('SELECT kind, scope, name, method, params, desired FROM resources '
+                               'WHERE fleet = ? ORDER BY rowid', (fleet,))
+        return [(Resource(kind, scope, name, method, json.loads(params)), bool(desired))
+                for kind, scope, name, method, params, desired in rows]
+
+    def forget(self, fleet, key):
+        with self.db:
+            self.db.execute('DELETE FROM resources WHERE fleet = ? AND kind = ? AND scope = ? AND name = ?',
+                            (fleet, *key))
+
+    def record_operation(self, fleet, key, action, operation):
+        scope, location = operation_scope(operation)
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO operations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, NULL)',
+                            (operation['name'], fleet, *key, action, scope, location, 'RUNNING', time.time()))
+
+    def finish_operation(self, name, status, error=None):
+        """Marks an operation DONE, ERROR or LOST; returns its (key, action, issued time) or None."""
+        row = self.db.execute('SELECT kind, scope, resource, action, issued FROM operations WHERE name = ?',
+                              (name,)).fetchone()
+        with self.db:
+            self.db.execute('UPDATE operations SET status = ?, finished = ?, error = ? WHERE name = ?',
+                            (status, time.time(), error, name))
+        return ((row[0], row[1], row[2]), row[3], row[4]) if row else None
+
+    def in_flight(self, fleet):
+        """Returns [(operation name, (scope kind, location), resource key)] for unfinished operations."""
+        rows = self.db.execute("SELECT name, op_scope, op_location, kind, scope, resource FROM operations "
+                               "WHERE fleet = ? AND status = 'RUNNING'", (fleet,))
+        return [(name, (op_scope, location), (kind, scope, resource))
+                for name, op_scope, location, kind, scope, resource in rows]
+
+    def observe(self, kind, scope, items):
+        """Replaces the observed state of one resource type in one scope with a fresh listing."""
+        now = time.time()
+        with self.db:
+            self.db.execute('DELETE FROM observed WHERE kind = ? AND scope = ?', (kind, scope))
+            self.db.executemany('INSERT INTO observed VALUES (?, ?, ?, ?, ?)',
+                                [(kind, scope, item['name'], item.get('status'), now) for item in items])
+
+
+def _list(compute, project, kind, scope):
+    params = {} if scope == 'global' else {'zone': scope}
+    return list_all(getattr(compute, kind)(), project=project, **params)
+
+
+def _create_request(compute, project, resource):
+    collection, method = resource.method.split('.')
+    return getattr(getattr(compute, collection)(), method)(project=project, **resource.params)
+
+
+def _delete_request(compute, project, key):
+    kind, scope, name = key
+    params = {} if scope == 'global' else {'zone': scope}
+    # instances -> instance=, snapshots -> snapshot=, instanceTemplates -> instanceTemplate=
+    return getattr(compute, kind)().delete(project=project, **params, **{kind[:-1]: name})
+
+
+def _status(error):
+    return error.resp.status if isinstance(error, googleapiclient.errors.HttpError) else None
+
+
+def reconcile(compute, project, store, fleet, resources, timeout=DEFAULT_TIMEOUT, log=print):
+    """Converges the fleet on `resources` and returns what changed.
+
+    Resource types are created in the order they first appear in
+    `resources` (e.g. the snapshot before the clones that boot from it),
+    each stage waiting for the previous one. Unwanted resources are deleted
+    in the reverse order. Returns {'created': {name: seconds}, 'deleted':
+    [names], 'unchanged': [names], 'failed': {name: error}, 'resumed': n}.
+    """
+    store.set_desired(fleet, resources)
+    managed = store.managed(fleet)
+    result = {'created': {}, 'deleted': [], 'unchanged': [], 'failed': {}, 'resumed': 0}
+    pending = {}    # operation name -> resource key
+
+    def done(operation):
+        key = pending.pop(operation['name'], None)
+        finished = store.finish_operation(operation['name'], 'ERROR' if 'error' in operation else 'DONE',
+                                          json.dumps(operation['error']) if 'error' in operation else None)
+        if key is None or finished is None:
+            return
+        _, action, issued = finished
+        if 'error' in operation:
+            result['failed'][key[2]] = '; '.join(e.get('message', '') for e in operation['error'].get('errors', []))
+        elif action == 'create':
+            result['created'][key[2]] = time.time() - issued
+            log(f"Created {key[0][:-1]} {key[2]} in {result['created'][key[2]]:.2f} seconds")
+        else:
+            store.forget(fleet, key)
+            result['deleted'].append(key[2])
+            log(f"Deleted {key[0][:-1]} {key[2]}")
+
+    waiter = OperationWaiter(compute, project, timeout=timeout, raise_on_error=False, on_done=done, log=log)
+
+    # Resume operations a previous run issued but never saw finish
+    resumed = store.in_flight(fleet)
+    if resumed:
+        log(f"Resuming {len(resumed)} in-flight operations from the last run...")
+        responses = batch_execute(compute, {name: operation_request(compute, project, name, scope)
+                                            for name, scope, _ in resumed})
+        for name, (scope, location), key in resumed:
+            response = responses[name]
+            if _status(response) == 404:
+                # Too old for the API to remember; the listing below shows what it did
+                store.finish_operation(name, 'LOST')
+                continue
+            pending[name] = key
+            # On a transient error, let the waiter retry the get in the operation's own scope
+            waiter.add(response if isinstance(response, dict) else
+                       {'name': name, scope: location} if location else {'name': name})
+            result['resumed'] += 1
+    in_progress = set(pending.values())
+
+    # One list call per resource type and scope
+    actual = {}
+    for kind, scope in dict.fromkeys((r.kind, r.scope) for r, _ in managed):
+        items = _list(compute, project, kind, scope)
+        store.observe(kind, scope, items)
+        actual.update({(kind, scope, item['name']): item for item in items})
+
+    def issue(action, requests):
+        responses = batch_execute(compute, requests)
+        for key, response in responses.items():
+            if isinstance(response, Exception):
+                if action == 'create' and _status(response) == 409:
+                    result['unchanged'].append(key[2])
+                elif action == 'delete' and _status(response) == 404:
+                    store.forget(fleet, key)
+                else:
+                    result['failed'][key[2]] = str(response)
+                continue
+            store.record_operation(fleet, key, action, response)
+            pending[response['name']] = key
+            waiter.add(response)
+
+    kinds = list(dict.fromkeys([r.kind for r in resources] + [r.kind for r, _ in managed]))
+    for kind in kinds:
+        wanted = [r for r, desired in managed if desired and r.kind == kind]
+        missing = [r for r in wanted if r.key not in actual and r.key not in in_progress]
+        result['unchanged'] += [r.name for r in wanted if r.key in actual and r.key not in in_progress]
+        if missing:
+            log(f"Creating {len(missing)} {kind}: {', '.join(r.name for r in missing)}")
+            issue('create', {r.key: _create_request(compute, project, r) for r in missing})
+        waiter.wait()
+
+    for kind in reversed(kinds):
+        unwanted = [r for r, desired in managed if not desired and r.kind == kind]
+        for r in unwanted:
+            if r.key not in actual and r.key not in in_progress:
+                store.forget(fleet, r.key)
+        extra = [r for r in unwanted if r.key in actual and r.key not in in_progress]
+        if extra:
+            log(f"Deleting {len(extra)} {kind}: {', '.join(r.name for r in extra)}")
+            issue('delete', {r.key: _delete_request(compute, project, r.key) for r in extra})
+        waiter.wait()
+    return result
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""Small summary statistics for latency samples (no numpy needed)."""
+
+import math
+
+
+def percentile(values, q):
+    """Returns the q-th percentile (0-100) of values, interpolating linearly; None when empty."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = (len(ordered) - 1) * q / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(values):
+    """Returns count, mean, p50, p95, p99 and max of a list of samples."""
+    values = list(values)
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values) if values else None,
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': max(values) if values else None,
+    }
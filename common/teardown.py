@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""Tear down what the part1/part2/part3 scripts left behind, in parallel.
+
+A Teardown finds resources by name pattern (DEFAULT_PATTERNS covers
+everything the scripts create) or by label. It needs one list call per
+resource type; instances are found in every zone with one aggregated
+list.
+
+Deletion runs in STAGES, in dependency order:
+1. instances;
+2. instance templates, images and snapshots;
+3. firewall rules.
+
+Each stage sends its deletes in batch HTTP requests and tracks every
+operation in one OperationWaiter. Deleting a hundred VMs therefore takes
+about as long as deleting one.
+
+Resources older than a TTL are orphans: a run that created them is
+long gone. report() lists them, and delete() can be limited to them.
+"""
+
+import re
+import time
+from dataclasses import dataclass
+from datetime import datetime
+
+import googleapiclient.errors
+
+from common import tracing
+from common.fleet import aggregated_instances, batch_execute, list_all
+from common.operations import DEFAULT_TIMEOUT, OperationWaiter
+
+# Names the scripts give what they create, per resource type (matched in full)
+DEFAULT_PATTERNS = {
+    'instances': r'flask-tutorial-instance|flask-clone-\d+|flask-warm-\d+|vm1-instance|vm2-instance(-\d+)?'
+                 r'|bench-p[123]-.+',
+    'instanceTemplates': r'flask-[0-9a-f]{10}',
+    'images': r'flask-tutorial-.+',
+    'snapshots': r'base-snapshot-.+',
+    'firewalls': r'allow-5000',
+}
+# Labels the scripts put on what they create (common.pool, common.artifacts)
+DEFAULT_LABELS = ('warm-pool', 'artifact-key')
+STAGES = (('instances',), ('instanceTemplates', 'images', 'snapshots'), ('firewalls',))
+TTL = 24 * 3600     # seconds after which a leftover resource counts as an orphan
+
+
+@dataclass(frozen=True)
+class Leftover:
+    """A resource the scripts created."""
+
+    kind: str
+    scope: str          # the zone for instances, 'global' otherwise
+    name: str
+    created: float      # epoch seconds
+
+    def age(self, now=None):
+        return (now or time.time()) - self.created
+
+
+def parse_label(text):
+    """Parses 'key' or 'key=value' into (key, value or None)."""
+    key, _, value = text.partition('=')
+    return key, value or None
+
+
+def _delete_request(compute, project, leftover):
+    params = {} if leftover.scope == 'global' else {'zone': leftover.scope}
+    # instances -> instance=, snapshots -> snapshot=, instanceTemplates -> instanceTemplate=
+    return getattr(compute, leftover.kind)().delete(project=project, **params, **{leftover.kind[:-1]: leftover.name})
+
+
+class Teardown:
+    """Finds the scripts' resources in a project and deletes them stage by stage."""
+
+    def __init__(self, compute, project, patterns=None, labels=DEFAULT_LABELS, log=print):
+        self.compute = compute
+        self.project = project
+        patterns = DEFAULT_PATTERNS if patterns is None else patterns
+        self.patterns = {kind: re.compile(pattern) for kind, pattern in patterns.items()}
+        self.labels = [parse_label(label) for label in labels]
+        self.log = log
+        self.found = []
+        self.results = {}   # kind -> {'deleted': [names], 'failed': {name: error}, 'seconds': float}
+
+    def _matches(self, kind, item):
+        pattern = self.patterns.get(kind)
+        if pattern and pattern.fullmatch(item['name']):
+            return True
+        labels = item.get('labels', {})
+        return any(key in labels and value in (None, labels[key]) for key, value in self.labels)
+
+    def find(self):
+        """Lists every resource type once and returns the matching Leftovers."""
+        listed = {'instances': aggregated_instances(self.compute, self.project)}
+        for kind in (kind for stage in STAGES for kind in stage if kind != 'instances'):
+            listed[kind] = list_all(getattr(self.compute, kind)(), project=self.project)
+        self.found = [
+            Leftover(kind, item['zone'].rsplit('/', 1)[-1] if kind == 'instances' else 'global', item['name'],
+                     datetime.fromisoformat(item['creationTimestamp']).timestamp())
+            for kind, items in listed.items() for item in items if self._matches(kind, item)]
+        return self.found
+
+    def orphans(self, ttl=TTL, now=None):
+        """Returns the found Leftovers older than `ttl` seconds, oldest first."""
+        now = now or time.time()
+        return sorted((leftover for leftover in self.found if leftover.age(now) > ttl),
+                      key=lambda leftover: leftover.created)
+
+    def delete(self, leftovers=None, timeout=DEFAULT_TIMEOUT):
+        """Deletes the Leftovers (default: all found) stage by stage; returns the per-kind results.
+
+        A resource that is already gone counts as deleted. Failures are
+        recorded and do not stop later stages.
+        """
+        leftovers = self.found if leftovers is None else leftovers
+        for stage in STAGES:
+            batch = [leftover for leftover in leftovers if leftover.kind in stage]
+            if batch:
+                with tracing.span('teardown.stage', kinds=','.join(stage), resources=len(batch)):
+                    self._delete_stage(batch, timeout)
+        return self.results
+
+    def _delete_stage(self, leftovers, timeout):
+        start = time.monotonic()
+        pending = {}    # operation name -> Leftover
+
+        def result(leftover):
+            return self.results.setdefault(leftover.kind, {'deleted': [], 'failed': {}, 'seconds': 0.0})
+
+        def done(operation):
+            leftover = pending.pop(operation['name'], None)
+            if leftover is None:
+                return
+            if 'error' in operation:
+                result(leftover)['failed'][leftover.name] = '; '.join(
+                    e.get('message', '') for e in operation['error'].get('errors', []))
+            else:
+                result(leftover)['deleted'].append(leftover.name)
+                self.log(f"Deleted {leftover.kind[:-1]} {leftover.name}")
+
+        waiter = OperationWaiter(self.compute, self.project, timeout=timeout, raise_on_error=False, on_done=done,
+                                 log=self.log)
+        responses = batch_execute(self.compute, {
+            leftover: _delete_request(self.compute, self.project, leftover) for leftover in leftovers})
+        for leftover, response in responses.items():
+            if isinstance(response, googleapiclient.errors.HttpError) and response.resp.status == 404:
+                result(leftover)['deleted'].append(leftover.name)
+            elif isinstance(response, Exception):
+                result(leftover)['failed'][leftover.name] = str(response)
+            else:
+                pending[response['name']] = leftover
+                waiter.add(response)
+        waiter.wait()
+        seconds = time.monotonic() - start
+        for kind in {leftover.kind for leftover in leftovers}:
+            self.results[kind]['seconds'] = seconds
+
+    def report(self, ttl=TTL, now=None):
+        """Returns text lines: what was found and deleted per resource type, then the orphans older than `ttl`."""
+        now = now or time.time()
+        lines = ['| resource | found | deleted | failed | stage seconds |',
+                 '|----------|-------|---------|--------|---------------|']
+        for kind in (kind for stage in STAGES for kind in stage):
+            found = sum(1 for leftover in self.found if leftover.kind == kind)
+            r = self.results.get(kind, {'deleted': [], 'failed': {}, 'seconds': 0.0})
+            if found or r['deleted'] or r['failed']:
+                lines.append(f"| {kind} | {found} | {len(r['deleted'])} | {len(r['failed'])} "
+                             f"| {r['seconds']:.2f} |")
+        for r in self.results.values():
+            lines += [f"{name} failed: {error}" for name, error in r['failed'].items()]
+        orphans = self.orphans(ttl, now)
+        lines.append(f"\n{len(orphans)} orphans older than {ttl / 3600:g}h")
+        if orphans:
+            lines += ['| resource | scope | name | age (h) |', '|----------|-------|------|---------|']
+            lines += [f"| {o.kind[:-1]} | {o.scope} | {o.name} | {o.age(now) / 3600:.1f} |" for o in orphans]
+        return lines
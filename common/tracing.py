@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""Opt-in tracing of Compute API calls and wait phases.
+
+When tracing is enabled, every API ``execute()``, batch request, operation
+wait and readiness phase is recorded as a span. Each span is one JSON line
+holding its name, start time, duration, parent span, thread and
+attributes. For API calls the attributes are the method, resource, HTTP
+status and retries. When an operation finishes, the trace also records its
+server-side insertTime, startTime and endTime. That splits each call into
+time queued in the API (insert -> start), time provisioning in GCE
+(start -> end) and time until we noticed (end -> observed).
+
+Enable it with enable(path), with --trace on the scripts, or with the
+PROVISION_TRACE environment variable. With otel=True (or
+PROVISION_TRACE_OTEL=1) spans also go to OpenTelemetry through
+opentelemetry-api, exported by whatever SDK is configured. When tracing is
+off, span() returns a shared no-op object and API calls go straight
+through.
+"""
+
+import atexit
+import itertools
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import googleapiclient.errors
+
+_lock = threading.Lock()
+_local = threading.local()
+_ids = itertools.count(1)
+_active = False
+_file = None
+_tracer = None
+
+
+def enable(path=None, otel=False):
+    """Starts writing spans to the JSONL file at path and/or to OpenTelemetry."""
+    global _active, _file, _tracer
+    if otel:
+        try:
+            from opentelemetry import trace
+        except ImportError as e:
+            raise RuntimeError("OpenTelemetry export needs the opentelemetry-api package") from e
+        _tracer = trace.get_tracer('programmable-cloud')
+    if path:
+        _file = open(path, 'a', buffering=1)
+        atexit.register(disable)
+    _active = bool(_file or _tracer)
+
+
+def disable():
+    """Stops tracing and closes the trace file."""
+    global _active, _file, _tracer
+    with _lock:
+        _active = False
+        if _file:
+            _file.close()
+        _file = _tracer = None
+
+
+def enabled():
+    return _active
+
+
+def add_arguments(parser):
+    """Adds the --trace and --otel options shared by the scripts."""
+    parser.add_argument('--trace', metavar='PATH', help='append a JSONL span per API call and wait phase to PATH')
+    parser.add_argument('--otel', action='store_true', help='also send spans to OpenTelemetry')
+
+
+def configure(args):
+    """Enables tracing from the --trace/--otel options, if given."""
+    if args.trace or args.otel:
+        enable(args.trace, otel=args.otel)
+
+
+class Span:
+    """One timed step. Use it as a context manager; set() adds attributes before it ends."""
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.id = next(_ids)
+        self.parent = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        stack = _local.__dict__.setdefault('stack', [])
+        self.parent = stack[-1].id if stack else None
+        stack.append(self)
+        self.start = time.time()
+        self._clock = time.perf_counter()
+        if _tracer:
+            self._otel = _tracer.start_as_current_span(self.name)
+            self._otel_span = self._otel.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._clock
+        _local.stack.pop()
+        if exc is not None:
+            self.attributes.setdefault('error', f'{exc_type.__name__}: {exc}')
+        _write({'name': self.name, 'span_id': self.id, 'parent_id': self.parent,
+                'thread': threading.current_thread().name, 'start': self.start,
+                'duration': duration, **self.attributes})
+        if getattr(self, '_otel', None):
+            for key, value in self.attributes.items():
+                if isinstance(value, (str, bool, int, float)):
+                    self._otel_span.set_attribute(key, value)
+            self._otel.__exit__(exc_type, exc, tb)
+        return False
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name, **attributes):
+    """Returns a span context manager, or a shared no-op when tracing is off."""
+    return Span(name, attributes) if _active else _NOOP
+
+
+def event(name, **attributes):
+    """Records a zero-length span."""
+    if _active:
+        with Span(name, attributes):
+            pass
+
+
+def _write(record):
+    if _file is None:
+        return
+    line = json.dumps(record, default=str)
+    with _lock:
+        if _file is not None:
+            _file.write(line + '\n')
+
+
+def operation_times(operation, observed=None):
+    """Returns an operation's server-side timestamps and the phases between them, in seconds."""
+    times = {key: operation[key] for key in ('insertTime', 'startTime', 'endTime') if operation.get(key)}
+    parsed = {key: datetime.fromisoformat(value).timestamp() for key, value in times.items()}
+    if 'insertTime' in parsed and 'startTime' in parsed:
+        times['queued'] = parsed['startTime'] - parsed['insertTime']
+    if 'startTime' in parsed and 'endTime' in parsed:
+        times['provisioning'] = parsed['endTime'] - parsed['startTime']
+    if observed is not None and 'endTime' in parsed:
+        times['detection_lag'] = observed - parsed['endTime']
+    return times
+
+
+def traced_call(method, resource, execute, retries=None):
+    """Runs execute() inside an 'api.call' span and returns its result.
+
+    `retries` is a list the transport appends to on each retry; its length
+    is recorded once the call returns.
+    """
+    if not _active:
+        return execute()
+    with Span('api.call', {'method': method, 'resource': resource}) as s:
+        try:
+            result = execute()
+        except googleapiclient.errors.HttpError as e:
+            s.set(status=e.resp.status)
+            raise
+        finally:
+            if retries is not None:
+                s.set(retries=len(retries))
+        s.set(status=200)
+        if isinstance(result, dict) and result.get('kind') == 'compute#operation':
+            s.set(operation=result.get('name'), operation_status=result.get('status'),
+                  **operation_times(result))
+        return result
+
+
+if os.environ.get('PROVISION_TRACE') or os.environ.get('PROVISION_TRACE_OTEL'):
+    enable(os.environ.get('PROVISION_TRACE'), otel=bool(os.environ.get('PROVISION_TRACE_OTEL')))
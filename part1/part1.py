@@ -2,66 +2,34 @@
 
 import argparse
 import os
+import sys
 import time
 from pprint import pprint
-import googleapiclient.discovery
-import google.auth
+import googleapiclient.errors
 
-# Authenticate and build the compute engine client
-credentials, _ = google.auth.default()
-project = 'directed-galaxy-437903-g9'  # Replace with your project ID
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import ratelimit, readiness, tracing
+from common.boottrace import BootCollector
+from common.client import cold_start_report, get_compute
+from common.dag import Graph
+from common.images import bake_image, family_image
+from common.spec import InstanceSpec
+from common.startup import BOOT_METADATA, SERVE_SCRIPT, STARTUP_SCRIPT
 
-service = googleapiclient.discovery.build('compute', 'v1', credentials=credentials)
+project = 'directed-galaxy-437903-g9'  # Replace with your project ID
 
 # Constants for the instance creation
 INSTANCE_NAME = 'flask-tutorial-instance'
 ZONE = 'us-west1-b'
-MACHINE_TYPE = f'zones/{ZONE}/machineTypes/f1-micro'
+MACHINE_TYPE = 'f1-micro'
 SOURCE_IMAGE = 'projects/ubuntu-os-cloud/global/images/family/ubuntu-2204-lts'
 FIREWALL_RULE_NAME = 'allow-5000'
+SPEC = InstanceSpec(source_image=SOURCE_IMAGE, machine_type=MACHINE_TYPE, metadata=dict(BOOT_METADATA))
 
-# Startup script for the Flask app setup
-STARTUP_SCRIPT = """#!/bin/bash
-sudo apt-get update
-sudo apt-get install -y python3 python3-pip git
-git clone https://github.com/cu-csci-4253-datacenter/flask-tutorial
-cd flask-tutorial
-sudo python3 setup.py install
-sudo pip3 install -e .
-export FLASK_APP=flaskr
-flask init-db
-nohup flask run -h 0.0.0.0 &
-"""
-
-def create_instance(compute, project, zone, instance_name):
+def create_instance(compute, project, zone, instance_name, source_image=SOURCE_IMAGE,
+                    startup_script=STARTUP_SCRIPT):
     """Creates a VM instance."""
-    config = {
-        'name': instance_name,
-        'machineType': MACHINE_TYPE,
-        'disks': [{
-            'boot': True,
-            'autoDelete': True,
-            'initializeParams': {
-                'sourceImage': SOURCE_IMAGE,
-            }
-        }],
-        'networkInterfaces': [{
-            'network': 'global/networks/default',
-            'accessConfigs': [{
-                'type': 'ONE_TO_ONE_NAT',
-                'name': 'External NAT'
-            }]
-        }],
-        'tags': {
-            'items': ['allow-5000']
-        },
-        'metadata': {
-            'items': [{
-                'key': 'startup-script',
-                'value': STARTUP_SCRIPT
-            }]
-        }
-    }
+    config = SPEC.body(instance_name, zone, source_image=source_image, startup_script=startup_script)
 
     return compute.instances().insert(
         project=project,
@@ -99,21 +67,77 @@ def get_instance_ip(compute, project, zone, instance_name):
     instance_info = compute.instances().get(project=project, zone=zone, instance=instance_name).execute()
     return instance_info['networkInterfaces'][0]['accessConfigs'][0]['natIP']
 
+def provision_graph(project, zone, instance_name, source_image=SOURCE_IMAGE, startup_script=STARTUP_SCRIPT,
+                    port=5000, probe_timeout=readiness.PROBE_TIMEOUT, probe_interval=readiness.PROBE_INTERVAL,
+                    deadline=readiness.DEADLINE):
+    """Returns part1 as a graph of steps.
+
+    The firewall rule and the instance are created concurrently. The HTTP
+    probe waits for both the firewall rule's global operation and the
+    instance to be RUNNING. The deadline counts from when the graph is built
+    and covers both waits together.
+    """
+    give_up = time.monotonic() + deadline
+    graph = Graph()
+    graph.add('firewall', lambda compute, _: create_firewall_rule(compute, project))
+    graph.add('instance', lambda compute, _: create_instance(compute, project, zone, instance_name,
+                                                             source_image, startup_script))
+    graph.add('running', lambda compute, _: readiness.wait_for_running(compute, project, zone, instance_name,
+                                                                       deadline=readiness.remaining(give_up))[1],
+              deps=['instance'])
+    graph.add('serving', lambda compute, results: readiness.probe_http(
+        f"http://{results['running']}:{port}/", timeout=probe_timeout, interval=probe_interval,
+        deadline=readiness.remaining(give_up)),
+              deps=['running', 'firewall'])
+    return graph
+
 def main():
-    # Create the firewall rule if it doesn't exist
-    create_firewall_rule(service, project)
+    parser = argparse.ArgumentParser(description='Create a VM running the flask tutorial app.')
+    parser.add_argument('command', nargs='?', default='create', choices=['create', 'bake'],
+                        help='create the VM (default), or bake its disk into a golden image')
+    parser.add_argument('--image', action='store_true',
+                        help='boot from the newest baked golden image and only start the app')
+    parser.add_argument('--probe-timeout', type=float, default=readiness.PROBE_TIMEOUT,
+                        help='seconds per HTTP health check attempt')
+    parser.add_argument('--probe-interval', type=float, default=readiness.PROBE_INTERVAL,
+                        help='seconds between HTTP health check attempts')
+    parser.add_argument('--deadline', type=float, default=readiness.DEADLINE,
+                        help='give up if the app is not serving after this many seconds')
+    parser.add_argument('--fake', action='store_true',
+                        help='run against the local fake Compute API; the app is probed on 127.0.0.1')
+    tracing.add_arguments(parser)
+    ratelimit.add_arguments(parser)
+    args = parser.parse_args()
+    tracing.configure(args)
+    ratelimit.configure(args)
 
-    # Create the VM instance
-    print(f"Creating instance {INSTANCE_NAME} in {ZONE}...")
-    create_instance(service, project, ZONE, INSTANCE_NAME)
+    if args.fake:
+        from common.fake_compute import FakeCompute
+        service = FakeCompute(latency=2.0, nat_ip='127.0.0.1')
+        if args.command == 'bake':
+            service.add_instance(project, ZONE, INSTANCE_NAME)
+    else:
+        service = get_compute()
 
-    # Wait for the instance to initialize (you may need to adjust sleep time)
-    print("Waiting for the instance to start...")
-    time.sleep(60)  # Adjust the sleep time as needed
+    if args.command == 'bake':
+        # The disk should already have the app installed by STARTUP_SCRIPT
+        bake_image(service, project, ZONE, INSTANCE_NAME)
+        return
 
-    # Retrieve and print the external IP of the VM instance
-    external_ip = get_instance_ip(service, project, ZONE, INSTANCE_NAME)
-    print(f"Your Flask application is running at http://{external_ip}:5000")
+    # Create the firewall rule and the VM instance, then wait until the Flask app answers
+    print(f"Creating instance {INSTANCE_NAME} in {ZONE}...")
+    source = {'source_image': family_image(project), 'startup_script': SERVE_SCRIPT} if args.image else {}
+    graph = provision_graph(project, ZONE, INSTANCE_NAME, probe_timeout=args.probe_timeout,
+                            probe_interval=args.probe_interval, deadline=args.deadline, **source)
+    results = graph.run((lambda: service) if args.fake else get_compute, project)
+    print('\n'.join(graph.report()))
+    print(f"Your Flask application is running at http://{results['running']}:5000/")
+    if not args.fake:
+        # Where the time to serving went, from the startup script's boot-phase markers
+        collector = BootCollector(service, project, ZONE, [INSTANCE_NAME])
+        collector.collect(deadline=60)
+        print('\n'.join(collector.report()))
+        print(cold_start_report())
 
 if __name__ == '__main__':
     main()
@@ -1,135 +1,634 @@
 #!/usr/bin/env python3
 
+import argparse
 import os
+import sys
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
 from pprint import pprint
-import googleapiclient.discovery
-import google.auth
+import googleapiclient.errors
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import autoscale, ratelimit, tracing
+from common.artifacts import ArtifactCache
+from common.client import cold_start_report, get_compute
+from common.dag import Graph
+from common.fleet import get_instances, list_all
+from common.images import IMAGE_FAMILY, family_image
+from common.operations import OperationWaiter, wait_for_operation
+from common.placement import PlacementScheduler
+from common.pool import FILL_TIMEOUT, MODES, WarmPool
+from common.readiness import wait_until_serving
+from common.spec import InstanceSpec, bulk_insert, ensure_instance_template, name_pattern_regex
+from common.startup import BOOT_METADATA, SERVE_SCRIPT
+from common.teardown import DEFAULT_LABELS, DEFAULT_PATTERNS, TTL, Teardown
+from common.state import STATE_DB, StateStore, instance_resource, reconcile, snapshot_resource
 
 # Manually set the project ID
 project = 'directed-galaxy-437903-g9'
-credentials, _ = google.auth.default()
-service = googleapiclient.discovery.build('compute', 'v1', credentials=credentials)
 ZONE = 'us-west1-b'
 INSTANCE_NAME = 'flask-tutorial-instance'
 DISK_NAME = 'flask-tutorial-instance'  # Replace with actual disk name
 
-# Startup script for Flask application
-STARTUP_SCRIPT = """#!/bin/bash
-sudo apt-get update
-sudo apt-get install -y python3 python3-pip git
-git clone https://github.com/cu-csci-4253-datacenter/flask-tutorial
-cd flask-tutorial
-sudo python3 setup.py install
-sudo pip3 install -e .
-export FLASK_APP=flaskr
-flask init-db
-nohup flask run -h 0.0.0.0 -p 5000 &
-"""
-
-def wait_for_operation(compute, project, zone, operation):
-    print('Waiting for operation to finish...')
-    while True:
-        result = compute.zoneOperations().get(
-            project=project,
-            zone=zone,
-            operation=operation).execute()
-
-        if result['status'] == 'DONE':
-            print("Operation finished.")
-            return result
-        time.sleep(10)
-
 def list_instances(compute, project, zone):
-    """Lists all instances in the specified zone."""
-    result = compute.instances().list(project=project, zone=zone).execute()
-    return result['items'] if 'items' in result else None
+    """Lists all instances in the specified zone, following every page."""
+    return list_all(compute.instances(), project=project, zone=zone) or None
+
+SNAPSHOT_PREFIX = f'base-snapshot-{INSTANCE_NAME}'
+SNAPSHOT_DESCRIPTION = 'Snapshot of the Flask app instance'
 
 def create_snapshot(compute, project, zone, instance_name, disk_name):
-    """Creates a snapshot of the disk from an instance."""
-    snapshot_body = {
-        'name': f'base-snapshot-{instance_name}',
-        'description': 'Snapshot of the Flask app instance'
-    }
+    """Snapshots the disk of an instance, reusing a snapshot of the same disk state; returns its name."""
+    return ArtifactCache(compute, project).ensure_snapshot(zone, instance_name, disk_name,
+                                                           f'base-snapshot-{instance_name}',
+                                                           description=SNAPSHOT_DESCRIPTION)
 
-    print(f"Creating snapshot for instance {instance_name}...")
+# Clones boot from a snapshot or image that already holds the installed app,
+# so they only need SERVE_SCRIPT to start it instead of re-running the install
+CLONE_SPEC = InstanceSpec(startup_script=SERVE_SCRIPT, metadata=dict(BOOT_METADATA))
 
-    operation = compute.disks().createSnapshot(
-        project=project,
-        zone=zone,
-        disk=disk_name,
-        body=snapshot_body
-    ).execute()
+def snapshot_spec(snapshot_name):
+    return CLONE_SPEC.replace(source_snapshot=f'global/snapshots/{snapshot_name}')
 
-    wait_for_operation(compute, project, zone, operation['name'])
-    print(f"Snapshot created: base-snapshot-{instance_name}")
+def image_spec(image):
+    if '/' not in image:
+        image = f'global/images/{image}'
+    return CLONE_SPEC.replace(source_image=image)
 
-def create_instance_from_snapshot(compute, project, zone, instance_name, snapshot_name):
-    """Creates a new instance from the given snapshot."""
-    config = {
-        'name': instance_name,
-        'machineType': f'zones/{zone}/machineTypes/f1-micro',
-        'disks': [{
-            'boot': True,
-            'autoDelete': True,
-            'initializeParams': {
-                'sourceSnapshot': f'global/snapshots/{snapshot_name}',
-            }
-        }],
-        'networkInterfaces': [{
-            'network': 'global/networks/default',
-            'accessConfigs': [{
-                'type': 'ONE_TO_ONE_NAT',
-                'name': 'External NAT'
-            }]
-        }],
-        'tags': {
-            'items': ['allow-5000']
-        },
-        'metadata': {
-            'items': [{
-                'key': 'startup-script',
-                'value': STARTUP_SCRIPT
-            }]
-        }
-    }
+def snapshot_instance_config(zone, instance_name, snapshot_name):
+    """Returns the insert body for a clone booting from the given snapshot."""
+    return snapshot_spec(snapshot_name).body(instance_name, zone)
+
+def image_instance_config(zone, instance_name, image):
+    """Returns the insert body for a clone booting from the given image (name or family URL)."""
+    return image_spec(image).body(instance_name, zone)
 
+def create_instance_from_config(compute, project, zone, config, **insert_params):
+    """Inserts an instance, waits for it and returns the elapsed seconds."""
     start_time = time.time()
-    operation = compute.instances().insert(project=project, zone=zone, body=config).execute()
-    wait_for_operation(compute, project, zone, operation['name'])
+    with tracing.span('create_instance', instance=config['name']):
+        operation = compute.instances().insert(project=project, zone=zone, body=config, **insert_params).execute()
+        wait_for_operation(compute, project, zone, operation['name'])
     end_time = time.time()
 
     elapsed_time = end_time - start_time
-    print(f"Instance {instance_name} created in {elapsed_time:.2f} seconds")
+    print(f"Instance {config['name']} created in {elapsed_time:.2f} seconds")
     return elapsed_time
 
-def create_multiple_instances_from_snapshot(compute, project, zone, snapshot_name):
-    instance_times = []
-    for i in range(1, 4):
-        instance_name = f'flask-clone-{i}'
-        elapsed_time = create_instance_from_snapshot(compute, project, zone, instance_name, snapshot_name)
-        instance_times.append((instance_name, elapsed_time))
-    
-    with open('TIMING.md', 'w') as f:
+def create_instance_from_snapshot(compute, project, zone, instance_name, snapshot_name):
+    """Creates a new instance from the given snapshot."""
+    config = snapshot_instance_config(zone, instance_name, snapshot_name)
+    return create_instance_from_config(compute, project, zone, config)
+
+def create_instance_from_image(compute, project, zone, instance_name, image):
+    """Creates a new instance from the given image."""
+    config = image_instance_config(zone, instance_name, image)
+    return create_instance_from_config(compute, project, zone, config)
+
+def write_timing(instance_times, wall_time=None, path='TIMING.md'):
+    """Writes per-instance creation times (and the total wall-clock time) to TIMING.md."""
+    with open(path, 'w') as f:
         for instance_name, elapsed_time in instance_times:
             f.write(f"{instance_name}: {elapsed_time:.2f} seconds\n")
-    print("TIMING.md created and times recorded.")
+        if wall_time is not None:
+            f.write(f"total wall-clock: {wall_time:.2f} seconds\n")
+    print(f"{path} created and times recorded.")
+
+def clone_names(count, prefix='flask-clone'):
+    return [f'{prefix}-{i}' for i in range(1, count + 1)]
+
+def create_clones(compute, project, zone, config_for, names, **insert_params):
+    """Creates clones one after another; returns ({name: seconds}, wall-clock seconds)."""
+    elapsed = {}
+    wall_start = time.time()
+    for instance_name in names:
+        elapsed[instance_name] = create_instance_from_config(compute, project, zone, config_for(instance_name),
+                                                             **insert_params)
+    return elapsed, time.time() - wall_start
+
+def create_multiple_instances_from_snapshot(compute, project, zone, snapshot_name, count=3):
+    names = clone_names(count)
+    elapsed, wall_time = create_clones(
+        compute, project, zone, lambda name: snapshot_instance_config(zone, name, snapshot_name), names)
+    write_timing([(name, elapsed[name]) for name in names], wall_time)
+
+def create_fleet(compute_factory, project, zone, config_for, names, workers=16, **insert_params):
+    """Creates clones concurrently, tracking every pending operation at once.
+
+    Inserts go through a bounded thread pool. Each worker thread gets its own
+    client from compute_factory (get_compute is already per-thread) because
+    googleapiclient clients are not thread-safe; the main thread polls all
+    pending operations in one loop.
+    insert_params (e.g. sourceInstanceTemplate) are passed to every insert.
+    Returns ({name: seconds}, wall-clock seconds) for the clones that succeeded.
+    """
+    local = threading.local()
+
+    def client():
+        if not hasattr(local, 'compute'):
+            local.compute = compute_factory()
+        return local.compute
+
+    def submit(instance_name):
+        return client().instances().insert(project=project, zone=zone, body=config_for(instance_name),
+                                           **insert_params).execute()
+
+    started = {}
+    elapsed = {}
+    operations = {}  # operation name -> instance name
+
+    def record(result):
+        instance_name = operations[result['name']]
+        if 'error' not in result:
+            elapsed[instance_name] = time.time() - started[instance_name]
+            print(f"Instance {instance_name} created in {elapsed[instance_name]:.2f} seconds")
+
+    waiter = OperationWaiter(client(), project, zone, raise_on_error=False, on_done=record)
+    wall_start = time.time()
+    print(f"Creating {len(names)} clones with {workers} workers...")
+    with tracing.span('create_fleet', clones=len(names), workers=workers), \
+            ThreadPoolExecutor(max_workers=workers) as pool:
+        inserts = {}
+        for name in names:
+            started[name] = time.time()
+            inserts[pool.submit(submit, name)] = name
+        while inserts or waiter.pending:
+            for future in [f for f in inserts if f.done()]:
+                instance_name = inserts.pop(future)
+                try:
+                    operation = future.result()
+                except googleapiclient.errors.HttpError as e:
+                    print(f"Failed to insert {instance_name}: {e}")
+                    continue
+                operations[operation['name']] = instance_name
+                waiter.add(operation)
+            waiter.poll()
+            if inserts:
+                wait(inserts, timeout=waiter.next_delay() if waiter.pending else None,
+                     return_when=FIRST_COMPLETED)
+            elif waiter.pending:
+                time.sleep(waiter.next_delay())
+    wall_time = time.time() - wall_start
+
+    print(f"{len(elapsed)}/{len(names)} clones created in {wall_time:.2f} seconds wall-clock")
+    return elapsed, wall_time
+
+def create_fleet_from_snapshot(compute_factory, project, zone, snapshot_name, count, workers=16):
+    """Creates `count` snapshot clones concurrently and records their times in TIMING.md."""
+    names = clone_names(count)
+    elapsed, wall_time = create_fleet(
+        compute_factory, project, zone, lambda name: snapshot_instance_config(zone, name, snapshot_name),
+        names, workers)
+    write_timing([(name, elapsed[name]) for name in names if name in elapsed], wall_time)
+    return elapsed, wall_time
+
+def run_clones(compute_factory, project, zone, config_for, names, workers=0, **insert_params):
+    """Creates clones concurrently when workers > 0, otherwise one at a time."""
+    if workers:
+        return create_fleet(compute_factory, project, zone, config_for, names, workers, **insert_params)
+    return create_clones(compute_factory(), project, zone, config_for, names, **insert_params)
+
+def create_bulk(compute, project, zone, count, names=None, name_pattern=None, min_count=None, **source):
+    """Creates clones with a single bulkInsert operation and a single wait.
+
+    The clones are named either explicitly (`names`, sent as
+    perInstanceProperties) or by `name_pattern`. `source` is spec=... or
+    template=..., as for bulk_insert(). A clone's time runs from the request
+    to its lastStartTimestamp, so it reflects when that VM started rather
+    than when the whole operation finished.
+    Returns ({name: seconds}, wall-clock seconds) for the clones that exist.
+    """
+    wall_start = time.time()
+    existing = set()
+    if name_pattern:
+        existing = {instance['name'] for instance in list_all(compute.instances(), project=project, zone=zone)}
+
+    print(f"Creating {count} clones with one bulkInsert request...")
+    with tracing.span('create_bulk', clones=count):
+        operation = bulk_insert(compute, project, zone, count, name_pattern=name_pattern, min_count=min_count,
+                                per_instance={name: {} for name in names or []}, **source)
+        result = wait_for_operation(compute, project, zone, operation, raise_on_error=False)
+    wall_time = time.time() - wall_start
+
+    status = result.get('instancesBulkInsertOperationMetadata', {}).get('perLocationStatus', {})
+    for location, counts in status.items():
+        print(f"{location}: {counts.get('createdVmCount', 0)} created, "
+              f"{counts.get('failedToCreateVmCount', 0)} failed")
+    if name_pattern:
+        pattern = name_pattern_regex(name_pattern)
+        names = sorted(instance['name'] for instance in list_all(compute.instances(), project=project, zone=zone)
+                       if pattern.match(instance['name']) and instance['name'] not in existing)
+
+    elapsed = {}
+    for name, instance in get_instances(compute, project, zone, names).items():
+        if isinstance(instance, Exception):
+            print(f"Instance {name} was not created: {instance}")
+            continue
+        started = instance.get('lastStartTimestamp')
+        elapsed[name] = datetime.fromisoformat(started).timestamp() - wall_start if started else wall_time
+        print(f"Instance {name} created in {elapsed[name]:.2f} seconds")
+    print(f"{len(elapsed)}/{count} clones created in {wall_time:.2f} seconds wall-clock")
+    return elapsed, wall_time
+
+def create_placed(compute, project, zones, config_for, names, **insert_params):
+    """Spreads clones over several zones, retrying stocked-out zones elsewhere.
+
+    config_for(name, zone) builds each clone's insert body. The zones that
+    provisioned fastest in earlier runs are tried first.
+    Returns ({name: seconds}, wall-clock seconds) for the clones that succeeded.
+    """
+    wall_start = time.time()
+    print(f"Placing {len(names)} clones over {', '.join(zones)}...")
+    with tracing.span('create_placed', clones=len(names), zones=','.join(zones)):
+        placed, failed = PlacementScheduler(compute, project, zones).create(names, config_for, **insert_params)
+    wall_time = time.time() - wall_start
+
+    for name, error in failed.items():
+        print(f"Instance {name} was not created: {error}")
+    for zone in zones:
+        count = sum(1 for placed_zone, _ in placed.values() if placed_zone == zone)
+        print(f"{zone}: {count} clones")
+    print(f"{len(placed)}/{len(names)} clones created in {wall_time:.2f} seconds wall-clock")
+    return {name: seconds for name, (_, seconds) in placed.items()}, wall_time
+
+def fleet_resources(compute, project, zone, count, source='snapshot', family=IMAGE_FAMILY, template=False):
+    """Returns the part2 fleet as desired resources: the base snapshot and the clones.
+
+    Resolving the snapshot for the disk's current state costs a batched get
+    of the disk and instance plus a labelled snapshot list on every run, so
+    an unchanged 'part2.py reconcile' makes four round trips: these two and
+    reconcile()'s instance and snapshot lists.
+    """
+    resources = []
+    if source == 'snapshot':
+        # The snapshot for the disk's current state; unchanged if an earlier run already made it
+        snapshot = ArtifactCache(compute, project).snapshot_artifact(zone, INSTANCE_NAME, DISK_NAME, SNAPSHOT_PREFIX)
+        resources.append(snapshot_resource(zone, DISK_NAME, snapshot.name, description=SNAPSHOT_DESCRIPTION,
+                                           labels=snapshot.labels))
+        spec = snapshot_spec(snapshot.name)
+    else:
+        # Clones boot from the newest image already baked into the family
+        spec = image_spec(family_image(project, family))
+    names = clone_names(count)
+    if template:
+        template = ensure_instance_template(compute, project, spec)
+        return resources + [instance_resource(zone, {'name': name}, sourceInstanceTemplate=template)
+                            for name in names]
+    return resources + [instance_resource(zone, spec.body(name, zone)) for name in names]
+
+def reconcile_fleet(compute, project, zone, resources, state_path=STATE_DB, fleet='part2'):
+    """Creates only what the fleet is missing, deletes clones it no longer wants and records the new times."""
+    store = StateStore(state_path)
+    try:
+        with tracing.span('reconcile', fleet=fleet, resources=len(resources)):
+            result = reconcile(compute, project, store, fleet, resources)
+    finally:
+        store.close()
+    print(f"Reconciled {fleet}: {len(result['created'])} created, {len(result['deleted'])} deleted, "
+          f"{len(result['unchanged'])} unchanged, {result['resumed']} resumed, {len(result['failed'])} failed")
+    for name, error in result['failed'].items():
+        print(f"{name} failed: {error}")
+    clones = [(name, seconds) for name, seconds in result['created'].items() if name.startswith('flask-clone-')]
+    if clones:
+        write_timing(clones)
+    return result
+
+def provision_graph(compute_factory, project, zone, count, source='snapshot', family=IMAGE_FAMILY, workers=0,
+                    template=False, bulk=False, name_pattern=None, min_count=None, zones=None):
+    """Returns part2 as a graph of steps.
+
+    Listing the running instances does not hold anything up. The 'artifacts'
+    step looks up the snapshot and image for the disk's current state; the
+    'snapshot' and 'image' steps only create what it did not find, so a
+    repeat run skips them. The image (if any) starts as soon as the
+    snapshot's operation is DONE, the template as soon as its boot source
+    exists, and the clones once both are ready. 'prune' then deletes old
+    versions. The 'clones' step returns (names, {name: seconds}, wall-clock
+    seconds).
+    """
+    graph = Graph()
+
+    def list_step(compute, _):
+        names = [instance['name'] for instance in list_instances(compute, project, zone) or []]
+        print("Your running instances are:\n" + '\n'.join(names))
+        return names
+
+    def artifacts_step(compute, _):
+        cache = ArtifactCache(compute, project)
+        snapshot = cache.snapshot_artifact(zone, INSTANCE_NAME, DISK_NAME, SNAPSHOT_PREFIX)
+        return {'snapshot': snapshot,
+                'image': cache.image_artifact(snapshot, family) if source != 'snapshot' else None}
+
+    def snapshot_step(compute, results):
+        return ArtifactCache(compute, project).start_snapshot(results['artifacts']['snapshot'], zone, DISK_NAME,
+                                                              SNAPSHOT_DESCRIPTION)
+
+    def image_step(compute, results):
+        artifacts = results['artifacts']
+        return ArtifactCache(compute, project).start_image(artifacts['image'], artifacts['snapshot'].name, family)
+
+    def prune_step(compute, results):
+        cache = ArtifactCache(compute, project)
+        return [operation for artifact in results['artifacts'].values() if artifact
+                for operation in cache.prune(artifact)]
+
+    graph.add('list', list_step)
+    graph.add('artifacts', artifacts_step)
+    graph.add('snapshot', snapshot_step, deps=['artifacts'])
+    created = ['snapshot']
+    if source != 'snapshot':
+        graph.add('image', image_step, deps=['artifacts', 'snapshot'])
+        created.append('image')
+    graph.add('prune', prune_step, deps=['artifacts'] + created)
+    if source == 'compare':
+        graph.add('compare', lambda compute, results: compare_clone_sources(
+            compute_factory, project, zone, results['artifacts']['snapshot'].name,
+            results['artifacts']['image'].name, count, workers), deps=['artifacts'] + created)
+        return graph
+
+    boot_source = 'snapshot' if source == 'snapshot' else 'image'
+
+    def spec_for(results):
+        artifact = results['artifacts'][boot_source]
+        return snapshot_spec(artifact.name) if source == 'snapshot' else image_spec(artifact.name)
+
+    if template:
+        graph.add('template', lambda compute, results: ensure_instance_template(compute, project,
+                                                                                spec_for(results)),
+                  deps=['artifacts', boot_source])
+
+    def clones_step(compute, results):
+        names = clone_names(count)
+        spec = spec_for(results)
+        if bulk:
+            source = {'template': results['template']} if template else {'spec': spec}
+            elapsed, wall_time = create_bulk(compute, project, zone, count,
+                                             names=None if name_pattern else names,
+                                             name_pattern=name_pattern, min_count=min_count, **source)
+            return list(elapsed), elapsed, wall_time
+        if zones:
+            if template:
+                elapsed, wall_time = create_placed(compute, project, zones, lambda name, zone: {'name': name},
+                                                   names, sourceInstanceTemplate=results['template'])
+            else:
+                elapsed, wall_time = create_placed(compute, project, zones, spec.body, names)
+        elif template:
+            elapsed, wall_time = run_clones(compute_factory, project, zone, lambda name: {'name': name},
+                                            names, workers, sourceInstanceTemplate=results['template'])
+        else:
+            elapsed, wall_time = run_clones(compute_factory, project, zone, lambda name: spec.body(name, zone),
+                                            names, workers)
+        return names, elapsed, wall_time
+
+    graph.add('clones', clones_step, deps=['artifacts', boot_source] + (['template'] if template else []))
+    return graph
+
+def run_pool(compute_factory, project, zone, count, size, mode='suspend', wait_ready=True,
+             fill_timeout=FILL_TIMEOUT):
+    """Fills a warm pool of snapshot clones, hands out `count` of them and reports the latencies.
+
+    With wait_ready, members are parked only once their app answers HTTP, so
+    a resumed clone is serving straight away. If the pool does not fill
+    within fill_timeout seconds (refills keep failing on quota or stockouts),
+    it goes on without it. Returns the pool's metrics.
+    """
+    snapshot_name = create_snapshot(compute_factory(), project, zone, INSTANCE_NAME, DISK_NAME)
+    ready = None
+    if wait_ready:
+        ready = lambda compute, name: wait_until_serving(compute, project, zone, name)
+    pool = WarmPool(compute_factory, project, zone, lambda name: snapshot_instance_config(zone, name, snapshot_name),
+                    size, mode=mode, ready=ready).start()
+    try:
+        print(f"Filling warm pool to {size} {MODES[mode][1]} clones...")
+        if not pool.wait_full(fill_timeout):
+            print(f"Warm pool did not fill within {fill_timeout:g} seconds "
+                  f"({pool.metrics()['failures']} failed builds); acquires past it create clones from scratch")
+        for _ in range(count):
+            pool.acquire()
+        # Let the refill catch up so its lag is part of the report
+        if not pool.wait_full(fill_timeout):
+            print(f"Warm pool did not refill within {fill_timeout:g} seconds")
+    finally:
+        pool.close()
+    print('\n'.join(pool.report()))
+    return pool.metrics()
+
+def autoscale_clones(compute_factory, project, zone, policy, interval=autoscale.INTERVAL, duration=None,
+                     trace=None, fake=None):
+    """Runs the autoscaler over the flask-clone-N fleet, creating clones from the base snapshot.
+
+    With `trace` (and the fake API in `fake`), load is simulated from the
+    trace instead of probing the clones. Returns the Autoscaler, whose
+    decisions and report() say what it did.
+    """
+    snapshot_name = create_snapshot(compute_factory(), project, zone, INSTANCE_NAME, DISK_NAME)
+
+    def delete(compute, name):
+        operation = compute.instances().delete(project=project, zone=zone, instance=name).execute()
+        wait_for_operation(compute, project, zone, operation, log=lambda *_: None)
+
+    if trace:
+        sampler = autoscale.SimulatedSampler(fake, project, zone, 'flask-clone', trace)
+    else:
+        sampler = autoscale.HttpSampler(compute_factory(), project, zone, 'flask-clone')
+    scaler = autoscale.Autoscaler(
+        policy, sampler,
+        lambda compute, name: create_instance_from_snapshot(compute, project, zone, name, snapshot_name),
+        delete, compute_factory, 'flask-clone')
+    print(f"Autoscaling flask-clone-N between {policy.min_size} and {policy.max_size} clones, "
+          f"sampling every {interval:g}s...")
+    try:
+        scaler.run(interval, duration)
+    except KeyboardInterrupt:
+        pass
+    print('\n'.join(scaler.report()))
+    return scaler
+
+def teardown(compute, project, patterns=None, labels=DEFAULT_LABELS, ttl=TTL, orphans_only=False, dry_run=False):
+    """Deletes what the scripts created, or only the orphans older than `ttl` seconds, and reports it.
+
+    With dry_run, only lists what would be deleted. Returns the Teardown.
+    """
+    cleaner = Teardown(compute, project, patterns, labels)
+    found = cleaner.find()
+    targets = cleaner.orphans(ttl) if orphans_only else found
+    print(f"Found {len(found)} resources; {'would delete' if dry_run else 'deleting'} {len(targets)}")
+    if dry_run:
+        for leftover in targets:
+            print(f"{leftover.kind[:-1]} {leftover.scope}/{leftover.name}")
+    elif targets:
+        start = time.time()
+        cleaner.delete(targets)
+        print(f"Teardown finished in {time.time() - start:.2f} seconds")
+    print('\n'.join(cleaner.report(ttl)))
+    return cleaner
+
+def compare_clone_sources(compute_factory, project, zone, snapshot_name, image, count, workers=0,
+                          path='TIMING.md'):
+    """Creates `count` clones from the snapshot, then `count` from the image, and writes both to TIMING.md."""
+    arms = [
+        ('snapshot', snapshot_name, lambda name: snapshot_instance_config(zone, name, snapshot_name)),
+        ('image', image, lambda name: image_instance_config(zone, name, image)),
+    ]
+    results = []
+    for source, source_name, config_for in arms:
+        print(f"Benchmarking clones from {source} {source_name}...")
+        names = clone_names(count, prefix=f'flask-clone-{source}')
+        elapsed, wall_time = run_clones(compute_factory, project, zone, config_for, names, workers)
+        results.append((source, source_name, names, elapsed, wall_time))
+
+    with open(path, 'w') as f:
+        for source, source_name, names, elapsed, wall_time in results:
+            f.write(f"## {source}: {source_name} ({zone})\n\n")
+            for name in names:
+                if name in elapsed:
+                    f.write(f"{name}: {elapsed[name]:.2f} seconds\n")
+            f.write(f"total wall-clock: {wall_time:.2f} seconds\n\n")
+        f.write("| zone | source | clones | mean (s) | max (s) | wall-clock (s) |\n")
+        f.write("|------|--------|--------|----------|---------|----------------|\n")
+        for source, _, names, elapsed, wall_time in results:
+            times = list(elapsed.values())
+            mean = sum(times) / len(times) if times else float('nan')
+            worst = max(times) if times else float('nan')
+            f.write(f"| {zone} | {source} | {len(times)}/{len(names)} | {mean:.2f} | {worst:.2f} | {wall_time:.2f} |\n")
+    print(f"{path} created with the snapshot vs image comparison.")
+    return results
 
 def main():
+    parser = argparse.ArgumentParser(description='Snapshot the part1 instance and create clones from it.')
+    parser.add_argument('command', nargs='?', choices=['create', 'reconcile', 'pool', 'autoscale', 'teardown'],
+                        default='create',
+                        help='create: snapshot and clone from scratch; reconcile: only create what is missing, '
+                             'delete clones beyond --count and resume operations left by a crashed run; '
+                             'pool: hand out --count clones from a warm pool of parked clones; '
+                             'autoscale: size the clone fleet to its request latency; '
+                             'teardown: delete everything the scripts created')
+    parser.add_argument('--count', type=int, default=3, help='number of clones to create')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='create clones concurrently with this many workers (0 = one at a time)')
+    parser.add_argument('--source', choices=['snapshot', 'image', 'compare'], default='snapshot',
+                        help='clone from the snapshot, from an image converted from it, or benchmark both')
+    parser.add_argument('--family', default=IMAGE_FAMILY, help='image family for the converted image')
+    parser.add_argument('--template', action='store_true',
+                        help='create an instance template once and send only a template reference per clone')
+    parser.add_argument('--bulk', action='store_true',
+                        help='create all clones with one instances().bulkInsert operation')
+    parser.add_argument('--name-pattern',
+                        help="with --bulk, name clones by pattern (e.g. flask-clone-####) instead of flask-clone-N")
+    parser.add_argument('--min-count', type=int,
+                        help='with --bulk, accept a partial launch of at least this many clones')
+    parser.add_argument('--zones',
+                        help='comma-separated zones to spread clones over, falling back to the next zone on stockouts')
+    parser.add_argument('--pool-size', type=int, default=2, help='with pool, parked clones to keep ready')
+    parser.add_argument('--pool-mode', choices=list(MODES), default='suspend',
+                        help='with pool, park clones suspended (resume keeps the app running) or stopped')
+    parser.add_argument('--pool-timeout', type=float, default=FILL_TIMEOUT,
+                        help='with pool, seconds to wait for the pool to fill before going on without it')
+    parser.add_argument('--min-size', type=int, default=autoscale.Policy.min_size,
+                        help='with autoscale, fewest clones')
+    parser.add_argument('--max-size', type=int, default=autoscale.Policy.max_size,
+                        help='with autoscale, most clones')
+    parser.add_argument('--scale-out-above', type=float, default=autoscale.Policy.scale_out_above,
+                        help='with autoscale, add clones while mean request latency stays above this many seconds')
+    parser.add_argument('--scale-in-below', type=float, default=autoscale.Policy.scale_in_below,
+                        help='with autoscale, remove clones while mean request latency stays below this')
+    parser.add_argument('--out-cooldown', type=float, default=autoscale.Policy.out_cooldown,
+                        help='with autoscale, seconds between scale-outs')
+    parser.add_argument('--in-cooldown', type=float, default=autoscale.Policy.in_cooldown,
+                        help='with autoscale, seconds after any change before a scale-in')
+    parser.add_argument('--interval', type=float, default=autoscale.INTERVAL,
+                        help='with autoscale, seconds between samples')
+    parser.add_argument('--duration', type=float, help='with autoscale, stop after this many seconds')
+    parser.add_argument('--load-trace',
+                        help="with autoscale and --fake, simulated load as 'seconds:rps,...', e.g. 0:50,30:400,90:50")
+    parser.add_argument('--match', action='append',
+                        help='with teardown, delete resources whose name fully matches this regex instead of the '
+                             'scripts\' names (repeatable)')
+    parser.add_argument('--label', action='append',
+                        help=f"with teardown, also delete resources with this label, as key or key=value "
+                             f"(repeatable; default: {', '.join(DEFAULT_LABELS)})")
+    parser.add_argument('--ttl', type=float, default=TTL / 3600,
+                        help='with teardown, hours after which a leftover resource is reported as an orphan')
+    parser.add_argument('--orphans-only', action='store_true',
+                        help='with teardown, delete only the orphans older than --ttl')
+    parser.add_argument('--dry-run', action='store_true', help='with teardown, only list what would be deleted')
+    parser.add_argument('--state', default=STATE_DB, help='SQLite file recording the fleet for reconcile')
+    parser.add_argument('--fake', action='store_true', help='run against the local fake Compute API')
+    tracing.add_arguments(parser)
+    ratelimit.add_arguments(parser)
+    args = parser.parse_args()
+    tracing.configure(args)
+    ratelimit.configure(args)
+
     # Validate project ID
     if not project:
         raise ValueError("Project ID is not set. Please provide a valid Google Cloud project ID.")
 
-    # List running instances
-    print("Your running instances are:")
-    for instance in list_instances(service, project, ZONE):
-        print(instance['name'])
-    
-    # Create a snapshot from the existing instance
-    create_snapshot(service, project, ZONE, INSTANCE_NAME, DISK_NAME)
+    if args.fake:
+        from common.fake_compute import FakeCompute
+        fake = FakeCompute(latency=2.0, jitter=1.0)
+        fake.add_instance(project, ZONE, INSTANCE_NAME)
+        compute_factory = lambda: fake
+    else:
+        compute_factory = get_compute
+    service = compute_factory()
+
+    if args.command == 'reconcile':
+        if args.source == 'compare':
+            parser.error('reconcile clones from a snapshot or an image, not both')
+        resources = fleet_resources(service, project, ZONE, args.count, args.source, args.family, args.template)
+        reconcile_fleet(service, project, ZONE, resources, args.state)
+        print(ratelimit.limiter().report())
+        if not args.fake:
+            print(cold_start_report())
+        return
+
+    if args.command == 'autoscale':
+        if args.load_trace and not args.fake:
+            parser.error('--load-trace simulates load against the fake API; add --fake')
+        policy = autoscale.Policy(min_size=args.min_size, max_size=args.max_size,
+                                  scale_out_above=args.scale_out_above, scale_in_below=args.scale_in_below,
+                                  out_cooldown=args.out_cooldown, in_cooldown=args.in_cooldown)
+        autoscale_clones(compute_factory, project, ZONE, policy, args.interval, args.duration, args.load_trace,
+                         fake if args.fake else None)
+        print(ratelimit.limiter().report())
+        if not args.fake:
+            print(cold_start_report())
+        return
+
+    if args.command == 'teardown':
+        patterns = None
+        if args.match:
+            pattern = '|'.join(f'(?:{match})' for match in args.match)
+            patterns = {kind: pattern for kind in DEFAULT_PATTERNS}
+        teardown(service, project, patterns, args.label or (() if args.match else DEFAULT_LABELS),
+                 args.ttl * 3600, args.orphans_only, args.dry_run)
+        print(ratelimit.limiter().report())
+        return
+
+    if args.command == 'pool':
+        run_pool(compute_factory, project, ZONE, args.count, args.pool_size, args.pool_mode,
+                 wait_ready=not args.fake, fill_timeout=args.pool_timeout)
+        print(ratelimit.limiter().report())
+        if not args.fake:
+            print(cold_start_report())
+        return
+
+    # Snapshot the part1 instance and create the clones, each step as soon as what it needs is ready
+    graph = provision_graph(compute_factory, project, ZONE, args.count, args.source, args.family, args.workers,
+                            template=args.template, bulk=args.bulk, name_pattern=args.name_pattern,
+                            min_count=args.min_count, zones=args.zones.split(',') if args.zones else None)
+    results = graph.run(compute_factory, project)
+    if 'clones' in results:
+        names, elapsed, wall_time = results['clones']
+        write_timing([(name, elapsed[name]) for name in names if name in elapsed], wall_time)
+    print('\n'.join(graph.report()))
 
-    # Create three instances from the snapshot and measure time
-    create_multiple_instances_from_snapshot(service, project, ZONE, f'base-snapshot-{INSTANCE_NAME}')
+    print(ratelimit.limiter().report())
+    if not args.fake:
+        print(cold_start_report())
 
 if __name__ == '__main__':
     main()
@@ -1,103 +1,44 @@
 #!/usr/bin/env python3
 
-import googleapiclient.discovery
-import google.auth
-import google.oauth2.service_account as service_account
-import time
+import argparse
+import glob
+import os
+import sys
 
-# Use Google Service Account credentials for authentication
-credentials = service_account.Credentials.from_service_account_file('/home/sudi2972/lab5new-programmable-cloud-Subashree1503/part3/service-credentials.json')
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+from common import ratelimit, tracing
+from common.client import cold_start_report, get_compute
+from common.fanout import FanoutSpec, format_tree, launcher_body, launcher_files, wait_for_reports
+from common.operations import wait_for_operation
+from common.spec import InstanceSpec
+
+# Google Service Account credentials, loaded on first use by get_compute()
+CREDENTIALS_FILE = '/home/sudi2972/lab5new-programmable-cloud-Subashree1503/part3/service-credentials.json'
 project = 'directed-galaxy-437903-g9'
 zone = 'us-west1-b'
-
-# Create a Compute Engine client
-service = googleapiclient.discovery.build('compute', 'v1', credentials=credentials)
-
-def wait_for_operation(compute, project, zone, operation):
-    print('Waiting for operation to finish...')
-    while True:
-        result = compute.zoneOperations().get(project=project, zone=zone, operation=operation).execute()
-        if result['status'] == 'DONE':
-            print("Operation finished.")
-            return result
-        time.sleep(5)
+VM1_SPEC = InstanceSpec(source_image='projects/debian-cloud/global/images/family/debian-11')
 
 # Function to create VM-1 that will create VM-2
-def create_vm1(compute, project, zone, instance_name):
+def create_vm1(compute, project, zone, instance_name, vm2_image=False, vm2_count=1, fanout=None,
+               wheelhouse=None, vm1_image=None, vm2_zones=None):
     # This startup script will run on VM-1 and will create VM-2
-    vm1_startup_script = """#!/bin/bash
-    mkdir -p /srv
-    cd /srv
-    curl http://metadata.google.internal/computeMetadata/v1/instance/attributes/vm2-startup-script -H "Metadata-Flavor: Google" > vm2-startup-script.sh
-    curl http://metadata.google.internal/computeMetadata/v1/instance/attributes/service-credentials -H "Metadata-Flavor: Google" > service-credentials.json
-    curl http://metadata.google.internal/computeMetadata/v1/instance/attributes/vm1-launch-vm2-code -H "Metadata-Flavor: Google" > vm1-launch-vm2-code.py
-
-    # Install necessary libraries
-    sudo apt-get update
-    sudo apt-get install -y python3 python3-pip
-    pip3 install --upgrade google-api-python-client google-auth-httplib2 google-auth-oauthlib
+    if fanout:
+        launch_args = fanout.args()
+    else:
+        launch_args = '--image' if vm2_image else ''
+        if vm2_count > 1:
+            launch_args += f' --count {vm2_count}'
+        if vm2_zones:
+            launch_args += f' --zones {vm2_zones}'
 
-    # Run the Python script to launch VM-2
-    python3 ./vm1-launch-vm2-code.py
-    """
-
-
-    # Create VM-1 configuration
-    vm1_config = {
-        'name': instance_name,
-        'machineType': f'zones/{zone}/machineTypes/f1-micro',
-        'disks': [{
-            'boot': True,
-            'autoDelete': True,
-            'initializeParams': {
-                'sourceImage': 'projects/debian-cloud/global/images/family/debian-11',
-            }
-        }],
-        'networkInterfaces': [{
-            'network': 'global/networks/default',
-            'accessConfigs': [{
-                'type': 'ONE_TO_ONE_NAT',
-                'name': 'External NAT'
-            }]
-        }],
-        'metadata': {
-            'items': [
-                {
-                    'key': 'startup-script',
-                    'value': vm1_startup_script
-                },
-                {
-                    'key': 'vm2-startup-script',
-                    'value': """#!/bin/bash
-                        sudo apt-get update
-                        sudo apt-get install -y python3 python3-pip git
-                        git clone https://github.com/cu-csci-4253-datacenter/flask-tutorial
-                        cd flask-tutorial
-                        sudo python3 setup.py install
-                        sudo pip3 install -e .
-                        
-                        # Set up the Flask app
-                        export FLASK_APP=flaskr
-                        flask init-db
-                        
-                        # Start Flask app on port 5000
-                        nohup flask run -h 0.0.0.0 -p 5000 &
-                    """
-                },
-                {
-                    'key': 'service-credentials',
-                    'value': open('/home/sudi2972/lab5new-programmable-cloud-Subashree1503/part3/service-credentials.json').read()
-                },
-                {
-                    'key': 'vm1-launch-vm2-code',
-                    'value': open('/home/sudi2972/lab5new-programmable-cloud-Subashree1503/part3/vm1-launch-vm2-code.py').read()
-                }
-            ]
-        },
-        'tags': {
-            'items': ['allow-5000']
-        }
-    }
+    # Everything VM-1 needs travels as one checksummed bundle; the bootstrap
+    # only installs the client libraries if neither the image nor the
+    # bundle's wheelhouse provides them
+    files = launcher_files(os.path.join(HERE, '..'), CREDENTIALS_FILE)
+    wheels = sorted(glob.glob(os.path.join(wheelhouse, '*.whl'))) if wheelhouse else ()
+    spec = VM1_SPEC.replace(source_image=vm1_image) if vm1_image else VM1_SPEC
+    vm1_config = launcher_body(spec, instance_name, zone, files, launch_args, wheels)
 
     print(f"Creating VM-1 instance: {instance_name}")
     operation = compute.instances().insert(project=project, zone=zone, body=vm1_config).execute()
@@ -105,4 +46,35 @@ def create_vm1(compute, project, zone, instance_name):
     wait_for_operation(compute, project, zone, operation['name'])
 
 if __name__ == '__main__':
-    create_vm1(service, project, zone, 'vm1-instance')
+    parser = argparse.ArgumentParser(description='Create VM-1, which then creates VM-2.')
+    parser.add_argument('--image', action='store_true',
+                        help='have VM-1 boot VM-2 from the newest baked golden image')
+    parser.add_argument('--vm2-count', type=int, default=1,
+                        help='have VM-1 create this many VM-2s with a single bulkInsert')
+    parser.add_argument('--vm2-zones',
+                        help='have VM-1 spread the VM-2s over these comma-separated zones, skipping stocked-out ones')
+    parser.add_argument('--children', type=int,
+                        help='fan out: VM-1 creates this many children concurrently')
+    parser.add_argument('--prefix', default='vm2', help='fan out: children are named PREFIX-1 .. PREFIX-N')
+    parser.add_argument('--depth', type=int, default=1,
+                        help='fan out: levels below VM-1; above 1 every child is a launcher too')
+    parser.add_argument('--collect', action='store_true',
+                        help="wait for VM-1's launch tree report and print it with latencies")
+    parser.add_argument('--wheelhouse',
+                        help='directory of wheels to vendor into the bundle so VM-1 installs nothing')
+    parser.add_argument('--vm1-image',
+                        help='boot VM-1 from an image that already has the client libraries installed')
+    tracing.add_arguments(parser)
+    ratelimit.add_arguments(parser)
+    args = parser.parse_args()
+    tracing.configure(args)
+    ratelimit.configure(args)
+
+    service = get_compute(CREDENTIALS_FILE)
+    fanout = FanoutSpec(args.children, args.prefix, args.depth, args.image) if args.children else None
+    create_vm1(service, project, zone, 'vm1-instance', vm2_image=args.image, vm2_count=args.vm2_count,
+               fanout=fanout, wheelhouse=args.wheelhouse, vm1_image=args.vm1_image, vm2_zones=args.vm2_zones)
+    if fanout and args.collect:
+        report = wait_for_reports(service, project, zone, ['vm1-instance'])['vm1-instance']
+        print('\n'.join(format_tree(report, 'vm1-instance')))
+    print(cold_start_report())
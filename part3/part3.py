@@ -2,92 +2,49 @@
 
 import argparse
 import os
-import time
+import sys
 from pprint import pprint
 
-import googleapiclient.discovery
-import google.auth
-import google.oauth2.service_account as service_account
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import ratelimit, tracing
+from common.client import cold_start_report, get_compute
+from common.dag import Graph
+from common.fleet import list_all
+from common.images import family_image
+from common.spec import InstanceSpec
+from common.startup import BOOT_METADATA, SERVE_SCRIPT, STARTUP_SCRIPT
 
-# Use Google Service Account credentials
-credentials = service_account.Credentials.from_service_account_file(filename='lab5new-programmable-cloud-Subashree1503/part3/service-credentials.json')
+# Google Service Account credentials, loaded on first use by get_compute()
+CREDENTIALS_FILE = 'lab5new-programmable-cloud-Subashree1503/part3/service-credentials.json'
 project = 'directed-galaxy-437903-g9'
-service = googleapiclient.discovery.build('compute', 'v1', credentials=credentials)
+SOURCE_IMAGE = 'projects/debian-cloud/global/images/family/debian-11'  # Updated to Debian 11
+SPEC = InstanceSpec(source_image=SOURCE_IMAGE, metadata=dict(BOOT_METADATA))
 
-# Function to wait for operation completion
-def wait_for_operation(compute, project, zone, operation):
-    print('Waiting for operation to finish...')
-    while True:
-        result = compute.zoneOperations().get(project=project, zone=zone, operation=operation).execute()
-        if result['status'] == 'DONE':
-            print("Operation finished.")
-            return result
-        time.sleep(5)
+# Function to create a new VM (VM-2); returns the insert operation, which the graph waits for
+def create_vm(compute, project, zone, instance_name, source_image=SOURCE_IMAGE, startup_script=STARTUP_SCRIPT):
+    """Starts creating a new VM instance with Flask app setup"""
+    config = SPEC.body(instance_name, zone, source_image=source_image, startup_script=startup_script)
 
-# Function to create a new VM (VM-2)
-def create_vm(compute, project, zone, instance_name):
-    """Creates a new VM instance with Flask app setup"""
-    
-    # This is the startup script that installs Flask and runs a simple app
-    startup_script = """#!/bin/bash
-    sudo apt-get update
-    sudo apt-get install -y python3 python3-pip git
-    git clone https://github.com/cu-csci-4253-datacenter/flask-tutorial
-    cd flask-tutorial
-    sudo python3 setup.py install
-    sudo pip3 install -e .
-    
-    # Set up the Flask app
-    export FLASK_APP=flaskr
-    flask init-db
-    
-    # Start Flask app on port 5000
-    nohup flask run -h 0.0.0.0 -p 5000 &
-    """
-
-
-    config = {
-        'name': instance_name,
-        'machineType': f'zones/{zone}/machineTypes/f1-micro',
-        'disks': [{
-            'boot': True,
-            'autoDelete': True,
-            'initializeParams': {
-                'sourceImage': 'projects/debian-cloud/global/images/family/debian-11',  # Updated to Debian 11
-            }
-        }],
-        'networkInterfaces': [{
-            'network': 'global/networks/default',
-            'accessConfigs': [{
-                'type': 'ONE_TO_ONE_NAT',
-                'name': 'External NAT'
-            }]
-        }],
-        'metadata': {
-            'items': [{
-                'key': 'startup-script',
-                'value': startup_script
-            }]
-        },
-        'tags': {
-            'items': ['allow-5000']  # Allows Flask app to be accessible on port 5000
-        }
-    }
-
-    # Start creating the instance
     print(f"Creating VM instance {instance_name}...")
-    operation = compute.instances().insert(project=project, zone=zone, body=config).execute()
+    with tracing.span('create_vm', instance=instance_name):
+        return compute.instances().insert(project=project, zone=zone, body=config).execute()
 
-    # Wait for the operation to complete
-    wait_for_operation(compute, project, zone, operation['name'])
+# Function to describe part3 as a graph: listing the existing instances and
+# creating VM-2 do not depend on each other, so they run concurrently
+def provision_graph(project, zone, instance_name, source_image=SOURCE_IMAGE, startup_script=STARTUP_SCRIPT):
+    graph = Graph()
+    graph.add('list', lambda compute, _: list_instances(compute, project, zone))
+    graph.add('create_vm', lambda compute, _: create_vm(compute, project, zone, instance_name,
+                                                        source_image, startup_script))
+    return graph
 
 # Function to list running instances with error handling and debugging
 def list_instances(compute, project, zone):
     try:
-        result = compute.instances().list(project=project, zone=zone).execute()
-        pprint(result)  # Debugging: print the raw response to inspect it
-        if 'items' in result:
-            return result['items']
+        items = list_all(compute.instances(), project=project, zone=zone)
+        pprint(items)  # Debugging: print the raw response to inspect it
+        if items:
+            return items
         else:
             print("No instances found in this zone.")
             return None
@@ -97,15 +54,25 @@ def list_instances(compute, project, zone):
 
 # Main script execution
 if __name__ == '__main__':
-    # List existing instances
-    print("Your running instances are:")
-    instances = list_instances(service, project, 'us-west1-b')
+    parser = argparse.ArgumentParser(description='Create VM-2 running the flask tutorial app.')
+    parser.add_argument('--image', action='store_true',
+                        help='boot from the newest baked golden image and only start the app')
+    tracing.add_arguments(parser)
+    ratelimit.add_arguments(parser)
+    args = parser.parse_args()
+    tracing.configure(args)
+    ratelimit.configure(args)
+
+    # List existing instances while VM-2 is being created
+    source = {'source_image': family_image(project), 'startup_script': SERVE_SCRIPT} if args.image else {}
+    graph = provision_graph(project, 'us-west1-b', 'vm2-flask-instance', **source)
+    instances = graph.run(lambda: get_compute(CREDENTIALS_FILE), project)['list']
+    # The list ran alongside the insert, so it may or may not include VM-2
+    print("Your instances (listed while vm2-flask-instance was being created) are:")
     if instances:  # Only iterate if instances are found
         for instance in instances:
             print(instance['name'])
     else:
         print("No instances to display.")
-    
-    # Create a new VM-2
-    create_vm(service, project, 'us-west1-b', 'vm2-flask-instance')
-
+    print('\n'.join(graph.report()))
+    print(cold_start_report())
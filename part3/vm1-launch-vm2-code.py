@@ -1,11 +1,23 @@
 #!/usr/bin/env python3
 
-import googleapiclient.discovery
-import google.auth
-import google.oauth2.service_account as service_account
-import time
+import argparse
+import os
+import sys
 import logging
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import ratelimit, tracing
+from common.client import cold_start_report, get_compute
+from common.fanout import FanoutSpec, format_tree, launch, launcher_body, launcher_files, node_name, publish_report
+from common.images import family_image
+from common.operations import wait_for_operation
+from common.placement import PlacementScheduler
+from common.spec import InstanceSpec, bulk_insert, name_pattern_for
+from common.startup import BOOT_METADATA, SERVE_SCRIPT, STARTUP_SCRIPT
+
+SOURCE_IMAGE = 'projects/debian-cloud/global/images/family/debian-11'
+SPEC = InstanceSpec(source_image=SOURCE_IMAGE, metadata=dict(BOOT_METADATA))
+
 # Set up logging
 logging.basicConfig(filename='/srv/vm1-launch-vm2.log', 
                     level=logging.DEBUG, 
@@ -13,100 +25,126 @@ logging.basicConfig(filename='/srv/vm1-launch-vm2.log',
 
 logging.info("Starting vm1-launch-vm2-code.py")
 
-# Path to the credentials file downloaded by the startup script
+# Path to the credentials file unpacked by the bootstrap, next to this script's bundle
+BUNDLE_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
 credentials_path = '/srv/service-credentials.json'
 
-# Authenticate using the service credentials
-try:
-    credentials = service_account.Credentials.from_service_account_file(credentials_path)
-    project = 'directed-galaxy-437903-g9'
-    zone = 'us-west1-b'
-    logging.info("Authenticated using service credentials.")
-except Exception as e:
-    logging.error(f"Failed to authenticate with service credentials: {e}")
-    raise
-
-# Create Compute Engine client
-try:
-    service = googleapiclient.discovery.build('compute', 'v1', credentials=credentials)
-    logging.info("Successfully built Compute Engine client.")
-except Exception as e:
-    logging.error(f"Failed to build Compute Engine client: {e}")
-    raise
-
-def wait_for_operation(compute, project, zone, operation):
-    logging.info(f"Waiting for operation {operation} to finish...")
-    while True:
-        try:
-            result = compute.zoneOperations().get(project=project, zone=zone, operation=operation).execute()
-            if result['status'] == 'DONE':
-                logging.info(f"Operation {operation} finished.")
-                return result
-        except Exception as e:
-            logging.error(f"Error while waiting for operation: {e}")
-        time.sleep(5)
+project = 'directed-galaxy-437903-g9'
+zone = 'us-west1-b'
 
-# Function to create VM-2 which will host the Flask app
-def create_vm2(compute, project, zone, instance_name):
-    # VM-2 startup script (to run the Flask app)
-    vm2_startup_script = """#!/bin/bash
-    sudo apt-get update
-    sudo apt-get install -y python3 python3-pip git
-    git clone https://github.com/cu-csci-4253-datacenter/flask-tutorial
-    cd flask-tutorial
-    sudo python3 setup.py install
-    sudo pip3 install -e .
-    
-    # Set up the Flask app
-    export FLASK_APP=flaskr
-    flask init-db
-    
-    # Start Flask app on port 5000
-    nohup flask run -h 0.0.0.0 -p 5000 &
-    """
+def seconds_since_boot():
+    with open('/proc/uptime') as f:
+        return float(f.read().split()[0])
 
+# Function to create VM-2 which will host the Flask app
+def create_vm2(compute, project, zone, instance_name, source_image=SOURCE_IMAGE, startup_script=STARTUP_SCRIPT):
     # Configuration for VM-2
-    vm2_config = {
-        'name': instance_name,
-        'machineType': f'zones/{zone}/machineTypes/f1-micro',
-        'disks': [{
-            'boot': True,
-            'autoDelete': True,
-            'initializeParams': {
-                'sourceImage': 'projects/debian-cloud/global/images/family/debian-11',
-            }
-        }],
-        'networkInterfaces': [{
-            'network': 'global/networks/default',
-            'accessConfigs': [{
-                'type': 'ONE_TO_ONE_NAT',
-                'name': 'External NAT'
-            }]
-        }],
-        'metadata': {
-            'items': [{
-                'key': 'startup-script',
-                'value': vm2_startup_script
-            }]
-        },
-        'tags': {
-            'items': ['allow-5000']
-        }
-    }
+    vm2_config = SPEC.body(instance_name, zone, source_image=source_image, startup_script=startup_script)
 
     try:
         logging.info(f"Creating VM-2 instance: {instance_name}")
-        operation = compute.instances().insert(project=project, zone=zone, body=vm2_config).execute()
-        logging.info(f"VM-2 instance creation initiated.")
-        wait_for_operation(compute, project, zone, operation['name'])
+        with tracing.span('create_vm2', instance=instance_name):
+            operation = compute.instances().insert(project=project, zone=zone, body=vm2_config).execute()
+            logging.info(f"VM-2 instance creation initiated.")
+            wait_for_operation(compute, project, zone, operation['name'], log=logging.info)
     except Exception as e:
         logging.error(f"Failed to create VM-2 instance: {e}")
         raise
 
+# Function to create several VM-2s with one bulkInsert operation instead of one insert each
+def create_vm2s(compute, project, zone, count, name_pattern=None, source_image=SOURCE_IMAGE,
+                startup_script=STARTUP_SCRIPT):
+    spec = SPEC.replace(source_image=source_image, startup_script=startup_script)
+    name_pattern = name_pattern or name_pattern_for('vm2-instance', count)
+
+    try:
+        logging.info(f"Creating {count} VM-2 instances named {name_pattern}")
+        with tracing.span('create_vm2s', count=count):
+            operation = bulk_insert(compute, project, zone, count, spec=spec, name_pattern=name_pattern)
+            logging.info("VM-2 bulk creation initiated.")
+            wait_for_operation(compute, project, zone, operation, log=logging.info)
+    except Exception as e:
+        logging.error(f"Failed to create VM-2 instances: {e}")
+        raise
+
+# Function to spread VM-2s over several zones, moving them to the next-best
+# zone when one is stocked out or out of quota
+def place_vm2s(compute, project, zones, count, source_image=SOURCE_IMAGE, startup_script=STARTUP_SCRIPT):
+    spec = SPEC.replace(source_image=source_image, startup_script=startup_script)
+    names = ['vm2-instance'] if count == 1 else [f'vm2-instance-{i}' for i in range(1, count + 1)]
+
+    logging.info(f"Placing {count} VM-2 instances over {', '.join(zones)}")
+    with tracing.span('place_vm2s', count=count, zones=','.join(zones)):
+        placed, failed = PlacementScheduler(compute, project, zones, log=logging.info).create(names, spec.body)
+    for name, error in failed.items():
+        logging.error(f"Failed to create VM-2 instance {name}: {error}")
+    if not placed:
+        raise RuntimeError(f"No VM-2 instance could be placed in {', '.join(zones)}")
+
+# Function to create a level of children (VM-2s, or launchers when depth > 1)
+# concurrently and report the subtree's timings to this node's parent
+def fan_out(compute, project, zone, fanout, source_image=SOURCE_IMAGE, startup_script=STARTUP_SCRIPT):
+    uptime = seconds_since_boot()
+    files = launcher_files(BUNDLE_ROOT, credentials_path)
+    try:
+        with tracing.span('fan_out', children=fanout.children, depth=fanout.depth):
+            report = launch(
+                compute, project, zone, fanout,
+                leaf_body=lambda name: SPEC.body(name, zone, source_image=source_image,
+                                                 startup_script=startup_script),
+                launcher_body_for=lambda name, child: launcher_body(SPEC, name, zone, files, child.args(),
+                                                                    log=logging.info),
+                log=logging.info)
+    except Exception as e:
+        logging.error(f"Fan-out failed: {e}")
+        publish_report({'error': str(e), 'uptime': uptime})
+        raise
+    report['uptime'] = uptime
+    publish_report(report)
+    for line in format_tree(report, node_name()):
+        logging.info(line)
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create VM-2 from VM-1.')
+    parser.add_argument('--image', action='store_true',
+                        help='boot VM-2 from the newest baked golden image and only start the app')
+    parser.add_argument('--count', type=int, default=1,
+                        help='number of VM-2s; more than one are created with a single bulkInsert')
+    parser.add_argument('--zones',
+                        help='comma-separated zones to spread VM-2s over, falling back to the next zone on stockouts')
+    parser.add_argument('--children', type=int,
+                        help='fan out: create this many children concurrently and report back to the parent')
+    parser.add_argument('--prefix', default='vm2', help='fan out: children are named PREFIX-1 .. PREFIX-N')
+    parser.add_argument('--depth', type=int, default=1,
+                        help='fan out: levels below this VM; above 1 the children are launchers too')
+    tracing.add_arguments(parser)
+    ratelimit.add_arguments(parser)
+    args = parser.parse_args()
+    tracing.configure(args)
+    ratelimit.configure(args)
+
+    # Authenticate using the service credentials and create the Compute Engine client
+    try:
+        service = get_compute(credentials_path)
+        logging.info("Built Compute Engine client with the service credentials.")
+    except Exception as e:
+        logging.error(f"Failed to build Compute Engine client: {e}")
+        raise
+
     try:
-        logging.info("Starting the process to create VM-2.")
-        create_vm2(service, project, zone, 'vm2-instance')
+        logging.info(f"Starting the process to create VM-2, {seconds_since_boot():.1f} seconds after boot.")
+        source = {'source_image': family_image(project), 'startup_script': SERVE_SCRIPT} if args.image else {}
+        if args.children:
+            fan_out(service, project, zone, FanoutSpec(args.children, args.prefix, args.depth, args.image),
+                    **source)
+        elif args.zones:
+            place_vm2s(service, project, args.zones.split(','), args.count, **source)
+        elif args.count > 1:
+            create_vm2s(service, project, zone, args.count, **source)
+        else:
+            create_vm2(service, project, zone, 'vm2-instance', **source)
     except Exception as e:
         logging.error(f"Error occurred in vm1-launch-vm2-code.py: {e}")
         raise
+    logging.info(ratelimit.limiter().report())
+    logging.info(cold_start_report())
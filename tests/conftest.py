@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The scripts import the shared code as the top-level `common` package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
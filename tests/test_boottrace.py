@@ -0,0 +1,19 @@
+from common.boottrace import BootCollector, parse_markers
+
+
+def test_parse_markers_keeps_the_latest_boot():
+    text = ('boot noise\nBOOT-PHASE init-db 100.5\nBOOT-PHASE start 101\n'
+            'reboot\nBOOT-PHASE init-db 200.25\nBOOT-PHASE serving 203\n')
+    assert parse_markers(text) == {'init-db': 200.25, 'start': 101.0, 'serving': 203.0}
+
+
+def test_waterfall_adds_provision_and_boot_from_the_api_timestamps():
+    collector = BootCollector(None, 'p', 'z', ['vm-1', 'vm-2'])
+    collector.markers = {'vm-1': {'init-db': 1000.0, 'start': 1004.0, 'serving': 1010.0},
+                         'vm-2': {'serving': 1000.0}}
+    collector.instances = {'vm-1': {'creationTimestamp': '1970-01-01T00:16:30+00:00',     # 990
+                                    'lastStartTimestamp': '1970-01-01T00:16:35+00:00'}}   # 995
+    rows = collector.waterfall()
+    assert rows == {'vm-1': [('provision', 0.0, 5.0), ('boot', 5.0, 5.0),
+                             ('init-db', 10.0, 4.0), ('start', 14.0, 6.0)]}
+    assert collector.report()[1].startswith('vm-1 |')
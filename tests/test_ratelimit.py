@@ -0,0 +1,69 @@
+import pytest
+
+from common import fleet, ratelimit
+from common.fake_compute import FakeCompute, http_error
+
+
+@pytest.fixture(autouse=True)
+def unlimited():
+    yield
+    ratelimit.enable(0, 0)
+
+
+def test_classify_puts_operation_polls_in_the_lowest_lane():
+    assert ratelimit.classify('compute.instances.get') == ('read', ratelimit.NORMAL)
+    assert ratelimit.classify('compute.zoneOperations.get') == ('read', ratelimit.POLL)
+    assert ratelimit.classify('compute.instances.insert') == ('mutate', ratelimit.NORMAL)
+
+
+def test_lower_lane_waits_while_a_higher_lane_is_queued():
+    bucket = ratelimit.TokenBucket('read', 10)
+    bucket.waiting[ratelimit.NORMAL] += 1
+    assert bucket._take(ratelimit.POLL, 1) > 0
+    assert bucket._take(ratelimit.URGENT, 1) == 0
+
+
+def test_cost_above_capacity_goes_through_once_and_leaves_debt():
+    bucket = ratelimit.TokenBucket('read', 10)
+    assert bucket._take(ratelimit.NORMAL, 50) == 0
+    assert bucket.tokens < 0
+    assert bucket._take(ratelimit.NORMAL, 1) > 0
+
+
+def test_backoff_halves_the_rate_down_to_the_floor_and_recover_restores_it():
+    bucket = ratelimit.TokenBucket('mutate', 20)
+    bucket.backoff(pause=5)
+    assert bucket.rate == 10
+    assert bucket._take(ratelimit.NORMAL, 1) > 4
+    for _ in range(20):
+        bucket.backoff()
+    assert bucket.rate == 20 * ratelimit.MIN_RATE
+    assert bucket.metrics()['min_rate'] == 20 * ratelimit.MIN_RATE
+    for _ in range(100):
+        bucket.recover()
+    assert bucket.rate == 20
+
+
+def test_call_retries_a_rate_limited_call():
+    limiter = ratelimit.RateLimiter(1000, 1000)
+    answers = [http_error(429, 'rateLimitExceeded', headers={'retry-after': '0'}), 'ok']
+
+    def execute():
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    assert limiter.call('compute.instances.get', execute) == 'ok'
+    assert limiter.buckets['read'].rate_limited == 1
+
+
+def test_batches_are_not_shrunk_to_the_tokens_available():
+    ratelimit.enable(20, 20)
+    fake = FakeCompute()
+    names = [f'vm-{i}' for i in range(1, 121)]
+    for name in names:
+        fake.add_instance('p', 'z', name)
+    instances = fleet.get_instances(fake, 'p', 'z', names)
+    assert fake.round_trips == 1
+    assert not any(isinstance(instance, Exception) for instance in instances.values())
@@ -0,0 +1,20 @@
+import pytest
+
+from common.spec import bulk_insert, name_pattern_capacity, name_pattern_for, name_pattern_regex
+
+
+def test_name_pattern_regex_matches_the_generated_names():
+    pattern = name_pattern_regex('flask-clone-###')
+    assert pattern.match('flask-clone-001')
+    assert pattern.match('flask-clone-1000')
+    assert not pattern.match('flask-clone-01')
+    assert not pattern.match('flask-clone-001-old')
+    assert not name_pattern_regex('a.b-##').match('axb-01')
+
+
+def test_name_patterns_are_sized_to_the_count():
+    assert name_pattern_for('vm2-instance', 5) == 'vm2-instance-##'
+    assert name_pattern_for('vm2-instance', 150) == 'vm2-instance-###'
+    assert name_pattern_capacity('vm2-instance-##') == 99
+    with pytest.raises(ValueError):
+        bulk_insert(None, 'p', 'z', 100, name_pattern='vm2-instance-##')
@@ -0,0 +1,64 @@
+import pytest
+
+from common.fake_compute import FakeCompute
+from common.spec import InstanceSpec
+from common.state import StateStore, instance_resource, reconcile, snapshot_resource
+
+PROJECT = 'test-project'
+ZONE = 'us-west1-b'
+SPEC = InstanceSpec()
+
+
+@pytest.fixture
+def fake():
+    fake = FakeCompute(latency=0.05)
+    fake.add_instance(PROJECT, ZONE, 'base')
+    calls = []
+    call = fake.call
+
+    def recording(method, kwargs, round_trip=True):
+        calls.append(method)
+        return call(method, kwargs, round_trip)
+
+    fake.call = recording
+    fake.recorded = calls
+    return fake
+
+
+@pytest.fixture
+def store():
+    store = StateStore(':memory:')
+    yield store
+    store.close()
+
+
+def fleet(count):
+    return [snapshot_resource(ZONE, 'base', 'snap')] + [
+        instance_resource(ZONE, SPEC.body(f'clone-{i}', ZONE)) for i in range(1, count + 1)]
+
+
+def mutations(fake):
+    return [method for method in fake.recorded if method.split('.')[1] in ('insert', 'delete', 'createSnapshot')]
+
+
+def test_creates_in_order_and_an_unchanged_rerun_creates_nothing(fake, store):
+    result = reconcile(fake, PROJECT, store, 'f', fleet(2), log=lambda *_: None)
+    assert sorted(result['created']) == ['clone-1', 'clone-2', 'snap']
+    assert mutations(fake) == ['disks.createSnapshot', 'instances.insert', 'instances.insert']
+
+    fake.recorded.clear()
+    result = reconcile(fake, PROJECT, store, 'f', fleet(2), log=lambda *_: None)
+    assert result['created'] == {}
+    assert sorted(result['unchanged']) == ['clone-1', 'clone-2', 'snap']
+    assert mutations(fake) == []
+
+
+def test_deletes_only_what_it_created_in_reverse_order(fake, store):
+    fake.add_instance(PROJECT, ZONE, 'clone-9')     # not created by the fleet
+    reconcile(fake, PROJECT, store, 'f', fleet(2), log=lambda *_: None)
+    fake.recorded.clear()
+
+    result = reconcile(fake, PROJECT, store, 'f', [], log=lambda *_: None)
+    assert sorted(result['deleted']) == ['clone-1', 'clone-2', 'snap']
+    assert mutations(fake) == ['instances.delete', 'instances.delete', 'snapshots.delete']
+    assert (PROJECT, ZONE, 'clone-9') in fake._resources['instances']
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta, timezone
+
+from common.fake_compute import FakeCompute
+from common.teardown import TTL, Leftover, Teardown
+
+PROJECT = 'test-project'
+ZONE = 'us-west1-b'
+
+
+def test_matches_default_patterns_in_full_and_labels():
+    cleaner = Teardown(None, PROJECT, labels=('warm-pool', 'team=web'))
+    assert cleaner._matches('instances', {'name': 'flask-clone-12'})
+    assert cleaner._matches('instances', {'name': 'vm2-instance-003'})
+    assert not cleaner._matches('instances', {'name': 'flask-clone-12-keep'})
+    assert not cleaner._matches('firewalls', {'name': 'allow-5000-extra'})
+    assert cleaner._matches('instances', {'name': 'other', 'labels': {'warm-pool': 'flask'}})
+    assert cleaner._matches('instances', {'name': 'other', 'labels': {'team': 'web'}})
+    assert not cleaner._matches('instances', {'name': 'other', 'labels': {'team': 'db'}})
+
+
+def test_orphans_are_the_leftovers_older_than_the_ttl_oldest_first():
+    now = 1_000_000.0
+    cleaner = Teardown(None, PROJECT)
+    cleaner.found = [Leftover('instances', ZONE, 'young', now - 60),
+                     Leftover('snapshots', 'global', 'old', now - 2 * TTL),
+                     Leftover('instances', ZONE, 'older', now - 3 * TTL)]
+    assert [o.name for o in cleaner.orphans(now=now)] == ['older', 'old']
+    assert [o.name for o in cleaner.orphans(ttl=30, now=now)] == ['older', 'old', 'young']
+
+
+def test_find_and_delete_against_the_fake():
+    fake = FakeCompute(latency=0.05)
+    old = (datetime.now(timezone.utc) - timedelta(seconds=2 * TTL)).isoformat()
+    fake.add_instance(PROJECT, ZONE, 'flask-clone-1', creationTimestamp=old)
+    fake.add_instance(PROJECT, ZONE, 'flask-clone-2')
+    fake.add_instance(PROJECT, ZONE, 'database')
+    cleaner = Teardown(fake, PROJECT, log=lambda *_: None)
+    assert sorted(leftover.name for leftover in cleaner.find()) == ['flask-clone-1', 'flask-clone-2']
+    assert [o.name for o in cleaner.orphans()] == ['flask-clone-1']
+
+    results = cleaner.delete()
+    assert sorted(results['instances']['deleted']) == ['flask-clone-1', 'flask-clone-2']
+    assert [name for (_, _, name) in fake._resources['instances']] == ['database']